@@ -0,0 +1,271 @@
+"""
+Benchmark the stages of the indexer on synthetic link lives datasets, see
+``synthetic.py``, at several scales.
+
+Each stage is run in a fresh process, so that the peak resident set size of
+a stage is not inflated by the stages before it. The bulk requests are sent
+to a local stand-in for the Elasticsearch bulk endpoint, running in its own
+process, which accepts every action, so the benchmark runs offline and
+measures the indexer rather than a cluster.
+
+The stages are cumulative pipelines, each including the stages before it:
+
+ * load maps: read the life courses and links into the join indices
+ * build actions: read the census data and build the bulk actions
+ * serialize: encode the bulk actions and discard them, with a NullSink
+ * bulk: send the bulk actions to the stand-in bulk endpoint, with an
+   ElasticsearchSink
+ * index update, index assemble: a full ``csv_index`` run in each build mode
+
+The time of a stage is reported both in total and without the time of the
+stage before it in the pipeline.
+"""
+import json
+import multiprocessing
+import sys
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import index
+from synthetic import generate_dataset
+
+
+# The default scales of the benchmark, in person appearances per source
+BENCHMARK_SCALES = (2000, 10000, 50000)
+BENCHMARK_STAGES = ('load maps', 'build actions', 'serialize', 'bulk', 'index update', 'index assemble')
+# The stage each stage builds on, whose time is subtracted from its own
+BENCHMARK_PREVIOUS_STAGES = {'build actions': 'load maps', 'serialize': 'build actions', 'bulk': 'serialize'}
+# The relative increase of time or peak RSS over the baseline that is
+# reported as a regression
+REGRESSION_TOLERANCE = 0.25
+
+
+class StubBulkHandler(BaseHTTPRequestHandler):
+    """
+    A stand-in for the Elasticsearch bulk endpoint, which accepts every
+    action of a bulk request and responds to any other request with an empty
+    acknowledgement.
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def respond(self, response):
+        body = json.dumps(response).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('X-Elastic-Product', 'Elasticsearch')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.respond({'version': {'number': '7.17.0', 'build_flavor': 'default'}, 'tagline': 'You Know, for Search'})
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if not self.path.split('?')[0].endswith('/_bulk'):
+            self.respond({'acknowledged': True})
+            return
+
+        items = []
+        lines = iter(line for line in body.split(b'\n') if line)
+        for line in lines:
+            (op_type, meta) = next(iter(json.loads(line).items()))
+            items.append({op_type: {'_index': meta.get('_index'), '_id': meta.get('_id'), 'status': 200}})
+            if op_type != 'delete':
+                next(lines, None)
+        self.respond({'took': 1, 'errors': False, 'items': items})
+
+    do_PUT = do_POST
+
+
+def serve_bulk_endpoint(ports):
+    """
+    Serve the stand-in bulk endpoint on a free local port, which is put on
+    the ``ports`` queue.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubBulkHandler)
+    ports.put(server.server_address[1])
+    server.serve_forever()
+
+
+def load_maps(csv_dir):
+    """
+    Load the sources, and the life courses and links into compact join
+    indices.
+
+    Returns:
+        A tuple of the sources, the person appearance to life courses join
+        index and the person appearance to links join index.
+    """
+    sources = index.csv_load_sources(csv_dir)
+    pa_life_courses = index.new_join_index('compact')
+    pa_links = index.new_join_index('compact')
+    deque(index.csv_read_life_courses(csv_dir, pa_life_courses), maxlen=0)
+    deque(index.csv_read_links(csv_dir, sources, pa_links), maxlen=0)
+    pa_life_courses.freeze()
+    pa_links.freeze()
+    return (sources, pa_life_courses, pa_links)
+
+
+def build_actions(csv_dir, profile='full'):
+    (sources, pa_life_courses, pa_links) = load_maps(csv_dir)
+    return index.csv_pas_bulk_actions(index.csv_census_pas(sources, csv_dir, pa_life_courses, pa_links, profile=profile), profile)
+
+
+def run_stage(stage, csv_dir, url, profile='full'):
+    """
+    Run a stage of the benchmark, see the module docstring, with the person
+    appearances of the links and life courses of one of index.PA_PROFILES.
+
+    Returns:
+        A dictionary with the seconds the stage took, the peak RSS of the
+        process in MB, the number of items the stage produced and, for the
+        serialize stage, the MB of the encoded bulk actions.
+    """
+    csv_dir = Path(csv_dir)
+    for alias in index.ALIAS_INDEX_MAPPING:
+        index.ALIAS_INDEX_MAPPING[alias] = f'{alias}_benchmark'
+
+    start = time.perf_counter()
+    megabytes = None
+    if stage == 'load maps':
+        (_, pa_life_courses, pa_links) = load_maps(csv_dir)
+        items = len(pa_life_courses) + len(pa_links)
+    elif stage == 'build actions':
+        items = sum(1 for _ in build_actions(csv_dir, profile))
+    elif stage == 'serialize':
+        sink = index.NullSink()
+        items = sum(1 for _ in sink.send(build_actions(csv_dir, profile)))
+        megabytes = sink.bytes / 2**20
+    elif stage == 'bulk':
+        items = sum(1 for _ in index.ElasticsearchSink(index.Elasticsearch(hosts=[url])).send(build_actions(csv_dir, profile)))
+    elif stage in ('index update', 'index assemble'):
+        index.csv_index(index.ElasticsearchSink(index.Elasticsearch(hosts=[url])), csv_dir, build_mode=stage.split()[1], profile=profile)
+        items = None
+    else:
+        raise Exception(f'Unknown benchmark stage {stage}')
+
+    return {'seconds': time.perf_counter() - start, 'peak_rss_mb': index.peak_rss_mb(), 'items': items, 'megabytes': megabytes}
+
+
+def run_benchmark(scales=BENCHMARK_SCALES, stages=BENCHMARK_STAGES, data_dir=None, seed=0, profile='full'):
+    """
+    Generate a synthetic dataset for each scale and run the stages of the
+    benchmark on it.
+
+    Args:
+        scales: The numbers of person appearances per source of the datasets
+        stages: The stages to run, a subset of BENCHMARK_STAGES
+        data_dir: The directory the datasets are generated in, or reused
+                  from if already there. A temporary directory is used if
+                  not given.
+        seed: The seed of the synthetic datasets
+        profile: The profile of the links and life courses, one of
+                 index.PA_PROFILES
+
+    Returns:
+        A list of result dictionaries, with the scale, the stage, the
+        profile, the seconds and the stage seconds it took, the peak RSS in
+        MB, the number of items it produced and the MB of bulk actions.
+    """
+    context = multiprocessing.get_context('spawn')
+    ports = context.Queue()
+    server = context.Process(target=serve_bulk_endpoint, args=(ports,), daemon=True)
+    server.start()
+    url = f'http://127.0.0.1:{ports.get()}'
+
+    data_dir = Path(data_dir or tempfile.mkdtemp(prefix='indexer-benchmark-'))
+    results = []
+    try:
+        for scale in scales:
+            csv_dir = data_dir / f'synthetic-{scale}-{seed}'
+            if not (csv_dir / 'sources.csv').exists():
+                print(f' => Generating a dataset of {scale} person appearances per source in {csv_dir}')
+                generate_dataset(csv_dir, pas_per_source=scale, seed=seed)
+
+            seconds = {}
+            for stage in stages:
+                print(f' => Benchmarking {stage} at scale {scale} with the {profile} profile')
+                with ProcessPoolExecutor(1, mp_context=context) as executor:
+                    result = executor.submit(run_stage, stage, str(csv_dir), url, profile).result()
+                seconds[stage] = result['seconds']
+                previous = BENCHMARK_PREVIOUS_STAGES.get(stage)
+                result.update(scale=scale, stage=stage, profile=profile,
+                              stage_seconds=result['seconds'] - seconds[previous] if previous in seconds else result['seconds'])
+                print(f' => -> {result["seconds"]:.2f} s ({result["stage_seconds"]:.2f} s in stage), peak RSS {result["peak_rss_mb"]:.0f} MB')
+                results.append(result)
+    finally:
+        server.terminate()
+
+    return results
+
+
+def compare_results(results, baseline, tolerance=REGRESSION_TOLERANCE):
+    """
+    Compare benchmark results to the results of a baseline run.
+
+    Args:
+        results: A list of result dictionaries, see ``run_benchmark``
+        baseline: A list of result dictionaries of the baseline
+        tolerance: The relative increase of the stage seconds or the peak RSS
+                   that is reported as a regression
+
+    Returns:
+        A list of messages describing the regressions, empty if there are
+        none. Results without a baseline result of the same scale, stage and
+        profile are not compared.
+    """
+    baseline = {(result['scale'], result['stage'], result.get('profile', 'full')): result for result in baseline}
+    regressions = []
+    for result in results:
+        base = baseline.get((result['scale'], result['stage'], result.get('profile', 'full')))
+        if base is None:
+            continue
+        for key in ('stage_seconds', 'peak_rss_mb'):
+            if result[key] > base[key] * (1 + tolerance):
+                regressions.append(f'{result["stage"]} at scale {result["scale"]}: {key} {result[key]:.2f} > {base[key]:.2f} in the baseline')
+    return regressions
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark the indexer on synthetic link lives datasets')
+    parser.add_argument('--scales', type=lambda s: [int(scale) for scale in s.split(',')], default=list(BENCHMARK_SCALES), help='Comma separated numbers of person appearances per source')
+    parser.add_argument('--stages', type=lambda s: s.split(','), default=list(BENCHMARK_STAGES), help='Comma separated stages to run')
+    parser.add_argument('--data-dir', type=lambda p: Path(p).resolve(), default=None, help='Directory the synthetic datasets are generated in and reused from')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--profile', choices=index.PA_PROFILES, default='full', help='The profile of the person appearances embedded in the links and life courses')
+    parser.add_argument('--output', type=lambda p: Path(p).resolve(), default=None, help='Path of the JSON file the results are written to')
+    parser.add_argument('--baseline', type=lambda p: Path(p).resolve(), default=None, help='Path of the JSON results of a baseline run to compare to')
+    parser.add_argument('--tolerance', type=float, default=REGRESSION_TOLERANCE)
+    args = parser.parse_args()
+
+    for stage in args.stages:
+        if stage not in BENCHMARK_STAGES:
+            parser.error(f'unknown stage {stage}, expected one of {", ".join(BENCHMARK_STAGES)}')
+
+    results = run_benchmark(args.scales, args.stages, args.data_dir, args.seed, args.profile)
+
+    if args.output is not None:
+        with args.output.open('w') as f:
+            json.dump(results, f, indent=2)
+        print(f' => Wrote results to {args.output}')
+
+    if args.baseline is not None:
+        with args.baseline.open() as f:
+            regressions = compare_results(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f' => Regression: {regression}')
+        if regressions:
+            sys.exit(1)
+        print(f' => No regressions compared to {args.baseline}')
@@ -1,7 +1,33 @@
 import sqlite3
-from elasticsearch import Elasticsearch
+import asyncio
+import gc
+import gzip
+import hashlib
+import io
+import mmap
+import os
+import shutil
+import tempfile
+import itertools
+import functools
+from itertools import groupby
+from collections import deque, namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing
+from array import array
+import sys
+import time
+import random
+import threading
+import resource
+from contextlib import contextmanager
+import orjson
+import numpy as np
+import pyarrow
+import pyarrow.compute
+import pyarrow.parquet as parquet
+from elasticsearch import AsyncElasticsearch, Elasticsearch
 from elasticsearch.helpers import bulk
-from elasticsearch.helpers import parallel_bulk
 from elasticsearch.exceptions import RequestError
 from math import ceil
 from pathlib import Path
@@ -9,7 +35,46 @@ from datetime import datetime
 import csv
 
 
-CHUNK_SIZE = 3000
+# Bulk requests start at BULK_START_BYTES and are resized between
+# BULK_MIN_BYTES and BULK_MAX_BYTES to keep their latency near
+# BULK_TARGET_SECONDS
+BULK_START_BYTES = 5 * 2**20
+BULK_MIN_BYTES = 512 * 2**10
+BULK_MAX_BYTES = 20 * 2**20
+BULK_TARGET_SECONDS = 2.0
+BULK_THREADS = 4
+BULK_MAX_RETRIES = 8
+BULK_BACKOFF_SECONDS = 1.0
+BULK_MAX_BACKOFF_SECONDS = 60.0
+BULK_RETRY_STATUSES = (429, 503)
+BULK_PIPELINES = ("threads", "asyncio")
+# The number of batches of bulk actions that are built ahead of the bulk
+# requests of the asyncio pipeline
+BULK_QUEUE_BATCHES = 8
+BUILD_MODES = ("update", "assemble")
+JOIN_INDEX_TYPES = ("dict", "compact", "disk")
+SQLITE_BATCH_SIZE = 100000
+SQLITE_CACHE_KIB = 65536
+LOOKUP_BATCH_SIZE = 500
+# The number of rows of the blocks person appearances are converted in, see
+# PersonAppearanceBatchConverter
+PA_BATCH_ROWS = 8192
+RANGE_BYTES = 8 * 2**20
+READ_BLOCK_BYTES = 2**20
+FAST_CSV_MODES = ("auto", "always", "never")
+DELTA_TARGETS = ("live", "clone")
+CHECKPOINT_FILE = "checkpoint.json"
+METRICS_INTERVAL_SECONDS = 10
+BULK_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SINK_TYPES = ("elasticsearch", "ndjson", "null")
+# Bulk files are rotated once they hold BULK_FILE_BYTES of uncompressed
+# NDJSON. Each call of a sink writes a new group of files, and the groups are
+# replayed in order.
+BULK_FILE_BYTES = 256 * 2**20
+BULK_FILE_PATTERN = "bulk-{group:05d}-{part:05d}.ndjson.gz"
+# Appends a person appearance to a link or life course once, so that the
+# updates of a resumed run can be replayed
+PA_APPEND_SCRIPT = "if (ctx._source.person_appearance.stream().anyMatch(p -> p.id == params.pa.id)) { ctx.op = 'noop' } else { ctx._source.person_appearance.add(params.pa) }"
 PA_IGNORE_KEYS = ["life_course_id", "link_id", "method_id", "score"]
 ALIAS_INDEX_MAPPING = {
     "sources": None,
@@ -18,10 +83,142 @@ ALIAS_INDEX_MAPPING = {
     "lifecourses": None
 }
 INDEX_SETTINGS = {
-    "index.refresh_interval": -1,
     "index.max_result_window": 100,
     "index.max_inner_result_window": 100
 }
+# The number of bytes of CSV input an index is built from per primary
+# shard, see index_shard_counts
+SHARD_INPUT_BYTES = 10 * 2**30
+# The source id of the keys of the join index of links to life courses,
+# which is keyed by (link_id, LINK_KEY_SOURCE)
+LINK_KEY_SOURCE = 0
+# Settings of the indices while they are built, which are replaced by
+# PRODUCTION_SETTINGS before the aliases are swapped to them
+BUILD_SETTINGS = {
+    "index.number_of_replicas": 0,
+    "index.refresh_interval": -1,
+    "index.translog.durability": "async"
+}
+PRODUCTION_SETTINGS = {
+    "index.refresh_interval": None,
+    "index.translog.durability": "request"
+}
+FORCE_MERGE_SEGMENTS = 1
+BUILD_TIMESTAMP_FORMAT = "%d-%m-%Y_%H-%M-%S"
+KEEP_BUILDS = 2
+BUILD_TIMEOUT_SECONDS = 3600
+# The index of the completion markers of the partitions of partitioned
+# builds, and the number of seconds between checks for them
+PARTITION_INDEX = "indexer_partitions"
+PARTITION_POLL_SECONDS = 10
+# The number of times each query of a comparison of the mapping profiles is
+# run, of which the median latency is reported
+COMPARE_QUERY_REPEAT = 20
+# The CSV files that are cached as typed columnar files, by the prefix of
+# their names, see columnar_cache
+COLUMNAR_FILE_PREFIXES = ("sources", "links", "life_courses", "census", "cph_burials")
+# The number of rows of each row group of the columnar cache files. The
+# census files are read from the cache in ranges of one row group.
+COLUMNAR_ROW_GROUP_ROWS = 16384
+# The version of the columnar cache files, files of another version are
+# converted again
+COLUMNAR_CACHE_VERSION = 1
+
+
+def encode_document(document):
+    """
+    Encode a document as JSON.
+
+    Documents are encoded once, and the encoded string is spliced into the
+    bodies of all bulk actions that need it.
+
+    Args:
+        document: A JSON-serializable object
+
+    Returns:
+        A string containing the JSON encoding of ``document``.
+    """
+    return orjson.dumps(document).decode('utf-8')
+
+
+# The body of the scripted update appending a person appearance, see
+# PA_APPEND_SCRIPT, is encoded once around the place of the encoded pa
+PA_APPEND_PREFIX = '{"script":' + encode_document({'source': PA_APPEND_SCRIPT, 'lang': 'painless'})[:-1] + ',"params":{"pa":'
+PA_APPEND_SUFFIX = '}}}'
+
+
+# A person appearance document together with its JSON encoding, and the
+# JSON encoding of the copy embedded in links and life courses
+EncodedPa = namedtuple('EncodedPa', ['id', 'source_id', 'pa_id', 'json', 'embedded'])
+
+
+def encode_pa(document, profile='full'):
+    """
+    Encode a person appearance document.
+
+    Args:
+        document: A person appearance document, or an EncodedPa which is
+                  returned as is
+        profile: One of PA_PROFILES, the fields of the copy of the document
+                 that is embedded in links and life courses
+
+    Returns:
+        An EncodedPa.
+    """
+    if isinstance(document, EncodedPa):
+        return document
+    json = encode_document(document)
+    keys = PA_PROFILE_KEYS[profile]
+    embedded = json if keys is None else encode_document({key: document[key] for key in keys if key in document})
+    return EncodedPa(document['id'], document['source_id'], document['pa_id'], json, embedded)
+
+
+def expand_bulk_action(action, indices=None):
+    """
+    Expand a bulk action into the action line and the body of a bulk request.
+
+    The '_source' of the actions generated by the indexer is the JSON-encoded
+    body of the action, so that it is passed on as is, instead of being
+    encoded again.
+
+    Args:
+        action: A dictionary with '_op_type', '_index', '_id' and, unless the
+                action is a 'delete', '_source', and optionally '_routing'
+        indices: A dictionary mapping the '_index' of the action, which is
+                 one of the aliases of ALIAS_INDEX_MAPPING, to the name of the
+                 index it is sent to. The '_index' is used as is if not given.
+
+    Returns:
+        A tuple of the action line and the encoded body, which is None for
+        'delete' actions.
+    """
+    index = action['_index'] if indices is None else indices[action['_index']]
+    meta = {'_index': index, '_id': action['_id']}
+    if action.get('_routing') is not None:
+        meta['routing'] = action['_routing']
+    return {action['_op_type']: meta}, action.get('_source')
+
+
+def bulk_action_lines(actions, indices=None):
+    """
+    Encode bulk actions into the lines of a bulk request.
+
+    Args:
+        actions: An iterable of bulk actions, see ``expand_bulk_action``
+        indices: A dictionary mapping the '_index' of the actions to the names
+                 of the indices they are sent to, if any
+
+    Yields:
+        A tuple of the action line and the body, if any, of each action, and
+        the checkpoint actions as they are.
+    """
+    for action in actions:
+        if action['_op_type'] == 'checkpoint':
+            yield action
+            continue
+        (action_line, body) = expand_bulk_action(action, indices)
+        METRICS.count('indexer_documents_built_total')
+        yield (encode_document(action_line),) if body is None else (encode_document(action_line), body)
 
 
 def index_pa(pa):
@@ -79,118 +276,226 @@ def index_life_course(life_course_id, pas):
     es.index(index='lifecourses', id=life_course_id, body=doc)
 
 
-def mapping_pa_properties():
+def split_list(value):
+    return value.split(',')
+
+
+# A field of the person appearance documents: its name, its Elasticsearch
+# mapping type, the type of its values, one of PA_VALUE_CASTS, and a
+# description of it
+PaField = namedtuple('PaField', ['name', 'mapping', 'value', 'description'])
+
+# The functions converting the string values of the fields of each value
+# type, where 'string' values are used as is
+PA_VALUE_CASTS = {'string': None, 'integer': int, 'float': float, 'list': split_list}
+
+# The fields of the person appearance documents, in the order of the
+# documents. The mapping, the parsers and the serializers of person
+# appearances are generated from this schema.
+PA_SCHEMA = (
+    PaField('id', 'keyword', 'string', 'unique id of the person appearance, source_id-pa_id'),
+    PaField('pa_id', 'integer', 'integer', 'person appearance id, unique within a source'),
+    PaField('source_id', 'integer', 'integer', 'id of the source in which the person appearance occurs'),
+
+    PaField('gender', 'text', 'string', 'Gender as transcribed'),
+    PaField('gender_clean', 'text', 'string', 'Gender after removing unwanted characters'),
+    PaField('gender_std', 'keyword', 'string', 'Standardized gender. A result of predicting the gender based on the name (also for records not originally coming with a gender)'),
+    PaField('age', 'text', 'string', 'Age as transcribed'),
+    PaField('age_clean', 'float', 'float', 'age after cleaning and converting to floats'),
+    PaField('name', 'text', 'string', 'Name as transcribed'),
+    PaField('name_clean', 'text', 'string', 'lowercase Name after removing unwanted characters'),
+    PaField('name_std', 'text', 'string', 'standardized full name'),
+    PaField('first_names', 'text', 'list', 'standardized names classified as first names'),
+    PaField('family_names', 'text', 'list', 'standardized names classified as family names'),
+    PaField('patronyms', 'text', 'list', 'standardized names classified as patronyms'),
+    PaField('uncat_names', 'text', 'list', 'unclassified standardized names'),
+    PaField('maiden_family_names', 'text', 'list', 'standardized names classified as maiden family names'),
+    PaField('maiden_patronyms', 'text', 'list', 'standardized names classified as maiden patronyms'),
+    PaField('all_possible_family_names', 'text', 'list', 'all possible  family names (standardized names). Includes constructed names based on husband/father names'),
+    PaField('all_possible_patronyms', 'text', 'list', 'all possible  patronyms (standardized names). Includes constructed names based on husband/father names'),
+    PaField('marital_status', 'text', 'string', 'marital status as transcribed'),
+    PaField('marital_status_clean', 'text', 'string', 'marital status after removing unwanted characters'),
+    PaField('marital_status_std', 'keyword', 'string', 'standardized marital status'),
+    PaField('household_position', 'text', 'string', 'household position as transcribed'),
+    PaField('household_position_std', 'keyword', 'string', 'standiardized household position'),
+    PaField('household_family_no', 'text', 'string', 'household family number as transcribed. Should uniquely label the households. It is far from doing so.'),
+    PaField('hh_id', 'integer', 'integer', 'household id. Improved household identification. Uses multiple variables get a better separation of households.'),
+    PaField('occupation', 'text', 'string', 'occupation as transcribed. Note: for some censuses the household positions are put here.'),
+    PaField('place_name', 'text', 'string', 'place_name as transcribed.'),
+    PaField('land_register_address', 'text', 'string', 'land_register_address  as transcribed.'),
+    PaField('land_register', 'text', 'string', 'land_register  as transcribed.'),
+    PaField('address', 'text', 'string', 'address  as transcribed. Note: this rarely contains a full addresss'),
+    PaField('full_address', 'text', 'string', 'a concatenation of: place_name, land_register_address, land_register, and address'),
+    PaField('parish', 'text', 'string', 'parish or street where the source was originally created'),
+    PaField('parish_type', 'keyword', 'string', 'the type of parish, i.e. parish, street etc.'),
+    PaField('district', 'text', 'string', 'district where the source was originally created'),
+    PaField('county', 'text', 'string', 'county where the source was originally created'),
+    PaField('state_region', 'text', 'string', 'state_region (danmark, grønland, færøerne, etc.) where the source was originally created'),
+    PaField('transcription_code', 'text', 'string', 'unique batch code of the transcription unit'),
+    PaField('transcription_id', 'integer', 'integer', 'unique record number within the transcription unit'),
+    PaField('birth_place', 'text', 'string', 'birth place as transcribed (note: only available from 1845 and forth)'),
+    PaField('birth_place_clean', 'text', 'string', 'birth_place after removing unwanted characters'),
+    PaField('birth_place_parish', 'text', 'string', 'birth place classified as a parish'),
+    PaField('birth_place_district', 'text', 'string', 'birth place classified as a district'),
+    PaField('birth_place_county', 'text', 'string', 'birth place classified as a county'),
+    PaField('birth_place_koebstad', 'text', 'string', 'birth place classified as a koebstad'),
+    PaField('birth_place_town', 'text', 'string', 'birth place classified as a town'),
+    PaField('birth_place_place', 'text', 'string', 'birth place classified as a place'),
+    PaField('birth_place_island', 'text', 'string', 'birth place classified as a island'),
+    PaField('birth_place_other', 'text', 'string', 'birth place classified as a other (e.g. a country)'),
+    PaField('birth_place_parish_std', 'text', 'string', 'standardized birth place parish'),
+    PaField('birth_place_county_std', 'text', 'string', 'standardized birth place county'),
+    PaField('birth_place_koebstad_std', 'text', 'string', 'standardized birth place koebstad'),
+    PaField('source_reference', 'text', 'string', 'A reference to the original source'),
+    PaField('transcriber_comments', 'text', 'string', 'comments by the transcriber'),
+    PaField('source_year', 'integer', 'integer', 'year of the event'),
+    PaField('event_type', 'text', 'string', 'type of event (e.g. census, burial, baptism, etc.)'),
+    PaField('role', 'text', 'string', 'the role of the record in the source (e.g. mother, father, child, deceased, bride, etc.)'),
+
+    # burials, whose values are passed on as transcribed, so that values
+    # that are not numbers are left for Elasticsearch to reject
+    PaField('dateOfBirth', 'text', 'string', 'date of birth'),
+    PaField('dateOfDeath', 'text', 'string', 'date of death'),
+    PaField('yearOfBirth', 'text', 'string', 'year of birth as transcribed'),
+    PaField('birth_year', 'text', 'string', 'year of birth'),
+    PaField('ageYears', 'integer', 'string', 'age in years'),
+    PaField('ageMonths', 'integer', 'string', 'age in months, in addition to the years'),
+    PaField('ageWeeks', 'integer', 'string', 'age in weeks, in addition to the months'),
+    PaField('ageDays', 'integer', 'string', 'age in days, in addition to the weeks'),
+    PaField('ageHours', 'integer', 'string', 'age in hours, in addition to the days'),
+    PaField('first_names_clean', 'text', 'string', 'first names after removing unwanted characters'),
+    PaField('lastname_clean', 'text', 'string', 'last name after removing unwanted characters'),
+    PaField('birthname_clean', 'text', 'string', 'birth name after removing unwanted characters'),
+    PaField('street', 'text', 'string', 'street of the address'),
+    PaField('street_number', 'integer', 'string', 'street number of the address'),
+    PaField('letter', 'text', 'string', 'letter of the street number'),
+    PaField('floor', 'text', 'string', 'floor of the address'),
+    PaField('positions', 'text', 'string', 'positions as transcribed'),
+    PaField('relationstypes', 'text', 'string', 'relations to other persons of the record'),
+
+    # special fields
+    PaField('first_names_sortable', 'keyword', 'string', 'sortable instance of first_names'),
+    PaField('family_names_sortable', 'keyword', 'string', 'sortable instance of family_names'),
+    PaField('last_updated', 'text', 'string', 'the date of the last update of the pa'),
+    PaField('pa_entry_permalink', 'text', 'string', 'the permalink to the entry of the pa')
+)
+PA_DOCUMENT_KEYS = tuple(field.name for field in PA_SCHEMA)
+# The fields that are derived from other values rather than read as is
+PA_DERIVED_KEYS = ('id', 'pa_id', 'source_id', 'first_names_sortable', 'family_names_sortable', 'last_updated', 'pa_entry_permalink')
+PA_LAST_UPDATED = "2020-11-16"
+
+# The denormalization profiles of the person appearances embedded in the
+# links and life courses, and the fields of PA_SCHEMA each embeds, or None
+# for all fields. The 'summary' profile embeds the fields that are searched
+# and displayed with a link or life course, and the 'reference' profile only
+# the ids, so that the details are read from the 'pas' index by 'id'.
+PA_PROFILES = ("full", "summary", "reference")
+PA_PROFILE_KEYS = {
+    'full': None,
+    'summary': (
+        'id', 'pa_id', 'source_id', 'gender_std', 'age_clean', 'name',
+        'name_clean', 'first_names', 'family_names', 'patronyms',
+        'all_possible_family_names', 'all_possible_patronyms',
+        'marital_status_std', 'household_position_std', 'occupation', 'parish',
+        'district', 'county', 'birth_place', 'birth_place_clean',
+        'birth_place_parish_std', 'birth_place_county_std', 'source_year',
+        'event_type', 'role', 'dateOfBirth', 'dateOfDeath', 'birth_year',
+        'first_names_sortable', 'family_names_sortable'
+    ),
+    'reference': ('id', 'pa_id', 'source_id')
+}
+
+# The mapping profiles of the person appearance fields. The 'standard'
+# profile maps each field as its type in PA_SCHEMA. The 'lean' profile keeps
+# the fields of PA_DISPLAY_KEYS in the _source only, indexes the text fields
+# that are not in PA_SCORED_KEYS without norms, frequencies and positions,
+# so they match but are neither scored nor phrase searched, and adds a
+# keyword subfield to the fields of PA_AGGREGATED_KEYS for sorting and
+# aggregations.
+MAPPING_PROFILES = ("standard", "lean")
+# The fields that are only displayed, never searched
+PA_DISPLAY_KEYS = ('land_register', 'source_reference', 'transcriber_comments', 'last_updated', 'pa_entry_permalink')
+# The text fields that are scored and searched for phrases
+PA_SCORED_KEYS = (
+    'name', 'name_clean', 'name_std', 'first_names', 'family_names',
+    'patronyms', 'uncat_names', 'maiden_family_names', 'maiden_patronyms',
+    'all_possible_family_names', 'all_possible_patronyms', 'occupation',
+    'full_address', 'birth_place', 'birth_place_clean', 'first_names_clean',
+    'lastname_clean', 'birthname_clean'
+)
+# The text fields that are sorted or aggregated on
+PA_AGGREGATED_KEYS = ('parish', 'district', 'county', 'birth_place_parish_std', 'birth_place_county_std', 'event_type', 'role')
+
+
+def mapping_pa_field(field, mapping_profile='standard'):
     """
-    Returns the Elasticsearch mappings for person appearance objects.
+    Returns the Elasticsearch mapping of a PaField in one of
+    MAPPING_PROFILES.
     """
-    return {
-        'id': {'type': 'keyword'},
-        'pa_id': {'type': 'integer'},
-        'source_id': {'type': 'integer'},
-
-        'gender': {'type': 'text' }, # Gender as transcribed
-        'gender_clean': {'type': 'text' }, # Gender after removing unwanted characters
-        'gender_std': {'type': 'keyword' }, # Standardized gender. A result of predicting the gender based on the name (also for records not originally coming with a gender)
-        'age': {'type': 'text' }, # Age as transcribed
-        'age_clean': {'type': 'float' }, # age after cleaning and converting to floats
-        'name': {'type': 'text' }, # Name as transcribed
-        'name_clean': {'type': 'text' }, # lowercase Name after removing unwanted characters
-        'name_std': {'type': 'text' }, # standardized full name
-        'first_names': {'type': 'text' }, # standardized names classified as first names
-        'family_names': {'type': 'text' }, # standardized names classified as family names
-        'patronyms': {'type': 'text' }, # standardized names classified as patronyms
-        'uncat_names': {'type': 'text' }, # unclassified standardized names
-        'maiden_family_names': {'type': 'text' }, # standardized names classified as maiden family names
-        'maiden_patronyms': {'type': 'text' }, # standardized names classified as maiden patronyms
-        'all_possible_family_names': {'type': 'text' }, # all possible  family names (standardized names). Includes constructed names based on husband/father names
-        'all_possible_patronyms': {'type': 'text' }, # all possible  patronyms (standardized names). Includes constructed names based on husband/father names
-        'marital_status': {'type': 'text' }, # marital status as transcribed
-        'marital_status_clean': {'type': 'text' }, # marital status after removing unwanted characters
-        'marital_status_std': {'type': 'keyword' }, # standardized marital status
-        'household_position': {'type': 'text' }, # household position as transcribed
-        'household_position_std': {'type': 'keyword' }, # standiardized household position
-        'household_family_no': {'type': 'text' }, # household family number as transcribed. Should uniquely label the households. It is far from doing so.
-        'hh_id': {'type': 'integer' }, # household id. Improved household identification. Uses multiple variables get a better separation of households.
-        'occupation': {'type': 'text' }, # occupation as transcribed. Note: for some censuses the household positions are put here.
-        'place_name': {'type': 'text' }, # place_name as transcribed.
-        'land_register_address': {'type': 'text' }, # land_register_address  as transcribed.
-        'land_register': {'type': 'text' }, # land_register  as transcribed.
-        'address': {'type': 'text' }, # address  as transcribed. Note: this rarely contains a full addresss
-        'full_address': {'type': 'text' }, # a concatenation of: place_name, land_register_address, land_register, and address
-        'parish': {'type': 'text' }, # parish or street where the source was originally created
-        'parish_type': {'type': 'keyword' }, # the type of parish, i.e. parish, street etc.
-        'district': {'type': 'text' }, # district where the source was originally created
-        'county': {'type': 'text' }, # county where the source was originally created
-        'state_region': {'type': 'text' }, # state_region (danmark, grønland, færøerne, etc.) where the source was originally created
-        'transcription_code': {'type': 'text' }, # unique batch code of the transcription unit
-        'transcription_id': {'type': 'integer' }, # unique record number within the transcription unit
-        'birth_place': {'type': 'text' }, # birth place as transcribed (note: only available from 1845 and forth)
-        'birth_place_clean': {'type': 'text' }, # birth_place after removing unwanted characters
-        'birth_place_parish': {'type': 'text' }, # birth place classified as a parish
-        'birth_place_district': {'type': 'text' }, # birth place classified as a district
-        'birth_place_county': {'type': 'text' }, # birth place classified as a county
-        'birth_place_koebstad': {'type': 'text' }, # birth place classified as a koebstad
-        'birth_place_town': {'type': 'text' }, # birth place classified as a town
-        'birth_place_place': {'type': 'text' }, # birth place classified as a place
-        'birth_place_island': {'type': 'text' }, # birth place classified as a island
-        'birth_place_other': {'type': 'text' }, # birth place classified as a other (e.g. a country)
-        'birth_place_parish_std': {'type': 'text' }, # standardized birth place parish
-        'birth_place_county_std': {'type': 'text' }, # standardized birth place county
-        'birth_place_koebstad_std': {'type': 'text' }, # standardized birth place koebstad
-        'source_reference': {'type': 'text' }, # A reference to the original source
-        'transcriber_comments': {'type': 'text' }, # comments by the transcriber
-        'source_year': {'type': 'integer' }, # year of the event
-        'event_type': {'type': 'text' }, # type of event (e.g. census, burial, baptism, etc.)
-        'role': {'type': 'text' }, # the role of the record in the source (e.g. mother, father, child, deceased, bride, etc.)
-        'birth_year': {'type': 'integer'}, # year of birth,
-        
-        'dateOfBirth': {'type': 'text'},
-        'dateOfDeath': {'type': 'text'},
-        'yearOfBirth': {'type': 'text'},
-        'birth_year': {'type': 'text'},
-        'ageYears': {'type': 'integer'},
-        'ageMonths': {'type': 'integer'},
-        'ageWeeks': {'type': 'integer'},
-        'ageDays': {'type': 'integer'},
-        'ageHours': {'type': 'integer'},
-        'first_names_clean': {'type': 'text'},
-        'lastname_clean': {'type': 'text'},
-        'birthname_clean': {'type': 'text'},
-        'street': {'type': 'text'},
-        'street_number': {'type': 'integer'},
-        'letter': {'type': 'text'},
-        'floor': {'type': 'text'},
-        'positions': {'type': 'text'},
-        'relationstypes': {'type': 'text'},
-        
-        'first_names_sortable': {'type': 'keyword'}, # sortable instance of first_names,
-        'family_names_sortable': {'type': 'keyword'}, # sortable instance of family_names,
-        'last_updated': {'type': 'text'}, # the date of the last update of the pa
-        'pa_entry_permalink': {'type': 'text'} # the permalink to the entry of the pa
-    }
+    mapping = {'type': field.mapping}
+    if mapping_profile == 'standard':
+        return mapping
+
+    if field.name in PA_DISPLAY_KEYS:
+        mapping['index'] = False
+    elif field.mapping == 'text' and field.name not in PA_SCORED_KEYS:
+        mapping.update(norms=False, index_options='docs')
+    if field.name in PA_AGGREGATED_KEYS:
+        mapping['fields'] = {'keyword': {'type': 'keyword', 'ignore_above': 256}}
+    return mapping
 
-def mappings_index_lifecourses():
+
+def mapping_pa_properties(profile='full', mapping_profile='standard'):
+    """
+    Returns the Elasticsearch mappings for person appearance objects, see
+    PA_SCHEMA, with the fields of one of PA_PROFILES mapped in one of
+    MAPPING_PROFILES.
+    """
+    keys = PA_PROFILE_KEYS[profile]
+    return {field.name: mapping_pa_field(field, mapping_profile) for field in PA_SCHEMA if keys is None or field.name in keys}
+
+
+def pa_derived_fields(document, first_names, patronyms, id_cph):
+    """
+    Add the derived special fields to a person appearance document, from the
+    raw first_names, all_possible_patronyms and id_cph values, if any.
+    """
+    if first_names:
+        document['first_names_sortable'] = first_names.replace(',', ' ')
+    if patronyms:
+        document['family_names_sortable'] = patronyms.split(',')[0]
+    document['last_updated'] = PA_LAST_UPDATED
+    if id_cph:
+        document['pa_entry_permalink'] = f"https://kbharkiv.dk/permalink/post/1-{id_cph}"
+    return document
+
+
+def mappings_index_lifecourses(profile='full', mapping_profile='standard'):
     """
     Returns the Elasticsearch mappings for the 'lifecourses' index
-    containing the life courses.
+    containing the life courses, with person appearances of one of
+    PA_PROFILES in one of MAPPING_PROFILES.
     """
     return {
         "dynamic": False,
+        "_meta": {"pa_profile": profile, "mapping_profile": mapping_profile},
         "properties": {
             "life_course_id": {"type": "integer"},
             "person_appearance": {
                 "type": "nested",
-                "properties": mapping_pa_properties()
+                "properties": mapping_pa_properties(profile, mapping_profile)
             }
         }
     }
 
-def mappings_index_links():
+def mappings_index_links(profile='full', mapping_profile='standard'):
     """
     Returns the Elasticsearch mappings for the 'links' index containing the
-    links between person appearances in different sources."""
+    links between person appearances in different sources, with person
+    appearances of one of PA_PROFILES in one of MAPPING_PROFILES."""
     return {
         "dynamic": False,
+        "_meta": {"pa_profile": profile, "mapping_profile": mapping_profile},
         "properties": {
             "link_id": {"type": "integer"},
             "method_type": {"type": "keyword"},
@@ -200,7 +505,7 @@ def mappings_index_links():
             "life_course_ids": {"type": "integer"},
             "person_appearance": {
                 "type": "nested",
-                "properties": mapping_pa_properties()
+                "properties": mapping_pa_properties(profile, mapping_profile)
             }
         }
     }
@@ -221,18 +526,19 @@ def mappings_index_sources():
         }
     }
 
-def mappings_index_pas():
+def mappings_index_pas(mapping_profile='standard'):
     """
     Returns the Elasticsearch mappings for the 'pas' index containing person
-    appearances.
+    appearances, in one of MAPPING_PROFILES.
     """
 
     return {
         "dynamic": False,
+        "_meta": {"mapping_profile": mapping_profile},
         "properties": {
             "person_appearance": {
                 "type": "nested",
-                "properties": mapping_pa_properties()
+                "properties": mapping_pa_properties(mapping_profile=mapping_profile)
             }
         }
     }
@@ -249,11 +555,422 @@ def read_csv(path, delimiter='$', quote='"'):
         delimiter: The delimiter used to separate values on each line.
     """
 
-    headers = None
-    with open(path, 'r', encoding='utf-8') as f:
-        headers = next(f).strip().split(delimiter)
-        for line in f:
-            yield { header: None if value == '' else value for (header, value) in zip(headers, line.strip().split(delimiter)) }
+    rows = read_csv_rows(path, delimiter)
+    headers = next(rows)
+    for row in rows:
+        if row:
+            yield { header: None if value == '' else value for (header, value) in zip(headers, row) }
+
+
+def read_csv_rows(path, delimiter='$', start=0, end=None):
+    """
+    Read the rows of a simple comma-separated file with arbitrary separators
+    as lists of strings.
+
+    Does *NOT* support multiline or quoted values. The file is read in large
+    binary blocks, and each block is decoded and split into lines at once,
+    which is considerably faster than the csv module.
+
+    Args:
+        path: The path of the csv-file to open for reading.
+        delimiter: The delimiter used to separate values on each line.
+        start: The offset of the first line to read.
+        end: The offset after the last line to read, or None to read until
+             the end of the file.
+
+    Returns:
+        A generator of lists of values, which are empty for empty lines.
+    """
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = None if end is None else end - start
+        rest = b''
+
+        while remaining is None or remaining > 0:
+            block = f.read(READ_BLOCK_BYTES if remaining is None else min(READ_BLOCK_BYTES, remaining))
+            if not block:
+                break
+            if remaining is not None:
+                remaining -= len(block)
+
+            # only split complete lines, the rest is prepended to the next block
+            block = rest + block
+            cut = block.rfind(b'\n') + 1
+            rest = block[cut:]
+
+            text = block[:cut].decode('utf-8')
+            if '\r' in text:
+                text = text.replace('\r\n', '\n')
+            lines = text.split('\n')
+            lines.pop()
+
+            for line in lines:
+                yield line.split(delimiter) if line else []
+
+        line = rest.decode('utf-8').rstrip('\r')
+        if line:
+            yield line.split(delimiter)
+
+
+def csv_has_quotes(csv_path, quote='"'):
+    """
+    Check whether a file contains any quote characters, in which case it must
+    be read with the csv module instead of ``read_csv_rows``.
+
+    Args:
+        csv_path: A pathlib.Path of the file
+        quote: The quote character
+    """
+    if csv_path.stat().st_size == 0:
+        return False
+    with csv_path.open('rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        return m.find(quote.encode('utf-8')) != -1
+
+
+def csv_use_fast_reader(csv_path, fast_csv):
+    """
+    Decide whether a file is read with ``read_csv_rows``.
+
+    Args:
+        csv_path: A pathlib.Path of the file
+        fast_csv: One of FAST_CSV_MODES. With 'auto' the fast reader is used
+                  for files without quote characters.
+    """
+    if fast_csv == 'auto':
+        return not csv_has_quotes(csv_path)
+    return fast_csv == 'always'
+
+
+def csv_numbered_rows(csv_path, fast):
+    """
+    Read the rows of a '$'-delimited file, including the header.
+
+    Args:
+        csv_path: A pathlib.Path-like object that can be opened
+        fast: If true the file is read with ``read_csv_rows``, otherwise with
+              the csv module
+
+    Returns:
+        A generator of tuples of line numbers and lists of values.
+    """
+    if fast:
+        yield from enumerate(read_csv_rows(csv_path), start=1)
+    else:
+        with csv_path.open('r', encoding='utf-8') as csvfile:
+            reader = csv.reader(csvfile, delimiter='$', quotechar='"')
+            for row in reader:
+                yield (reader.line_num, row)
+
+
+# The types of the columns that are stored as integers or floats in the
+# columnar cache files: the integer and float fields of PA_SCHEMA, the ids of
+# the person appearances, and the numeric columns of the sources, links and
+# life courses
+COLUMNAR_COLUMN_TYPES = {
+    **{field.name: field.value for field in PA_SCHEMA if field.value in ('integer', 'float')},
+    'id': 'integer',
+    '': 'integer',
+    'occurences': 'integer',
+    'year': 'integer',
+    'link_id': 'integer',
+    'iteration': 'integer',
+    'method_id': 'integer',
+    'score': 'float',
+    'duplicates': 'integer',
+    'pa_id1': 'integer',
+    'source_id1': 'integer',
+    'pa_id2': 'integer',
+    'source_id2': 'integer'
+}
+
+COLUMNAR_VALUE_TYPES = {'integer': pyarrow.int64(), 'float': pyarrow.float64()}
+
+# The typed columns whose values are only used converted, by
+# PersonAppearanceConverter, so that they are typed if all of their values
+# can be converted. The values of the other typed columns are also used as
+# strings, so they must be converted losslessly.
+COLUMNAR_CONVERTED_COLUMNS = {field.name for field in PA_SCHEMA if field.value in ('integer', 'float')} - {'pa_id', 'source_id'}
+
+
+def columnar_csv_files(csv_dir):
+    """
+    Returns a list of the pathlib.Path objects of the CSV files of a
+    directory of link lives data that are cached as columnar files.
+    """
+    return sorted(f for f in csv_dir.iterdir() if f.suffix == '.csv' and f.stem.startswith(COLUMNAR_FILE_PREFIXES))
+
+
+def file_digest(path):
+    """
+    Returns the hex BLAKE2b digest of the contents of a file.
+    """
+    digest = hashlib.blake2b()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(READ_BLOCK_BYTES), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def columnar_cache(csv_path, cache_dir, fast_csv='auto'):
+    """
+    Get the columnar cache file of a CSV file, converting the CSV file if it
+    has no cache file yet or if it changed since it was converted.
+
+    The cache file of ``<name>.csv`` is ``<name>.parquet`` in ``cache_dir``,
+    next to ``<name>.json``, which records the size, the modification time
+    and the BLAKE2b digest of the CSV file. A CSV file is unchanged if its
+    size and modification time are the same, or if only its modification
+    time changed and its digest is the same, in which case the recorded
+    modification time is updated.
+
+    Args:
+        csv_path: A pathlib.Path of the CSV file
+        cache_dir: A pathlib.Path of the directory of the cache files
+        fast_csv: One of FAST_CSV_MODES, how the CSV file is read if it is
+                  converted
+
+    Returns:
+        The pathlib.Path of the cache file.
+    """
+    cache_path = cache_dir / f'{csv_path.stem}.parquet'
+    key_path = cache_dir / f'{csv_path.stem}.json'
+    stat = csv_path.stat()
+
+    if cache_path.exists() and key_path.exists():
+        key = orjson.loads(key_path.read_bytes())
+        if key['version'] == COLUMNAR_CACHE_VERSION and key['size'] == stat.st_size:
+            if key['mtime_ns'] == stat.st_mtime_ns:
+                return cache_path
+            if key['blake2b'] == file_digest(csv_path):
+                print(f' => -> {csv_path} is unchanged since it was converted')
+                key_path.write_bytes(orjson.dumps({**key, 'mtime_ns': stat.st_mtime_ns}))
+                return cache_path
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    if key_path.exists():
+        key_path.unlink()
+    print(f' => -> Converting {csv_path} to {cache_path}')
+    (rows, typed) = convert_columnar(csv_path, cache_path, csv_use_fast_reader(csv_path, fast_csv))
+    key_path.write_bytes(orjson.dumps({
+        'version': COLUMNAR_CACHE_VERSION,
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'blake2b': file_digest(csv_path),
+        'rows': rows,
+        'typed': typed
+    }))
+    print(f' => -> Converted {rows} rows, typed columns: {typed}')
+    return cache_path
+
+
+def columnar_typed_column(column, value_type, lossless=True):
+    """
+    Convert a column of strings to integers or floats, if all of its values
+    can be converted and, if ``lossless``, are the same strings when
+    converted back.
+
+    Args:
+        column: A pyarrow string Array, where empty values are null
+        value_type: The pyarrow type to convert to
+        lossless: Whether the values must be converted losslessly
+
+    Returns:
+        A pyarrow Array of ``value_type``, or None if the column cannot be
+        converted.
+    """
+    try:
+        typed = column.cast(value_type)
+    except pyarrow.ArrowInvalid:
+        return None
+    if not lossless:
+        return typed
+    same = pyarrow.compute.all(pyarrow.compute.equal(typed.cast(pyarrow.string()), column))
+    return typed if same.as_py() is not False else None
+
+
+def convert_columnar(csv_path, cache_path, fast):
+    """
+    Convert a '$'-delimited file with a header to a columnar Parquet file.
+
+    Empty values are stored as nulls. The columns of COLUMNAR_COLUMN_TYPES
+    are stored as integers or floats if all of their values can be
+    converted, and, except for COLUMNAR_CONVERTED_COLUMNS, are converted
+    losslessly, so that the values read back as strings are the values of the
+    CSV file. The other columns are stored as strings. The file is first
+    written with string columns, and then typed once it is known which
+    columns can be typed.
+
+    Rows with more values than the header are reported and skipped, and rows
+    with fewer values are padded with empty values.
+
+    Args:
+        csv_path: A pathlib.Path of the CSV file
+        cache_path: A pathlib.Path of the Parquet file, which is replaced
+                    once it is complete
+        fast: If true the file is read with ``read_csv_rows``
+
+    Returns:
+        A tuple of the number of rows and a list of the typed columns.
+    """
+    rows = csv_numbered_rows(csv_path, fast)
+    (_, header) = next(rows)
+    width = len(header)
+    strings_schema = pyarrow.schema([(name, pyarrow.string()) for name in header])
+    types = {name: COLUMNAR_VALUE_TYPES[COLUMNAR_COLUMN_TYPES[name]] for name in header if name in COLUMNAR_COLUMN_TYPES}
+    count = 0
+
+    with tempfile.TemporaryDirectory(prefix='columnar-', dir=cache_path.parent) as tmp_dir:
+        strings_path = Path(tmp_dir) / 'strings.parquet'
+        with parquet.ParquetWriter(str(strings_path), strings_schema) as writer:
+            for chunk in batched(rows, COLUMNAR_ROW_GROUP_ROWS):
+                values = []
+                for (line_num, row) in chunk:
+                    if not row:
+                        continue
+                    if len(row) > width:
+                        print(f" => -> Error: expected {width} values, got {len(row)} line={line_num} file={csv_path}")
+                        continue
+                    values.append(row if len(row) == width else row + [''] * (width - len(row)))
+                if not values:
+                    continue
+
+                columns = [pyarrow.array([value or None for value in column], pyarrow.string()) for column in zip(*values)]
+                for (name, column) in zip(header, columns):
+                    if name in types and columnar_typed_column(column, types[name], name not in COLUMNAR_CONVERTED_COLUMNS) is None:
+                        del types[name]
+                writer.write_batch(pyarrow.record_batch(columns, schema=strings_schema))
+                count += len(values)
+
+        typed_schema = pyarrow.schema([(name, types.get(name, pyarrow.string())) for name in header])
+        strings = parquet.ParquetFile(str(strings_path))
+        tmp_path = Path(tmp_dir) / cache_path.name
+        with parquet.ParquetWriter(str(tmp_path), typed_schema) as writer:
+            for row_group in range(strings.num_row_groups):
+                writer.write_table(strings.read_row_group(row_group).cast(typed_schema))
+        os.replace(tmp_path, cache_path)
+
+    return (count, [name for name in header if name in types])
+
+
+def columnar_strings(values):
+    """
+    Returns a pyarrow string Array of a sequence of strings, where empty
+    strings are null.
+    """
+    array = pyarrow.array(values, pyarrow.string())
+    return pyarrow.compute.if_else(pyarrow.compute.equal(array, ''), pyarrow.scalar(None, pyarrow.string()), array)
+
+
+def columnar_dict_rows(cache_path):
+    """
+    Read the rows of a columnar cache file as dictionaries of string values,
+    the same as the rows of the CSV file read with ``csv.DictReader``, except
+    for the values of COLUMNAR_CONVERTED_COLUMNS.
+
+    Args:
+        cache_path: A pathlib.Path of the cache file
+
+    Returns:
+        A generator of dictionaries mapping column names to values.
+    """
+    parquet_file = parquet.ParquetFile(str(cache_path))
+    names = parquet_file.schema_arrow.names
+    for batch in parquet_file.iter_batches(batch_size=COLUMNAR_ROW_GROUP_ROWS):
+        columns = [column.cast(pyarrow.string()).to_pylist() for column in batch.columns]
+        for row in zip(*columns):
+            yield {name: '' if value is None else value for (name, value) in zip(names, row)}
+
+
+def csv_dict_rows(csv_path, cache_dir=None):
+    """
+    Read the rows of a '$'-delimited file with a header as dictionaries of
+    string values, from its columnar cache file if ``cache_dir`` is given,
+    see ``columnar_cache``.
+
+    Args:
+        csv_path: A pathlib.Path of the CSV file
+        cache_dir: A pathlib.Path of the directory of the cache files, or None
+
+    Returns:
+        A generator of dictionaries mapping column names to values.
+    """
+    if cache_dir is not None:
+        yield from columnar_dict_rows(columnar_cache(csv_path, cache_dir))
+        return
+    with csv_path.open('r', encoding='utf-8') as csvfile:
+        yield from csv.DictReader(csvfile, delimiter='$', quotechar='"')
+
+
+def columnar_pa_converter(cache_path, source_id):
+    """
+    Compile a PersonAppearanceBatchConverter for the rows of a census cache
+    file, of which only the columns used by the converter are read.
+
+    Args:
+        cache_path: A pathlib.Path of the cache file
+        source_id: The source id of the person appearances in the file
+
+    Returns:
+        A tuple of the converter and a list of the columns it converts.
+    """
+    schema = parquet.read_schema(str(cache_path))
+    converter = PersonAppearanceBatchConverter(schema.names, source_id, [field.name for field in schema if field.type != pyarrow.string()])
+    return (converter, converter.columns)
+
+
+def columnar_convert_pas(batch, converter, cache_path, first_row):
+    """
+    Convert a batch of rows of a census cache file to person appearance
+    documents, reporting the rows that cannot be converted.
+
+    Args:
+        batch: A pyarrow Table or RecordBatch of the cache file
+        converter: A PersonAppearanceBatchConverter, see
+                   ``columnar_pa_converter``
+        cache_path: A pathlib.Path of the cache file, for error messages
+        first_row: The number of the first row of the batch in the file
+
+    Returns:
+        A list of tuples of (pa_id, source_id) keys and person appearance
+        documents.
+    """
+    with gc_paused():
+        results = converter.convert_batch(batch)
+
+    pas = []
+    for (row_num, result) in enumerate(results, start=first_row):
+        if isinstance(result, Exception):
+            print(f" => -> Error: {repr(result)} row={row_num} file={cache_path}")
+        else:
+            pas.append(result)
+    return pas
+
+
+def csv_convert_pas(converter, rows, location):
+    """
+    Convert a block of rows of a census CSV file to person appearance
+    documents, reporting the rows that cannot be converted.
+
+    Args:
+        converter: A PersonAppearanceBatchConverter
+        rows: A list of (line number, row) tuples of non-empty rows
+        location: The location of the rows in the error messages, after
+                  their line numbers
+
+    Returns:
+        A list of tuples of (pa_id, source_id) keys and person appearance
+        documents.
+    """
+    with gc_paused():
+        results = converter.convert_rows([row for (_, row) in rows])
+
+    pas = []
+    for ((line_num, _), result) in zip(rows, results):
+        if isinstance(result, Exception):
+            print(f" => -> Error: {repr(result)} line={line_num} {location}")
+        else:
+            pas.append(result)
+    return pas
 
 
 class PersonAppearance:
@@ -268,186 +985,35 @@ class PersonAppearance:
         Initialize a person appearance with just the id properties defined.
         """
 
+        for field in PA_SCHEMA:
+            setattr(self, field.name, None)
+
         self.id = f'{source_id}-{pa_id}'
         self.pa_id = pa_id
         self.source_id = source_id
 
+        # the id of the entry at kbharkiv.dk, for the permalink of burials
         self.id_cph = None
 
-        self.gender = None # original	string	census	Gender as transcribed
-        self.gender_clean = None # processed	string	census	Gender after removing unwanted characters
-        self.gender_std = None # processed	string (m or k)	census	Standardized gender. A result of predicting the gender based on the name (also for records not originally coming with a gender)
-        self.age = None # original	string	census	Age as transcribed
-        self.age_clean = None # processed	float	census	age after cleaning and converting to floats
-        self.name = None # original	string	census	Name as transcribed
-        self.name_clean = None # processed	string	census	lowercase Name after removing unwanted characters
-        self.name_std = None # processed	string	census	standardized full name
-        self.first_names = None # processed	list of strings (comma "," separated)	census	standardized names classified as first names
-        self.family_names = None # processed	list of strings (comma "," separated)	census	standardized names classified as family names
-        self.patronyms = None # processed	list of strings (comma "," separated)	census	standardized names classified as patronyms
-        self.uncat_names = None # processed	list of strings (comma "," separated)	census	unclassified standardized names
-        self.maiden_family_names = None # processed	list of strings (comma "," separated)	census	standardized names classified as maiden family names
-        self.maiden_patronyms = None # processed	list of strings (comma "," separated)	census	standardized names classified as maiden patronyms
-        self.all_possible_family_names = None # processed	list of strings (comma "," separated)	census	all possible  family names (standardized names). Includes constructed names based on husband/father names
-        self.all_possible_patronyms = None # processed	list of strings (comma "," separated)	census	all possible  patronyms (standardized names). Includes constructed names based on husband/father names
-        self.marital_status = None # original	string	census	marital status as transcribed
-        self.marital_status_clean = None # processed	string	census	marital status after removing unwanted characters
-        self.marital_status_std = None # processed	string	census	standardized marital status
-        self.household_position = None # original	string	census	household position as transcribed
-        self.household_position_std = None # processed	string	census	standiardized household position
-        self.household_family_no = None # original	string	census	household family number as transcribed. Should uniquely label the households. It is far from doing so.
-        self.hh_id = None # processed	integer	census	household id. Improved household identification. Uses multiple variables get a better separation of households.
-        self.occupation = None # original	string	census	occupation as transcribed. Note: for some censuses the household positions are put here.
-        self.place_name = None # original	string	census	place_name as transcribed.
-        self.land_register_address = None # original	string	census	land_register_address  as transcribed.
-        self.land_register = None # original	string	census	land_register  as transcribed.
-        self.address = None # original	string	census	address  as transcribed. Note: this rarely contains a full addresss
-        self.full_address = None # processed	string	census	a concatenation of: place_name, land_register_address, land_register, and address
-        self.parish = None # original	string	census	parish or street where the source was originally created
-        self.parish_type = None # original	string	census	the type of parish, i.e. parish, street etc.
-        self.district = None # original	string	census	district where the source was originally created
-        self.county = None # original	string	census	county where the source was originally created
-        self.state_region = None # original	string	census	state_region (danmark, grønland, færøerne, etc.) where the source was originally created
-        self.transcription_code = None # original	string	census	unique batch code of the transcription unit
-        self.transcription_id = None # original	integer	census	unique record number within the transcription unit
-        self.birth_place = None # original	string	census	birth place as transcribed (note: only available from 1845 and forth)
-        self.birth_place_clean = None # processed	string	census	birth_place after removing unwanted characters
-        self.birth_place_parish = None # processed	string	census	birth place classified as a parish
-        self.birth_place_district = None # processed	string	census	birth place classified as a district
-        self.birth_place_county = None # processed	string	census	birth place classified as a county
-        self.birth_place_koebstad = None # processed	string	census	birth place classified as a koebstad
-        self.birth_place_town = None # processed	string	census	birth place classified as a town
-        self.birth_place_place = None # processed	string	census	birth place classified as a place
-        self.birth_place_island = None # processed	string	census	birth place classified as a island
-        self.birth_place_other = None # processed	string	census	birth place classified as a other (e.g. a country)
-        self.birth_place_parish_std = None # processed	string	census	standardized birth place parish
-        self.birth_place_county_std = None # processed	string	census	standardized birth place county
-        self.birth_place_koebstad_std = None # processed	string	census	standardized birth place koebstad
-        self.source_reference = None # original	string	census	A reference to the original source
-        self.transcriber_comments = None # original	string	census	comments by the transcriber
-        self.source_year = None # processed	integer	census	year of the event
-        self.event_type = None # processed	string	census	type of event (e.g. census, burial, baptism, etc.)
-        self.role = None # processed	string	census	the role of the record in the source (e.g. mother, father, child, deceased, bride, etc.)
-        
-        # burials
-        self.dateOfBirth = None
-        self.dateOfDeath = None
-        self.yearOfBirth = None
-        self.birth_year = None
-        self.ageYears = None
-        self.ageMonths = None
-        self.ageWeeks = None
-        self.ageDays = None
-        self.ageHours = None
-        self.first_names_clean = None
-        self.lastname_clean = None
-        self.birthname_clean = None
-        self.street = None
-        self.street_number = None
-        self.letter = None
-        self.floor = None
-        self.positions = None
-        self.relationstypes = None
-
-        # special fields
-        self.first_names_sortable = None 
-        self.family_names_sortable = None
-        self.last_updated = None
-        self.pa_entry_permalink = None
-
     def es_document(self):
         """
         Get a dictionary that is an Elasticsearch document.
 
         Returns:
            A dictionary containing the data of this person appearance in the
-           format of an Elasticsearch document. 
+           format of an Elasticsearch document, without the fields that have
+           no value.
         """
-        return {
-            'id': self.id,
-            'pa_id': int(self.pa_id),
-            'source_id': int(self.source_id),
-            'transcription_id': int(self.transcription_id) if self.transcription_id is not None else None,
-            'gender': self.gender,
-            'gender_clean': self.gender_clean,
-            'gender_std': self.gender_std,
-            'age': self.age,
-            'age_clean': float(self.age_clean) if self.age_clean is not None else None,
-            'name': self.name,
-            'name_clean': self.name_clean,
-            'name_std': self.name_std,
-            'first_names': self.first_names.split(',') if self.first_names is not None else None,
-            'patronyms': self.patronyms.split(',') if self.patronyms is not None else None,
-            'family_names': self.family_names.split(',') if self.family_names is not None else None,
-            'uncat_names': self.uncat_names.split(',') if self.uncat_names is not None else None,
-            'maiden_family_names': self.maiden_family_names.split(',') if self.maiden_family_names is not None else None,
-            'maiden_patronyms': self.maiden_patronyms.split(',') if self.maiden_patronyms is not None else None,
-            'all_possible_patronyms': self.all_possible_patronyms.split(',') if self.all_possible_patronyms is not None else None,
-            'all_possible_family_names': self.all_possible_family_names.split(',') if self.all_possible_family_names is not None else None,
-            'marital_status': self.marital_status,
-            'marital_status_clean': self.marital_status_clean,
-            'marital_status_std': self.marital_status_std,
-            'household_position': self.household_position,
-            'household_position_std': self.household_position_std,
-            'household_family_no': self.household_family_no,
-            'hh_id': int(self.hh_id) if self.hh_id is not None else None,
-            'occupation': self.occupation,
-            'place_name': self.place_name,
-            'land_register_address': self.land_register_address,
-            'parish': self.parish,
-            'parish_type': self.parish_type,
-            'state_region': self.state_region,
-            'county': self.county,
-            'district': self.district,
-            'transcription_code': self.transcription_code,
-            'source_reference': self.source_reference,
-            'transcriber_comments': self.transcriber_comments,
-            'address': self.address,
-            'land_register': self.land_register,
-            'source_year': int(self.source_year) if self.source_year is not None else None,
-            'event_type': self.event_type,
-            'role': self.role,
-            'full_address': self.full_address,
-            'birth_place': self.birth_place,
-            'birth_place_clean': self.birth_place_clean,
-            'birth_place_other': self.birth_place_other,
-            'birth_place_parish': self.birth_place_parish,
-            'birth_place_district': self.birth_place_district,
-            'birth_place_county': self.birth_place_county,
-            'birth_place_koebstad': self.birth_place_koebstad,
-            'birth_place_island': self.birth_place_island,
-            'birth_place_town': self.birth_place_town,
-            'birth_place_place': self.birth_place_place,
-            'birth_place_county_std': self.birth_place_county_std,
-            'birth_place_parish_std': self.birth_place_parish_std,
-            'birth_place_koebstad_std': self.birth_place_koebstad_std,
-            
-            # burials
-            'dateOfBirth': self.dateOfBirth,
-            'dateOfDeath': self.dateOfDeath,
-            'yearOfBirth': self.yearOfBirth,
-            'birth_year': self.birth_year,
-            'ageYears': self.ageYears,
-            'ageMonths': self.ageMonths,
-            'ageWeeks': self.ageWeeks,
-            'ageDays': self.ageDays,
-            'ageHours': self.ageHours,
-            'first_names_clean': self.first_names_clean,
-            'lastname_clean': self.lastname_clean,
-            'birthname_clean': self.birthname_clean,
-            'street': self.street,
-            'street_number': self.street_number,
-            'letter': self.letter,
-            'floor': self.floor,
-            'positions': self.positions,
-            'relationstypes': self.relationstypes,
-
-            # special fields
-            'first_names_sortable': self.first_names.replace(',',' ') if self.first_names is not None else None,
-            'family_names_sortable': self.all_possible_patronyms.split(',')[0] if self.all_possible_patronyms is not None else None,
-            'last_updated': "2020-11-16",
-            'pa_entry_permalink': f"https://kbharkiv.dk/permalink/post/1-{self.id_cph}" if self.id_cph is not None else None
-        }
+        document = {'id': self.id, 'pa_id': int(self.pa_id), 'source_id': int(self.source_id)}
+        for field in PA_SCHEMA:
+            if field.name in PA_DERIVED_KEYS:
+                continue
+            value = getattr(self, field.name)
+            if value is not None:
+                cast = PA_VALUE_CASTS[field.value]
+                document[field.name] = value if cast is None else cast(value)
+
+        return pa_derived_fields(document, self.first_names, self.all_possible_patronyms, self.id_cph)
 
     @staticmethod
     def from_dict(data, raise_invalid=False):
@@ -485,6 +1051,318 @@ class PersonAppearance:
         return pa 
 
 
+class PersonAppearanceConverter:
+    """
+    Converts rows of a person appearance CSV file directly to Elasticsearch
+    documents, without instantiating PersonAppearance objects.
+
+    The converter is compiled once per file from its header and PA_SCHEMA:
+    the column of each document key and its type conversion are resolved up
+    front, and columns that are not part of the document are ignored. Empty
+    values are left out of the documents. The documents are identical to
+    those of ``PersonAppearance.es_document()``.
+
+    The values of the ``typed`` columns of rows of columnar cache files are
+    already converted, and are used as they are.
+    """
+
+    def __init__(self, header, source_id, typed=()):
+        """
+        Compile a converter for the given header.
+
+        Args:
+            header: A list of the column names of the CSV file
+            source_id: The source id of the person appearances in the file
+            typed: The columns of a columnar cache file whose values are
+                   integers or floats, which are not converted again
+
+        Raises:
+            KeyError: If the header has no 'id' column.
+        """
+        columns = {column: i for (i, column) in enumerate(header)}
+
+        self.width = len(header)
+        self.source_id = source_id
+        self.id_column = columns['id']
+        self.pa_id_column = columns.get('pa_id', self.id_column)
+        self.first_names_column = columns.get('first_names')
+        self.patronyms_column = columns.get('all_possible_patronyms')
+        self.id_cph_column = columns.get('id_cph')
+
+        self.source_id_value = int(source_id)
+
+        # (key, column, cast) of the columns of the document, in the order
+        # of PA_SCHEMA, where cast is None for string values
+        self.columns = [
+            (field.name, columns[field.name], None if field.name in typed else PA_VALUE_CASTS[field.value])
+            for field in PA_SCHEMA
+            if field.name in columns and field.name not in PA_DERIVED_KEYS
+        ]
+
+    def key(self, row):
+        """
+        Get the (pa_id, source_id) key of a row, as used by the maps of
+        person appearances to life courses and links.
+        """
+        return (row[self.pa_id_column], self.source_id)
+
+    def typed_key(self, row):
+        """
+        Get the (pa_id, source_id) key of a row of a columnar cache file, see
+        ``key``.
+        """
+        return (str(row[self.pa_id_column]), self.source_id)
+
+    def convert(self, row):
+        """
+        Convert a row to an Elasticsearch document.
+
+        Args:
+            row: A list of the string values of a row of the CSV file
+
+        Returns:
+            A dictionary containing the person appearance document.
+        """
+        if len(row) != self.width:
+            if len(row) > self.width:
+                raise ValueError(f'expected {self.width} values, got {len(row)}')
+            row = row + [''] * (self.width - len(row))
+
+        document = {
+            'id': f'{self.source_id}-{row[self.id_column]}',
+            'pa_id': int(row[self.pa_id_column]),
+            'source_id': self.source_id_value
+        }
+
+        for (key, column, cast) in self.columns:
+            value = row[column]
+            if value != '':
+                document[key] = value if cast is None else cast(value)
+
+        return pa_derived_fields(
+            document,
+            row[self.first_names_column] if self.first_names_column is not None else None,
+            row[self.patronyms_column] if self.patronyms_column is not None else None,
+            row[self.id_cph_column] if self.id_cph_column is not None else None
+        )
+
+
+@contextmanager
+def gc_paused():
+    """
+    Pause the cyclic garbage collector, if it is enabled.
+
+    The documents of a block of person appearances are allocated at once and
+    contain no reference cycles, but their allocations would trigger
+    repeated collections of all objects of the process.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class PersonAppearanceBatchConverter:
+    """
+    Converts blocks of rows of a person appearance file to Elasticsearch
+    documents with vector operations on their columns.
+
+    The integer and float casts, the splits of the list fields and the
+    derived fields are computed for all rows of a block at once with Arrow
+    compute functions, and only the documents are assembled row by row. The
+    documents are identical to those of ``PersonAppearanceConverter``. The
+    casts of a column that Arrow cannot convert are done by Python for that
+    block, and rows with values that cannot be converted are converted again
+    by a PersonAppearanceConverter, which raises the same error as for the
+    row of the CSV file.
+
+    The cost of the conversion is dominated by the assembly of the documents,
+    so blocks are best converted with the garbage collector paused, see
+    ``gc_paused``.
+    """
+
+    def __init__(self, header, source_id, typed=()):
+        """
+        Compile a batch converter for the given header.
+
+        Args:
+            header: A list of the column names of the file
+            source_id: The source id of the person appearances in the file
+            typed: The columns of a columnar cache file whose values are
+                   integers or floats
+
+        Raises:
+            KeyError: If the header has no 'id' column.
+        """
+        # the columns the documents are converted from, see ``convert_rows``
+        self.columns = [column for column in header if column in PA_DOCUMENT_KEYS or column == 'id_cph']
+        self.indices = [header.index(column) for column in self.columns]
+
+        self.converter = PersonAppearanceConverter(self.columns, source_id, typed)
+        self.width = len(header)
+        self.source_id = source_id
+        self.source_id_value = int(source_id)
+
+        def name(column):
+            return self.columns[column] if column is not None else None
+
+        self.id_name = name(self.converter.id_column)
+        self.pa_id_name = name(self.converter.pa_id_column)
+        self.first_names_name = name(self.converter.first_names_column)
+        self.patronyms_name = name(self.converter.patronyms_column)
+        self.id_cph_name = name(self.converter.id_cph_column)
+
+        # (key, value type) of the columns of the document, in the order of
+        # PA_SCHEMA
+        schema = {field.name: field.value for field in PA_SCHEMA}
+        self.fields = [(key, schema[key]) for (key, _, _) in self.converter.columns]
+
+        # the string columns of the document, whose values are used as they
+        # are by ``convert_rows``
+        derived = (self.id_name, self.pa_id_name, self.first_names_name, self.patronyms_name, self.id_cph_name)
+        self.texts = set(key for (key, value) in self.fields if value == 'string' and key not in derived)
+
+    def convert_rows(self, rows):
+        """
+        Convert a block of rows of a CSV file.
+
+        Only the columns that are cast or derived from are converted to
+        Arrow arrays, the values of the other columns are used as they are.
+
+        Args:
+            rows: A list of lists of the string values of the rows
+
+        Returns:
+            A list with a tuple of the (pa_id, source_id) key and the
+            document of each row, or the exception raised for the row.
+        """
+        results = [None] * len(rows)
+        valid = []
+        block = []
+        for (i, row) in enumerate(rows):
+            if len(row) > self.width:
+                results[i] = ValueError(f'expected {self.width} values, got {len(row)}')
+                continue
+            valid.append(i)
+            block.append(row if len(row) == self.width else row + [''] * (self.width - len(row)))
+
+        if block:
+            values = list(zip(*block))
+            computed = [(column, index) for (column, index) in zip(self.columns, self.indices) if column not in self.texts]
+            batch = pyarrow.table([columnar_strings(values[index]) for (_, index) in computed], names=[column for (column, _) in computed])
+            texts = {column: values[index] for (column, index) in zip(self.columns, self.indices) if column in self.texts}
+            for (i, result) in zip(valid, self.convert_batch(batch, texts)):
+                results[i] = result
+        return results
+
+    def convert_batch(self, batch, texts=None):
+        """
+        Convert a block of rows in columnar form.
+
+        The documents of all rows are created with the values of all columns
+        that are not empty in every row, and the empty values of the columns
+        that have some are then deleted from the documents that have them,
+        so that the order of the keys is the order of PA_SCHEMA.
+
+        Args:
+            batch: A pyarrow Table or RecordBatch with the ``columns`` of the
+                   file, where empty values are null
+            texts: A dictionary mapping string columns that are not in
+                   ``batch`` to sequences of their values, where empty values
+                   are empty strings
+
+        Returns:
+            A list with a tuple of the (pa_id, source_id) key and the
+            document of each row, or the exception raised for the row.
+        """
+        compute = pyarrow.compute
+        texts = texts or {}
+        count = batch.num_rows
+        failed = set()
+
+        def strings(name):
+            column = batch.column(name)
+            return column if column.type == pyarrow.string() else column.cast(pyarrow.string())
+
+        def nulls(column):
+            return np.flatnonzero(column.is_null().to_numpy(zero_copy_only=False)).tolist() if column.null_count else []
+
+        def cast(column, value):
+            if value == 'string' or column.type == COLUMNAR_VALUE_TYPES.get(value):
+                return column.to_pylist()
+            if value == 'list':
+                return compute.split_pattern(column, ',').to_pylist()
+            try:
+                return column.cast(COLUMNAR_VALUE_TYPES[value]).to_pylist()
+            except (pyarrow.ArrowInvalid, pyarrow.ArrowNotImplementedError):
+                pass
+
+            # the values Arrow cannot convert are converted by Python, and
+            # the rows of the values Python cannot convert either fail
+            values = column.to_pylist()
+            python_cast = PA_VALUE_CASTS[value]
+            for (i, item) in enumerate(values):
+                if item is not None:
+                    try:
+                        values[i] = python_cast(item)
+                    except Exception:
+                        failed.add(i)
+            return values
+
+        # (key, values, empty) of the keys of the documents, where empty is
+        # a list of the rows the key is left out of
+        keys = []
+
+        def add(key, values, empty=()):
+            if len(empty) < count:
+                keys.append((key, values, empty))
+
+        pa_ids = strings(self.pa_id_name)
+        failed.update(nulls(pa_ids))
+
+        add('id', compute.binary_join_element_wise(f'{self.source_id}-', compute.fill_null(strings(self.id_name), ''), '').to_pylist())
+        add('pa_id', cast(pa_ids, 'integer'))
+        add('source_id', itertools.repeat(self.source_id_value, count))
+        for (key, value) in self.fields:
+            if key in texts:
+                values = texts[key]
+                empty = [i for (i, item) in enumerate(values) if item == ''] if '' in values else []
+                add(key, values, empty)
+            else:
+                column = batch.column(key)
+                add(key, cast(column, value), nulls(column))
+
+        if self.first_names_name is not None:
+            column = strings(self.first_names_name)
+            add('first_names_sortable', compute.replace_substring(column, ',', ' ').to_pylist(), nulls(column))
+        if self.patronyms_name is not None:
+            column = strings(self.patronyms_name)
+            add('family_names_sortable', compute.list_element(compute.split_pattern(column, ',', max_splits=1), 0).to_pylist(), nulls(column))
+        add('last_updated', itertools.repeat(PA_LAST_UPDATED, count))
+        if self.id_cph_name is not None:
+            column = strings(self.id_cph_name)
+            add('pa_entry_permalink', compute.binary_join_element_wise('https://kbharkiv.dk/permalink/post/1-', column, '').to_pylist(), nulls(column))
+
+        names = [key for (key, _, _) in keys]
+        documents = list(map(dict, map(functools.partial(zip, names), zip(*(values for (_, values, _) in keys)))))
+        for (key, _, empty) in keys:
+            for i in empty:
+                del documents[i][key]
+
+        results = list(zip(zip(pa_ids.to_pylist(), itertools.repeat(self.source_id)), documents))
+        for i in failed:
+            row = [texts[column][i] if column in texts else batch.column(column)[i].as_py() for column in self.columns]
+            row = ['' if value is None else value for value in row]
+            try:
+                results[i] = (self.converter.typed_key(row), self.converter.convert(row))
+            except Exception as e:
+                results[i] = e
+        return results
+
+
 class Link:
     """
     A link between two person appearances.
@@ -593,298 +1471,3278 @@ class Source:
         return source           
 
 
-def method_info(method_id):
-    """
-    Get the method information from the id.
+# The offset up to which a census file has been read
+CensusProgress = namedtuple('CensusProgress', ['file', 'offset'])
+
+
+def checkpoint_action(progress):
+    """
+    Returns a bulk action that is not sent to Elasticsearch, but acknowledges
+    the census progress once all actions before it have been confirmed, see
+    ``AdaptiveBulkSender.send``.
+    """
+    return {'_op_type': 'checkpoint', '_checkpoint': progress}
+
+
+class BuildCheckpoint:
+    """
+    The progress of an indexing run, which is saved as JSON in the work
+    directory of the build so that a failed run can be resumed.
+
+    The progress consists of the stages that are done, and for each census
+    file the offset up to which its person appearances have been confirmed
+    by Elasticsearch.
+    """
+
+    def __init__(self, path=None, build_mode=None):
+        """
+        Load the checkpoint of a build, or create an empty one.
+
+        Args:
+            path: Path of the JSON file of the checkpoint, or None if the
+                  progress should not be saved
+            build_mode: The build mode of the run, which must match the build
+                        mode of a saved checkpoint
+        """
+        self.path = path
+        self.state = {'build_mode': build_mode, 'stages': [], 'census': {}}
+        # the stages of concurrent pipelines finish in different threads
+        self.lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            with open(path, 'rb') as f:
+                self.state = orjson.loads(f.read())
+            if self.state['build_mode'] != build_mode:
+                raise Exception(f'the build was started with build mode {self.state["build_mode"]}, not {build_mode}')
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def done(self, stage):
+        return stage in self.state['stages']
+
+    def finish(self, stage):
+        self.state['stages'].append(stage)
+        self.save()
+
+    def census_offset(self, csv_path):
+        """
+        Returns the offset up to which a census file has been indexed, or 0.
+        """
+        return self.state['census'].get(csv_path.name, 0)
+
+    def advance(self, progress):
+        """
+        Record that a census file has been indexed up to an offset.
+
+        Args:
+            progress: A CensusProgress
+        """
+        self.state['census'][Path(progress.file).name] = progress.offset
+        self.save()
+
+    def save(self):
+        if self.path is None:
+            return
+        tmp_path = f'{self.path}.tmp'
+        with self.lock:
+            with open(tmp_path, 'wb') as f:
+                f.write(orjson.dumps(self.state))
+            os.replace(tmp_path, self.path)
+
+
+class DocumentAssembler:
+    """
+    Groups person appearances by link and life course on the indexer side.
+
+    Instead of sending a scripted update to a link or life course document
+    for every person appearance belonging to it, the person appearances are
+    spilled to a SQLite database on disk, and each link and life course
+    document is emitted once, with all of its person appearances, when the
+    census data has been read.
+    """
+
+    def __init__(self, path=None):
+        """
+        Initialize an empty assembler.
+
+        Args:
+            path: Path of the SQLite file used for spilling person
+                  appearances to disk, which is kept to resume a build. A
+                  temporary file is used if not given.
+        """
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix='assembler-', suffix='.sqlite')
+            os.close(fd)
+            self.remove_on_close = True
+        else:
+            self.remove_on_close = False
+        self.path = path
+
+        self.db = open_sqlite(path, durable=not self.remove_on_close)
+        self.lock = threading.Lock()
+        self.db.execute('CREATE TABLE IF NOT EXISTS documents (kind TEXT, doc_id TEXT, body TEXT, PRIMARY KEY (kind, doc_id))')
+        self.db.execute('CREATE TABLE IF NOT EXISTS members (kind TEXT, doc_id TEXT, source_id INTEGER, pa_id INTEGER, pa TEXT, PRIMARY KEY (kind, doc_id, source_id, pa_id))')
+
+    def add_document(self, kind, doc_id, body=None):
+        """
+        Register a link or life course document.
+
+        Args:
+            kind: Either 'links' or 'lifecourses'
+            doc_id: The id of the link or life course
+            body: JSON-encoded metadata of the document, if any
+        """
+        self.db.execute('INSERT OR REPLACE INTO documents VALUES (?, ?, ?)', (kind, doc_id, body))
+
+    def add_pa(self, pa, life_course_ids, link_ids):
+        """
+        Add a person appearance to the given life courses and links.
+
+        Args:
+            pa: The EncodedPa of the person appearance
+            life_course_ids: The ids of the life courses the pa belongs to
+            link_ids: The ids of the links the pa belongs to
+        """
+        if not life_course_ids and not link_ids:
+            return
+
+        rows = [('lifecourses', str(lc), pa.source_id, pa.pa_id, pa.embedded) for lc in life_course_ids]
+        rows += [('links', str(li), pa.source_id, pa.pa_id, pa.embedded) for li in link_ids]
+
+        # duplicates are skipped, a pa is only added once to each document
+        self.db.executemany('INSERT OR IGNORE INTO members VALUES (?, ?, ?, ?, ?)', rows)
+
+    def commit(self):
+        """
+        Write the added documents and person appearances to the SQLite file.
+        """
+        self.db.commit()
+
+    def documents(self, kind):
+        """
+        Get the assembled documents of the given kind.
+
+        Args:
+            kind: Either 'links' or 'lifecourses'
+
+        Returns:
+            A generator of tuples of document id, JSON-encoded metadata and
+            the list of JSON-encoded person appearance documents, ordered by
+            source id and pa id. The documents of both kinds can be read
+            from different threads at once.
+        """
+        # the primary key of the members orders them by document and pa
+        with self.lock:
+            self.db.commit()
+
+        cursor = self.db.execute("""
+            SELECT d.doc_id, d.body, m.pa
+            FROM documents d LEFT JOIN members m ON m.kind = d.kind AND m.doc_id = d.doc_id
+            WHERE d.kind = ?
+            ORDER BY d.doc_id, m.source_id, m.pa_id
+        """, (kind,))
+
+        for doc_id, rows in groupby(cursor, key=lambda row: row[0]):
+            rows = list(rows)
+            yield (doc_id, rows[0][1], [pa for (_, _, pa) in rows if pa is not None])
+
+    def close(self):
+        self.db.close()
+        if self.remove_on_close:
+            os.remove(self.path)
+
+
+class ContentManifest:
+    """
+    A SQLite file with a content hash of every document of a build, keyed by
+    index alias and document id, to index only the documents that changed
+    since a previous build.
+
+    The hash is the first 8 bytes of the BLAKE2b digest of the encoded body of
+    the document, so the hash of a link or life course changes with any of
+    its person appearances. The routing of each document is recorded too, so
+    that a document is deleted from the shard of its previous routing when
+    its routing changes.
+    """
+
+    def __init__(self, path, previous_path=None):
+        """
+        Create an empty manifest.
+
+        Args:
+            path: Path of the SQLite file of the manifest, which is replaced
+                  if it exists
+            previous_path: Path of the manifest of the previous build, if the
+                           documents should be compared against it
+        """
+        if os.path.exists(path):
+            os.remove(path)
+        self.db = open_sqlite(path)
+        self.db.execute('CREATE TABLE hashes (kind TEXT, doc_id TEXT, hash INTEGER, routing TEXT, PRIMARY KEY (kind, doc_id)) WITHOUT ROWID')
+        self.has_previous = previous_path is not None
+        self.previous_routing = 'NULL'
+        if self.has_previous:
+            self.db.execute('ATTACH DATABASE ? AS previous', (str(previous_path),))
+            # manifests written before the documents were routed have no
+            # routing, which is the default routing by id
+            if any(column[1] == 'routing' for column in self.db.execute('PRAGMA previous.table_info(hashes)')):
+                self.previous_routing = 'routing'
+
+    @staticmethod
+    def hash(body):
+        return int.from_bytes(hashlib.blake2b(body.encode('utf-8'), digest_size=8).digest(), 'little', signed=True)
+
+    def changed(self, kind, documents):
+        """
+        Record the hashes of a batch of documents, and find the documents
+        that are new or changed since the previous build.
+
+        Args:
+            kind: The alias of the index of the documents
+            documents: A list of (doc_id, body, routing) tuples, where the
+                       routing is None for the default routing
+
+        Returns:
+            A tuple of the set of ids of the new or changed documents, which
+            are all the documents if there is no previous manifest, and a
+            dictionary mapping the ids of the documents of the previous
+            build whose routing changed to their previous routing.
+        """
+        rows = [(kind, str(doc_id), self.hash(body), routing) for (doc_id, body, routing) in documents]
+        self.db.executemany('INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?)', rows)
+        if not self.has_previous:
+            return (set(doc_id for (_, doc_id, _, _) in rows), {})
+
+        placeholders = ','.join('?' * len(rows))
+        previous = {doc_id: (doc_hash, routing) for (doc_id, doc_hash, routing) in self.db.execute(
+            f'SELECT doc_id, hash, {self.previous_routing} FROM previous.hashes WHERE kind = ? AND doc_id IN ({placeholders})',
+            [kind] + [doc_id for (_, doc_id, _, _) in rows])}
+        changed = set(doc_id for (_, doc_id, doc_hash, routing) in rows if previous.get(doc_id) != (doc_hash, routing))
+        moved = {doc_id: previous[doc_id][1] for (_, doc_id, _, routing) in rows if doc_id in previous and previous[doc_id][1] != routing}
+        return (changed, moved)
+
+    def removed(self, kind):
+        """
+        Returns a generator of (doc_id, routing) tuples of the documents of
+        the previous build that are not in this build.
+        """
+        if not self.has_previous:
+            return
+        self.db.commit()
+        yield from self.db.execute(
+            f'SELECT doc_id, {self.previous_routing} FROM previous.hashes p WHERE kind = ? AND NOT EXISTS (SELECT 1 FROM hashes h WHERE h.kind = p.kind AND h.doc_id = p.doc_id)',
+            (kind,))
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+
+class DictJoinIndex(dict):
+    """
+    A map of person appearances to life course or link ids, as a dictionary
+    keyed by (pa_id, source_id) string tuples with sets of ids as values.
+    """
+
+    def add(self, pa_id, source_id, value):
+        if (pa_id, source_id) not in self:
+            self[(pa_id, source_id)] = set()
+        self[(pa_id, source_id)].add(value)
+
+    def freeze(self):
+        pass
+
+
+def pack_pa_key(pa_id, source_id):
+    """
+    Pack a (pa_id, source_id) pair into a single 64-bit integer, with the
+    source id in the upper and the pa id in the lower 32 bits.
+    """
+    return (int(source_id) << 32) | int(pa_id)
+
+
+class CompactJoinIndex:
+    """
+    A memory-compact map of person appearances to life course or link ids.
+
+    The (pa_id, source_id) keys are packed into 64-bit integers, and the map
+    is stored in CSR layout as NumPy arrays: the sorted unique keys, the
+    offsets of the values of each key, and the integer ids. Lookups are done
+    by binary search in the keys.
+
+    Pairs are added with ``add`` and the index must be frozen with ``freeze``
+    before lookups.
+    """
+
+    def __init__(self):
+        self.added_keys = array('q')
+        self.added_values = array('q')
+        self.keys = np.empty(0, dtype=np.int64)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.values = np.empty(0, dtype=np.int64)
+
+    def add(self, pa_id, source_id, value):
+        pa_id = int(pa_id)
+        if not 0 <= pa_id < 2**32:
+            raise ValueError(f'pa_id out of range: {pa_id}')
+        self.added_keys.append(pack_pa_key(pa_id, source_id))
+        self.added_values.append(int(value))
+
+    def freeze(self):
+        """
+        Build the CSR arrays from the added pairs, skipping duplicate pairs.
+        """
+        keys = np.concatenate((np.repeat(self.keys, np.diff(self.offsets)), np.frombuffer(self.added_keys, dtype=np.int64)))
+        values = np.concatenate((self.values, np.frombuffer(self.added_values, dtype=np.int64)))
+        self.added_keys = array('q')
+        self.added_values = array('q')
+
+        order = np.lexsort((values, keys))
+        keys = keys[order]
+        values = values[order]
+
+        if len(keys) > 0:
+            unique_pairs = np.ones(len(keys), dtype=bool)
+            unique_pairs[1:] = (keys[1:] != keys[:-1]) | (values[1:] != values[:-1])
+            keys = keys[unique_pairs]
+            values = values[unique_pairs]
+
+        self.keys, starts = np.unique(keys, return_index=True)
+        self.offsets = np.append(starts, len(keys)).astype(np.int64)
+        self.values = values
+
+    def get(self, key, default=None):
+        """
+        Get the ids of a person appearance.
+
+        Args:
+            key: A (pa_id, source_id) tuple
+            default: The value returned if the person appearance has no ids
+
+        Returns:
+            A list of integer ids.
+        """
+        packed = pack_pa_key(*key)
+        i = self.keys.searchsorted(packed)
+        if i == len(self.keys) or self.keys[i] != packed:
+            return default
+        return self.values[self.offsets[i]:self.offsets[i + 1]].tolist()
+
+    def get_many(self, keys):
+        """
+        Get the ids of a batch of person appearances, with a single binary
+        search for all of the keys.
+
+        Args:
+            keys: A list of (pa_id, source_id) tuples
+
+        Returns:
+            A list with a list of integer ids for each key, which is empty for
+            person appearances without ids.
+        """
+        if len(self.keys) == 0:
+            return [[] for _ in keys]
+
+        packed = np.fromiter((pack_pa_key(*key) for key in keys), dtype=np.int64, count=len(keys))
+        positions = np.minimum(self.keys.searchsorted(packed), len(self.keys) - 1)
+        starts = self.offsets[positions]
+        counts = np.where(self.keys[positions] == packed, self.offsets[positions + 1] - starts, 0)
+
+        # gather the values of all keys at once, and split them afterwards
+        ends = np.cumsum(counts)
+        gathered = np.arange(ends[-1] if len(ends) else 0) - np.repeat(ends - counts - starts, counts)
+        values = self.values[gathered].tolist()
+
+        result = []
+        start = 0
+        for end in ends.tolist():
+            result.append(values[start:end])
+            start = end
+        return result
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def nbytes(self):
+        return self.keys.nbytes + self.offsets.nbytes + self.values.nbytes
+
+
+def open_sqlite(path, durable=False):
+    """
+    Open a SQLite database used by the indexer, with a bounded page cache.
+
+    Args:
+        path: Path of the SQLite file
+        durable: Whether the database is kept for resuming a build, and must
+                 survive the indexer being killed during a commit. Otherwise
+                 it is scratch space, which is rebuilt or thrown away by
+                 every run, and durability is traded for speed.
+    """
+    # the bulk helpers consume the action generators in a separate thread
+    db = sqlite3.connect(str(path), check_same_thread=False)
+    if durable:
+        db.execute('PRAGMA journal_mode = WAL')
+        db.execute('PRAGMA synchronous = NORMAL')
+    else:
+        db.execute('PRAGMA journal_mode = OFF')
+        db.execute('PRAGMA synchronous = OFF')
+    db.execute(f'PRAGMA cache_size = -{SQLITE_CACHE_KIB}')
+    return db
+
+
+class SqliteJoinIndex:
+    """
+    A disk-backed map of person appearances to life course or link ids, for
+    datasets where the maps do not fit in memory.
+
+    The packed (pa_id, source_id) keys and the ids are stored in a SQLite
+    table clustered on (key, value), so memory usage is bounded by the page
+    cache regardless of the size of the map. Lookups should be done in
+    batches with ``get_many``.
+    """
+
+    def __init__(self, path, create=True):
+        """
+        Create an empty map, or open an existing one for lookups.
+
+        Args:
+            path: Path of the SQLite file of the map
+            create: Whether a new map is created, replacing the file if it
+                    exists. The map is rebuilt by every run, and the file of
+                    an interrupted run may be corrupt.
+        """
+        self.path = path
+        if create and os.path.exists(path):
+            os.remove(path)
+        self.db = open_sqlite(path)
+        if create:
+            self.db.execute('CREATE TABLE IF NOT EXISTS pa_ids (key INTEGER, value INTEGER, PRIMARY KEY (key, value)) WITHOUT ROWID')
+        else:
+            self.db.execute('PRAGMA query_only = ON')
+        self.added = []
+
+    @staticmethod
+    def open(path):
+        """
+        Open the existing map of another process for lookups, see
+        ``csv_init_worker``.
+        """
+        return SqliteJoinIndex(path, create=False)
+
+    def add(self, pa_id, source_id, value):
+        pa_id = int(pa_id)
+        if not 0 <= pa_id < 2**32:
+            raise ValueError(f'pa_id out of range: {pa_id}')
+        self.added.append((pack_pa_key(pa_id, source_id), int(value)))
+        if len(self.added) >= SQLITE_BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        # pairs are sorted to append to the b-tree in order, duplicates are skipped
+        self.added.sort()
+        self.db.executemany('INSERT OR IGNORE INTO pa_ids VALUES (?, ?)', self.added)
+        self.added = []
+
+    def freeze(self):
+        self.flush()
+        self.db.commit()
+
+    def get(self, key, default=None):
+        [values] = self.get_many([key])
+        return values if values else default
+
+    def get_many(self, keys):
+        """
+        Get the ids of a batch of person appearances.
+
+        Args:
+            keys: A list of (pa_id, source_id) tuples
+
+        Returns:
+            A list with a list of integer ids for each key, which is empty for
+            person appearances without ids.
+        """
+        packed = [pack_pa_key(*key) for key in keys]
+        found = {}
+        for i in range(0, len(packed), LOOKUP_BATCH_SIZE):
+            chunk = packed[i:i + LOOKUP_BATCH_SIZE]
+            for (key, value) in self.db.execute(f'SELECT key, value FROM pa_ids WHERE key IN ({",".join("?" * len(chunk))}) ORDER BY key, value', chunk):
+                found.setdefault(key, []).append(value)
+        return [found.get(key, []) for key in packed]
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(DISTINCT key) FROM pa_ids').fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+
+def new_join_index(join_index, path=None):
+    """
+    Create an empty map of person appearances to life course or link ids.
+
+    Args:
+        join_index: One of JOIN_INDEX_TYPES
+        path: Path of the SQLite file of a 'disk' join index
+    """
+    if join_index == 'disk':
+        return SqliteJoinIndex(path)
+    if join_index == 'compact':
+        return CompactJoinIndex()
+    return DictJoinIndex()
+
+
+def join_index_get_many(join_index, keys):
+    """
+    Look up a batch of person appearances in a join index.
+
+    Args:
+        join_index: A join index or a dictionary
+        keys: A list of (pa_id, source_id) tuples
+
+    Returns:
+        A list with the ids of each key, which is empty for person
+        appearances without ids.
+    """
+    if hasattr(join_index, 'get_many'):
+        return join_index.get_many(keys)
+    return [join_index.get(key, []) for key in keys]
+
+
+def deep_sizeof(obj, seen=None):
+    """
+    Get the approximate memory footprint in bytes of an object, including the
+    containers and strings it refers to. Objects are only counted once.
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(key, seen) + deep_sizeof(value, seen) for (key, value) in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    return size
+
+
+def peak_rss_mb():
+    """
+    Returns the peak resident set size of the indexer process in MB.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+
+class IndexerMetrics:
+    """
+    Counters, gauges and histograms of an indexing run, which can be written
+    periodically as JSON lines and as a Prometheus textfile.
+
+    Each metric is identified by its name and its labels. Counters are only
+    updated by the indexer process, not by census worker processes.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stopped = threading.Event()
+        self.reset()
+
+    def reset(self):
+        # failures and retries are reported as 0 rather than missing
+        self.counters = {('indexer_bulk_retries_total', ()): 0, ('indexer_bulk_failures_total', ()): 0}
+        self.gauges = {}
+        self.histograms = {}
+        self.stage = None
+        self.last = (time.time(), {})
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, value, **labels):
+        """
+        Add an observation to a histogram with the buckets
+        BULK_LATENCY_BUCKETS.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.setdefault(key, {'buckets': [0] * len(BULK_LATENCY_BUCKETS), 'count': 0, 'sum': 0.0})
+            for (i, bound) in enumerate(BULK_LATENCY_BUCKETS):
+                if value <= bound:
+                    histogram['buckets'][i] += 1
+            histogram['count'] += 1
+            histogram['sum'] += value
+
+    def totals(self):
+        """
+        Returns a dictionary of the totals of each counter over all labels,
+        and of the count and sum of each histogram.
+        """
+        totals = {}
+        with self.lock:
+            for ((name, _), value) in self.counters.items():
+                totals[name] = totals.get(name, 0) + value
+            for ((name, _), histogram) in self.histograms.items():
+                totals[f'{name}_count'] = totals.get(f'{name}_count', 0) + histogram['count']
+                totals[f'{name}_sum'] = totals.get(f'{name}_sum', 0) + histogram['sum']
+        return totals
+
+    def snapshot(self):
+        """
+        Returns the current metrics as a JSON-serializable dictionary,
+        including the rate per second of each counter since the previous
+        snapshot.
+        """
+        self.set('indexer_peak_rss_bytes', peak_rss_mb() * 2**20)
+        now = time.time()
+        with self.lock:
+            counters = {metric_name(key): value for (key, value) in self.counters.items()}
+            gauges = {metric_name(key): value for (key, value) in self.gauges.items()}
+            histograms = {metric_name(key): dict(histogram, buckets=list(histogram['buckets'])) for (key, histogram) in self.histograms.items()}
+            (last_time, last_counters) = self.last
+            self.last = (now, counters)
+
+        elapsed = max(now - last_time, 1e-9)
+        return {
+            'time': now,
+            'stage': self.stage,
+            'counters': counters,
+            'rates': {name: (value - last_counters.get(name, 0)) / elapsed for (name, value) in counters.items()},
+            'gauges': gauges,
+            'histograms': histograms
+        }
+
+    def prometheus(self):
+        """
+        Returns the current metrics in the Prometheus text format.
+        """
+        self.set('indexer_peak_rss_bytes', peak_rss_mb() * 2**20)
+        lines = []
+        with self.lock:
+            for (kind, metrics) in [('counter', self.counters), ('gauge', self.gauges)]:
+                for name in sorted(set(name for (name, _) in metrics)):
+                    lines.append(f'# TYPE {name} {kind}')
+                    lines += [f'{metric_name(key)} {value}' for (key, value) in metrics.items() if key[0] == name]
+            for name in sorted(set(name for (name, _) in self.histograms)):
+                lines.append(f'# TYPE {name} histogram')
+                for ((_, labels), histogram) in self.histograms.items():
+                    for (bound, count) in zip(BULK_LATENCY_BUCKETS, histogram['buckets']):
+                        lines.append(f'{metric_name((name + "_bucket", labels + (("le", str(bound)),)))} {count}')
+                    lines.append(f'{metric_name((name + "_bucket", labels + (("le", "+Inf"),)))} {histogram["count"]}')
+                    lines.append(f'{metric_name((name + "_count", labels))} {histogram["count"]}')
+                    lines.append(f'{metric_name((name + "_sum", labels))} {histogram["sum"]}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, json_path=None, prom_path=None, event=None):
+        """
+        Append a snapshot, or an event, to a JSON lines file, and replace a
+        Prometheus textfile with the current metrics.
+        """
+        if json_path is not None:
+            with open(json_path, 'ab') as f:
+                f.write(orjson.dumps(event if event is not None else self.snapshot()) + b'\n')
+        if prom_path is not None:
+            tmp_path = f'{prom_path}.tmp'
+            with open(tmp_path, 'w') as f:
+                f.write(self.prometheus())
+            os.replace(tmp_path, prom_path)
+
+    def start(self, json_path=None, prom_path=None, interval=METRICS_INTERVAL_SECONDS):
+        """
+        Reset the metrics and write them every ``interval`` seconds in a
+        background thread, until ``stop`` is called.
+        """
+        self.reset()
+        self.json_path = json_path
+        self.prom_path = prom_path
+        if json_path is None and prom_path is None:
+            return
+
+        def run():
+            while not self.stopped.wait(interval):
+                self.write(json_path, prom_path)
+
+        self.stopped.clear()
+        self.thread = threading.Thread(target=run, name='indexer-metrics', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop writing the metrics, and write them a last time.
+        """
+        if self.thread is None:
+            return
+        self.stopped.set()
+        self.thread.join()
+        self.thread = None
+        self.write(self.json_path, self.prom_path)
+
+    def stage_event(self, summary):
+        """
+        Write the summary of a stage to the JSON lines file, if any.
+        """
+        if self.thread is not None and self.json_path is not None:
+            self.write(self.json_path, event=dict(summary, event='stage', time=time.time()))
+
+
+def metric_name(key):
+    """
+    Returns the Prometheus name of a metric, with its labels, given a tuple
+    of its name and its label pairs.
+    """
+    (name, labels) = key
+    if not labels:
+        return name
+    return name + '{' + ','.join(f'{label}="{value}"' for (label, value) in labels) + '}'
+
+
+# The metrics of the current indexing run
+METRICS = IndexerMetrics()
+
+
+class RunSummary:
+    """
+    Records the duration, throughput and bulk requests of the stages of an
+    indexing run, and the peak resident set size of the indexer after each
+    stage.
+
+    The metrics are global to the run, so stages that run concurrently are
+    summed up as one combined stage, see ``concurrent``, and only their
+    durations are recorded on their own.
+    """
+
+    def __init__(self):
+        self.stages = []
+        self.group = None
+
+    @contextmanager
+    def stage(self, name):
+        print(f' => {name}')
+        start = time.perf_counter()
+        if self.group is not None:
+            yield
+            summary = {'stage': name, 'concurrent': self.group, 'seconds': time.perf_counter() - start, 'peak_rss_mb': peak_rss_mb()}
+            self.stages.append(summary)
+            METRICS.stage_event(summary)
+            return
+
+        METRICS.stage = name
+        before = METRICS.totals()
+        yield
+        after = METRICS.totals()
+        summary = {key: value - before.get(key, 0) for (key, value) in after.items()}
+        summary.update(stage=name, seconds=time.perf_counter() - start, peak_rss_mb=peak_rss_mb())
+        self.stages.append(summary)
+        METRICS.stage_event(summary)
+
+    @contextmanager
+    def concurrent(self, name):
+        """
+        Record the stages run within the block, which run concurrently, as
+        the stage ``name`` with the metrics of all of them. Blocks within the
+        block are part of it.
+        """
+        if self.group is not None:
+            yield
+            return
+        with self.stage(name):
+            self.group = name
+            try:
+                yield
+            finally:
+                self.group = None
+
+    def report(self):
+        print(f' => Run summary')
+        for summary in self.stages:
+            seconds = max(summary['seconds'], 1e-9)
+            parts = [f'{summary["seconds"]:.1f} s']
+            if 'concurrent' in summary:
+                parts.append(f'concurrently, see {summary["concurrent"]}')
+            if summary.get('indexer_rows_parsed_total'):
+                parts.append(f'{summary["indexer_rows_parsed_total"]} rows parsed ({summary["indexer_rows_parsed_total"] / seconds:.0f}/s)')
+            if summary.get('indexer_documents_built_total'):
+                parts.append(f'{summary["indexer_documents_built_total"]} documents built ({summary["indexer_documents_built_total"] / seconds:.0f}/s)')
+            if summary.get('indexer_bulk_request_seconds_count'):
+                requests = summary['indexer_bulk_request_seconds_count']
+                parts.append(f'{requests} bulk requests ({summary["indexer_bulk_request_seconds_sum"] / requests:.2f} s mean)')
+                parts.append(f'{summary.get("indexer_bulk_bytes_total", 0) / 2**20:.1f} MB sent')
+                parts.append(f'{summary.get("indexer_bulk_retries_total", 0)} retries')
+                parts.append(f'{summary.get("indexer_bulk_failures_total", 0)} failures')
+            parts.append(f'peak RSS {summary["peak_rss_mb"]:.0f} MB')
+            print(f' => -> {summary["stage"]}: {", ".join(parts)}')
+
+
+def method_info(method_id):
+    """
+    Get the method information from the id.
+
+    Args:
+        method_id: The unique identifier of the method.
+
+    Returns:
+        A dictionary containing the method metadata information, ie. the 'method'
+        and 'description' of the source.
+    """
+
+    methods = {
+        '0': { 'type': 'Rule Based', 'subtype1': 'primary', 'description': 'rule based links made from personal information only (age, gender, name, birth place)' },
+        '1': { 'type': 'Rule Based', 'subtype1': 'household', 'description': 'links based on household links made by primary links' },
+        '2': { 'type': 'Manual', 'subtype1': '', 'description': 'hand made links' }
+    }
+    
+    return methods[str(method_id)]    
+
+def getSourceIdByFilePath(sources, filename):
+    for s in sources:
+        if sources[s].filename is not None and filename.find(sources[s].filename) != -1:
+            return sources[s].source_id
+    raise Exception(f'could not map filename {filename} to source')
+
+class AdaptiveBulkSender:
+    """
+    Sends bulk actions to Elasticsearch in requests sized by bytes instead of
+    by number of documents, adapting the size to the observed latency.
+
+    A request that takes longer than ``target_seconds``, or that is rejected,
+    halves the size of the following requests, and a request that takes less
+    than half of it grows them by ``min_bytes``. Requests and documents
+    rejected with a status in BULK_RETRY_STATUSES are retried after an
+    exponential backoff with full jitter. At most ``thread_count`` requests
+    are in flight, and no further actions are read until one of them is done.
+
+    Attributes:
+        batch_bytes: The current target size of a request in bytes
+        in_flight: The number of requests currently in flight
+        retries: The number of retried requests
+        indices: A dictionary mapping the '_index' of the actions to the
+                 names of the indices they are sent to, if any
+    """
+
+    def __init__(self, es, thread_count=BULK_THREADS, start_bytes=BULK_START_BYTES,
+                 min_bytes=BULK_MIN_BYTES, max_bytes=BULK_MAX_BYTES,
+                 target_seconds=BULK_TARGET_SECONDS, max_retries=BULK_MAX_RETRIES,
+                 backoff_seconds=BULK_BACKOFF_SECONDS, indices=None):
+        self.es = es
+        self.indices = indices
+        self.thread_count = thread_count
+        self.batch_bytes = start_bytes
+        self.min_bytes = min_bytes
+        self.max_bytes = max_bytes
+        self.target_seconds = target_seconds
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.in_flight = 0
+        self.retries = 0
+        self.lock = threading.Lock()
+
+    def send(self, actions, acknowledge=None):
+        """
+        Send bulk actions to Elasticsearch.
+
+        Args:
+            actions: An iterable of bulk actions, see ``expand_bulk_action``.
+                     Actions with the '_op_type' 'checkpoint' are not sent,
+                     but their '_checkpoint' is passed to ``acknowledge``.
+            acknowledge: A function that is called with the '_checkpoint' of
+                         each checkpoint action, once Elasticsearch has
+                         responded to all actions before it
+
+        Yields:
+            A (success, info) tuple for each action, in the order of the
+            actions, where info is the item of the bulk response.
+        """
+        return self.send_lines(bulk_action_lines(actions, self.indices), acknowledge)
+
+    def send_lines(self, items, acknowledge=None):
+        """
+        Send encoded bulk actions to Elasticsearch, see ``send``.
+
+        Args:
+            items: An iterable of tuples of the lines of each action, and of
+                   checkpoint actions, see ``bulk_action_lines``
+            acknowledge: A function that is called with the '_checkpoint' of
+                         each checkpoint action, see ``send``
+        """
+        pending = deque()
+        with ThreadPoolExecutor(self.thread_count) as executor:
+            for (batch, checkpoints) in self.line_batches(items):
+                if len(pending) >= self.thread_count:
+                    yield from self.results(pending.popleft(), acknowledge)
+                future = None
+                if batch:
+                    with self.lock:
+                        self.in_flight += 1
+                        METRICS.set('indexer_queue_depth', self.in_flight, queue='bulk_requests')
+                    future = executor.submit(self.send_batch, batch)
+                pending.append((future, checkpoints))
+
+            while pending:
+                yield from self.results(pending.popleft(), acknowledge)
+
+    def results(self, pending, acknowledge):
+        """
+        Wait for the results of a batch, and acknowledge its checkpoints.
+        """
+        (future, checkpoints) = pending
+        if future is not None:
+            yield from future.result()
+        if acknowledge is not None:
+            for checkpoint in checkpoints:
+                acknowledge(checkpoint)
+
+    def batches(self, actions):
+        """
+        Group bulk actions into lists of about ``batch_bytes`` bytes, of the
+        lines of each action, which are the action line and the body, if any.
+
+        Returns:
+            A generator of tuples of a batch and the list of the checkpoints
+            that follow the actions of the batch.
+        """
+        return self.line_batches(bulk_action_lines(actions, self.indices))
+
+    def line_batches(self, items):
+        """
+        Group encoded bulk actions into lists of about ``batch_bytes`` bytes,
+        see ``batches``.
+        """
+        batch = []
+        checkpoints = []
+        size = 0
+        for lines in items:
+            if isinstance(lines, dict):
+                checkpoints.append(lines['_checkpoint'])
+                continue
+            batch.append(lines)
+            size += sum(len(line) + 1 for line in lines)
+            if size >= self.batch_bytes:
+                yield (batch, checkpoints)
+                batch = []
+                checkpoints = []
+                size = 0
+
+        if batch or checkpoints:
+            yield (batch, checkpoints)
+
+    def send_batch(self, batch):
+        """
+        Send a batch of actions in a bulk request, retrying rejected requests
+        and documents.
+
+        Returns:
+            A list with a (success, info) tuple for each action of the batch.
+        """
+        results = [None] * len(batch)
+        todo = list(range(len(batch)))
+        attempt = 0
+        try:
+            while True:
+                start = time.perf_counter()
+                rejected = []
+                body = [line for i in todo for line in batch[i]]
+                METRICS.count('indexer_bulk_bytes_total', sum(len(line) + 1 for line in body))
+                try:
+                    response = self.es.bulk(body=body)
+                except Exception as e:
+                    if getattr(e, 'status_code', None) not in BULK_RETRY_STATUSES or attempt >= self.max_retries:
+                        raise
+                    rejected = todo
+                else:
+                    rejected = self.record_items(todo, response['items'], results, attempt)
+
+                METRICS.observe('indexer_bulk_request_seconds', time.perf_counter() - start)
+                self.adapt(time.perf_counter() - start, len(rejected) > 0)
+                if not rejected:
+                    return results
+
+                todo = rejected
+                attempt += 1
+                with self.lock:
+                    self.retries += 1
+                METRICS.count('indexer_bulk_retries_total')
+                time.sleep(self.backoff(attempt))
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+                METRICS.set('indexer_queue_depth', self.in_flight, queue='bulk_requests')
+
+    def record_items(self, todo, items, results, attempt):
+        """
+        Record the items of a bulk response in the results of a batch.
+
+        Args:
+            todo: The indices in the batch of the actions of the request
+            items: The items of the bulk response
+            results: The list of the results of the batch
+            attempt: The number of retries of the request so far
+
+        Returns:
+            A list of the indices of the rejected actions that are retried.
+        """
+        rejected = []
+        for (i, item) in zip(todo, items):
+            status = next(iter(item.values())).get('status', 500)
+            if status in BULK_RETRY_STATUSES and attempt < self.max_retries:
+                rejected.append(i)
+            else:
+                results[i] = (200 <= status < 300, item)
+                if not results[i][0]:
+                    METRICS.count('indexer_bulk_failures_total')
+        return rejected
+
+    def adapt(self, seconds, rejected):
+        """
+        Resize the following requests given the latency of a request, and
+        whether any of its documents were rejected.
+        """
+        with self.lock:
+            if rejected or seconds > self.target_seconds:
+                self.batch_bytes = max(self.min_bytes, self.batch_bytes // 2)
+            elif seconds < self.target_seconds / 2:
+                self.batch_bytes = min(self.max_bytes, self.batch_bytes + self.min_bytes)
+            METRICS.set('indexer_bulk_batch_bytes', self.batch_bytes)
+
+    def backoff(self, attempt):
+        """
+        Returns the number of seconds to wait before a retry.
+        """
+        return random.uniform(0, min(BULK_MAX_BACKOFF_SECONDS, self.backoff_seconds * 2 ** (attempt - 1)))
+
+
+class AsyncBulkSender(AdaptiveBulkSender):
+    """
+    An AdaptiveBulkSender with an asyncio pipeline, which sends the bulk
+    requests with an AsyncElasticsearch client.
+
+    The pipeline has three stages connected by bounded queues: the actions
+    are built and grouped into batches in an executor thread, up to
+    ``queue_batches`` batches ahead of the requests, at most
+    ``thread_count`` bulk requests are in flight at a time, and their
+    results are collected in the order of the actions. So building the
+    actions, which reads and converts the census data, overlaps the round
+    trips of the requests. The depths of the queues are reported in the
+    'indexer_queue_depth' metric: 'bulk_batches' is the number of built
+    batches waiting to be sent, which stays at ``queue_batches`` when the
+    cluster is the bottleneck and near 0 when the actions are.
+
+    The event loop runs while the results are read from ``send``.
+
+    Attributes:
+        loop: The event loop of the client
+        queued: The number of built batches waiting to be sent
+    """
+
+    def __init__(self, es, loop, queue_batches=BULK_QUEUE_BATCHES, **sender_args):
+        super().__init__(es, **sender_args)
+        self.loop = loop
+        self.queue_batches = queue_batches
+        self.queued = 0
+
+    def send_lines(self, items, acknowledge=None):
+        """
+        Send encoded bulk actions to Elasticsearch, see ``send``.
+        """
+        executor = ThreadPoolExecutor(1)
+        stages = set()
+        try:
+            results = self.loop.run_until_complete(self.start(self.line_batches(items), executor, stages))
+            while True:
+                item = self.loop.run_until_complete(results.get())
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                (batch_results, checkpoints) = item
+                yield from batch_results
+                if acknowledge is not None:
+                    for checkpoint in checkpoints:
+                        acknowledge(checkpoint)
+        finally:
+            for stage in stages:
+                stage.cancel()
+            self.loop.run_until_complete(asyncio.gather(*stages, return_exceptions=True))
+            executor.shutdown()
+
+    async def start(self, batches, executor, stages):
+        """
+        Start the stages of the pipeline, whose tasks are added to the set
+        ``stages`` while they run.
+
+        Args:
+            batches: An iterator of (batch, checkpoints) tuples, see
+                     ``line_batches``
+            executor: The executor the batches are built in
+
+        Returns:
+            An asyncio.Queue of the results of the batches, in order, as
+            tuples of the list of the results of the actions and the
+            checkpoints that follow them, followed by None. An exception of
+            any stage is put in the queue instead, after the results of the
+            batches before it.
+        """
+        built = asyncio.Queue(self.queue_batches)
+        sent = asyncio.Queue(self.thread_count)
+        results = asyncio.Queue(1)
+        requests = asyncio.Semaphore(self.thread_count)
+        stages.update([
+            asyncio.ensure_future(self.build(batches, executor, built)),
+            asyncio.ensure_future(self.dispatch(built, sent, requests, stages)),
+            asyncio.ensure_future(self.collect(sent, results))
+        ])
+        return results
+
+    async def build(self, batches, executor, built):
+        """
+        Build the batches in the executor and queue them, followed by None.
+        """
+        loop = asyncio.get_event_loop()
+        try:
+            while True:
+                item = await loop.run_in_executor(executor, next, batches, None)
+                if item is None:
+                    break
+                await built.put(item)
+                self.queued = built.qsize()
+                METRICS.set('indexer_queue_depth', self.queued, queue='bulk_batches')
+            await built.put(None)
+        except Exception as e:
+            await built.put(e)
+
+    async def dispatch(self, built, sent, requests, stages):
+        """
+        Send the queued batches, with at most ``thread_count`` requests in
+        flight, and queue the requests in order, followed by None.
+        """
+        while True:
+            item = await built.get()
+            self.queued = built.qsize()
+            METRICS.set('indexer_queue_depth', self.queued, queue='bulk_batches')
+            if item is None or isinstance(item, Exception):
+                await sent.put(item)
+                return
+
+            (batch, checkpoints) = item
+            request = None
+            if batch:
+                await requests.acquire()
+                request = asyncio.ensure_future(self.send_batch_async(batch, requests))
+                stages.add(request)
+                request.add_done_callback(stages.discard)
+            await sent.put((request, checkpoints))
+
+    async def collect(self, sent, results):
+        """
+        Wait for the queued requests in order, and queue their results,
+        followed by None.
+        """
+        while True:
+            item = await sent.get()
+            if item is None or isinstance(item, Exception):
+                await results.put(item)
+                return
+
+            (request, checkpoints) = item
+            try:
+                batch_results = await request if request is not None else []
+            except Exception as e:
+                await results.put(e)
+                return
+            await results.put((batch_results, checkpoints))
+
+    async def send_batch_async(self, batch, requests):
+        """
+        Send a batch of actions in a bulk request, see ``send_batch``, and
+        release a request of the ``requests`` semaphore once done.
+        """
+        results = [None] * len(batch)
+        todo = list(range(len(batch)))
+        attempt = 0
+        self.in_flight += 1
+        METRICS.set('indexer_queue_depth', self.in_flight, queue='bulk_requests')
+        try:
+            while True:
+                start = time.perf_counter()
+                rejected = []
+                body = [line for i in todo for line in batch[i]]
+                METRICS.count('indexer_bulk_bytes_total', sum(len(line) + 1 for line in body))
+                try:
+                    response = await self.es.bulk(body=body)
+                except Exception as e:
+                    if getattr(e, 'status_code', None) not in BULK_RETRY_STATUSES or attempt >= self.max_retries:
+                        raise
+                    rejected = todo
+                else:
+                    rejected = self.record_items(todo, response['items'], results, attempt)
+
+                METRICS.observe('indexer_bulk_request_seconds', time.perf_counter() - start)
+                self.adapt(time.perf_counter() - start, len(rejected) > 0)
+                if not rejected:
+                    return results
+
+                todo = rejected
+                attempt += 1
+                self.retries += 1
+                METRICS.count('indexer_bulk_retries_total')
+                await asyncio.sleep(self.backoff(attempt))
+        finally:
+            self.in_flight -= 1
+            METRICS.set('indexer_queue_depth', self.in_flight, queue='bulk_requests')
+            requests.release()
+
+
+class ElasticsearchSink:
+    """
+    A sink sending bulk actions to Elasticsearch with an AdaptiveBulkSender.
+
+    Sinks receive the bulk actions of the indexer, whose '_index' is one of
+    the aliases of ALIAS_INDEX_MAPPING. Each call of ``send`` sends an
+    iterable of actions, and generates a (success, info) tuple for each
+    action. Checkpoint actions are passed to ``acknowledge`` once the actions
+    before them are stored, see ``AdaptiveBulkSender.send``. At most
+    ``requests`` bulk requests of a call are in flight, if given, and sinks
+    can be sent to from several threads at once. The status of a sink is
+    the status of the last call of ``send`` of the calling thread.
+
+    The actions are sent to the indices that ALIAS_INDEX_MAPPING maps their
+    '_index' to when they are sent.
+    """
+
+    def __init__(self, es, **sender_args):
+        self.es = es
+        self.sender_args = sender_args
+        self.local = threading.local()
+
+    @property
+    def sender(self):
+        return getattr(self.local, 'sender', None)
+
+    @sender.setter
+    def sender(self, sender):
+        self.local.sender = sender
+
+    def send(self, actions, acknowledge=None, requests=None):
+        self.sender = AdaptiveBulkSender(self.es, indices=ALIAS_INDEX_MAPPING, **self.send_args(requests))
+        return self.sender.send(actions, acknowledge)
+
+    def send_args(self, requests):
+        """
+        Returns the arguments of the sender of a call of ``send`` with at
+        most ``requests`` requests in flight, if given.
+        """
+        return dict(self.sender_args, thread_count=requests) if requests else self.sender_args
+
+    def status(self):
+        if self.sender is None:
+            return ''
+        return f'batch size {self.sender.batch_bytes / 2**20:.1f} MB, {self.sender.in_flight} requests in flight, {self.sender.retries} retries'
+
+    def close(self):
+        pass
+
+
+class AsyncElasticsearchSink(ElasticsearchSink):
+    """
+    A sink sending bulk actions to Elasticsearch with an AsyncBulkSender,
+    see ``ElasticsearchSink``.
+
+    Each call of ``send`` runs in an event loop of its own, with a client of
+    its own, which are closed when the actions are sent, so that calls can be
+    made from several threads at once.
+    """
+
+    def __init__(self, client, **sender_args):
+        """
+        Args:
+            client: A function returning a new AsyncElasticsearch client
+            sender_args: The arguments of the AsyncBulkSender of each call
+        """
+        super().__init__(None, **sender_args)
+        self.client = client
+
+    def send(self, actions, acknowledge=None, requests=None):
+        loop = asyncio.new_event_loop()
+        es = self.client()
+        try:
+            self.sender = AsyncBulkSender(es, loop, indices=ALIAS_INDEX_MAPPING, **self.send_args(requests))
+            yield from self.sender.send(actions, acknowledge)
+        finally:
+            loop.run_until_complete(es.close())
+            loop.close()
+
+    def status(self):
+        if self.sender is None:
+            return ''
+        return f'{super().status()}, {self.sender.queued} batches queued'
+
+
+class NdjsonBulkFileSink:
+    """
+    A sink writing bulk actions to gzip compressed NDJSON files in the format
+    of the bulk API, which can be replayed into Elasticsearch later, see
+    ``replay_bulk_files``.
+
+    The actions keep the aliases of ALIAS_INDEX_MAPPING as their '_index', so
+    the files can be replayed into the indices of any build. Each call of
+    ``send`` writes a new group of files named after BULK_FILE_PATTERN,
+    which is rotated after ``max_bytes`` of uncompressed NDJSON. The groups
+    are numbered after the groups already in the directory, so that the
+    groups of a resumed run follow those of the failed run. A file is
+    written under a temporary name and renamed when it is complete, and
+    checkpoints are acknowledged once the actions before them are in a
+    complete file.
+
+    Attributes:
+        files: The number of files written
+        actions: The number of actions written
+        bytes: The number of uncompressed bytes written
+    """
+
+    def __init__(self, directory, max_bytes=BULK_FILE_BYTES):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        groups = [bulk_file_group(path) for path in self.directory.glob('bulk-*.ndjson.gz')]
+        self.group = max(groups) + 1 if groups else 0
+        self.files = 0
+        self.actions = 0
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def send(self, actions, acknowledge=None, requests=None):
+        with self.lock:
+            group = self.group
+            self.group += 1
+        part = 0
+        f = None
+        size = 0
+        checkpoints = []
+        try:
+            for lines in bulk_action_lines(actions):
+                if isinstance(lines, dict):
+                    checkpoints.append(lines['_checkpoint'])
+                    continue
+                if f is None:
+                    path = self.directory / BULK_FILE_PATTERN.format(group=group, part=part)
+                    f = gzip.open(f'{path}.tmp', 'wb')
+                data = ''.join(line + '\n' for line in lines).encode('utf-8')
+                f.write(data)
+                size += len(data)
+                with self.lock:
+                    self.actions += 1
+                    self.bytes += len(data)
+                yield (True, None)
+
+                if size >= self.max_bytes:
+                    self.finish_file(f, path, checkpoints, acknowledge)
+                    (f, size, checkpoints) = (None, 0, [])
+                    part += 1
+
+            if f is not None:
+                self.finish_file(f, path, checkpoints, acknowledge)
+                f = None
+            elif acknowledge is not None:
+                for checkpoint in checkpoints:
+                    acknowledge(checkpoint)
+        finally:
+            if f is not None:
+                f.close()
+
+    def finish_file(self, f, path, checkpoints, acknowledge):
+        f.close()
+        os.replace(f'{path}.tmp', path)
+        with self.lock:
+            self.files += 1
+        if acknowledge is not None:
+            for checkpoint in checkpoints:
+                acknowledge(checkpoint)
+
+    def status(self):
+        return f'{self.bytes / 2**20:.1f} MB written to {self.files} files'
+
+    def close(self):
+        print(f' => -> Wrote {self.actions} actions, {self.bytes / 2**20:.1f} MB, to {self.files} files in {self.directory}')
+
+
+class NullSink:
+    """
+    A sink that encodes bulk actions and discards them, counting the actions
+    and bytes, to measure the throughput of the indexer without a cluster.
+
+    Attributes:
+        actions: The number of actions
+        bytes: The number of bytes of the encoded actions
+    """
+
+    def __init__(self):
+        self.actions = 0
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def send(self, actions, acknowledge=None, requests=None):
+        for lines in bulk_action_lines(actions):
+            if isinstance(lines, dict):
+                if acknowledge is not None:
+                    acknowledge(lines['_checkpoint'])
+                continue
+            size = sum(len(line) + 1 for line in lines)
+            with self.lock:
+                self.actions += 1
+                self.bytes += size
+            yield (True, None)
+
+    def status(self):
+        return f'{self.bytes / 2**20:.1f} MB discarded'
+
+    def close(self):
+        print(f' => -> Discarded {self.actions} actions, {self.bytes / 2**20:.1f} MB')
+
+
+def bulk_insert_actions(sink, actions, acknowledge=None, requests=None):
+    i = 0
+    for success, info in sink.send(actions, acknowledge, requests):
+        i += 1
+
+        if i%10000 == 0:
+            print(f'indexed {i} documents ({sink.status()})')
+
+        if not success:
+            print('A document failed:', info)
+
+
+def bulk_file_group(path):
+    """
+    Returns the group number of a bulk file, see BULK_FILE_PATTERN.
+    """
+    return int(Path(path).name.split('-')[1])
+
+
+def read_bulk_file(path, indices=None):
+    """
+    Read the actions of a bulk file written by a NdjsonBulkFileSink.
+
+    Args:
+        path: The path of the file
+        indices: A dictionary mapping the '_index' of the actions to the
+                 names of the indices they are sent to, if any
+
+    Yields:
+        A tuple of the action line and the body, if any, of each action.
+    """
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            action_line = line.rstrip('\n')
+            if indices is not None:
+                ((op_type, meta),) = orjson.loads(action_line).items()
+                meta['_index'] = indices[meta['_index']]
+                action_line = encode_document({op_type: meta})
+            if action_line.startswith('{"delete"'):
+                yield (action_line,)
+            else:
+                yield (action_line, next(f).rstrip('\n'))
+
+
+def replay_bulk_files(es, directory, workers=BULK_THREADS):
+    """
+    Send the bulk files of a directory, written by a NdjsonBulkFileSink, to
+    the indices of ALIAS_INDEX_MAPPING.
+
+    The groups of files are replayed in order, as the actions of a group may
+    update the documents of the groups before it, and the files of a group
+    are replayed in parallel, each by an AdaptiveBulkSender with one request
+    in flight.
+
+    Args:
+        es: An Elasticsearch client
+        directory: The directory of the bulk files
+        workers: The number of files replayed in parallel
+
+    Returns:
+        The number of actions that failed.
+    """
+    paths = sorted(Path(directory).glob('bulk-*.ndjson.gz'))
+    if not paths:
+        raise Exception(f'No bulk files in {directory}')
+
+    failures = 0
+    with ThreadPoolExecutor(workers) as executor:
+        for (group, files) in groupby(paths, key=bulk_file_group):
+            files = list(files)
+            print(f' => Replaying group {group} of {len(files)} files')
+            for (path, count, failed) in executor.map(lambda path: replay_bulk_file(es, path), files):
+                print(f' => -> {path.name}: {count} actions, {failed} failed')
+                failures += failed
+    return failures
+
+
+def replay_bulk_file(es, path):
+    """
+    Send the actions of a bulk file to the indices of ALIAS_INDEX_MAPPING.
+
+    Returns:
+        A tuple of the path, the number of actions and the number of failed
+        actions.
+    """
+    sender = AdaptiveBulkSender(es, thread_count=1)
+    count = 0
+    failed = 0
+    for (success, info) in sender.send_lines(read_bulk_file(path, ALIAS_INDEX_MAPPING)):
+        count += 1
+        if not success:
+            failed += 1
+            print('A document failed:', info)
+    return (path, count, failed)
+
+def csv_index_sources(sink, sources, requests=None):
+    """
+    Bulk indexes documents in the 'life_courses' index.
+    
+    This only creates the empty life course documents without any person
+    appearances, which are added to this index by the `csv_index_pa` function.
+
+    Args:
+        sink: A sink for the bulk actions, see ``ElasticsearchSink``
+        life_courses: An iterable of life course rows, which is consumed as
+                      the documents are indexed
+        bulk_helper: Helper function for Elasticsearch _bulk endpoint
+    """
+   # for s in sources:
+    #    print(s.es_document())
+    actions = [{'_op_type': 'index', '_index': 'sources', '_id': s.source_id, '_source': encode_document({"source": s.es_document()}) } for s in sources]
+    bulk_insert_actions(sink, actions, requests=requests)
+
+def csv_index_life_courses(sink, life_courses, requests=None):
+    """
+    Bulk indexes documents in the 'life_courses' index.
+    
+    This only creates the empty life course documents without any person
+    appearances, which are added to this index by the `csv_index_pa` function.
+
+    Args:
+        sink: A sink for the bulk actions, see ``ElasticsearchSink``
+        life_courses: An iterable of life course rows, which is consumed as
+                      the documents are indexed
+        requests: The number of bulk requests in flight, or None for the
+                  default of the sink
+    """
+    actions = ({'_op_type': 'index', '_index': 'lifecourses', '_id': lc[''], '_source': encode_document({'life_course_id': lc[''], 'person_appearance': []}) } for lc in life_courses)
+    bulk_insert_actions(sink, actions, requests=requests)
+
+
+def csv_index_links(sink, links, requests=None):
+    """
+    Bulk indexes documents in the 'links' index.
+
+    This only creates the link documents with link metadata, without any person
+    appearances, which are added to this index by the `csv_index_pas` function.
+
+    Args:
+        sink: A sink for the bulk actions, see ``ElasticsearchSink``
+        links: An iterable of tuples of link rows and the ids of the life
+               courses of the links, see ``csv_link_life_courses``, which is
+               consumed as the documents are indexed
+        requests: The number of bulk requests in flight, or None for the
+                  default of the sink
+    """
+    actions = ({'_op_type': 'index', '_index': 'links', '_id': li['link_id'], '_routing': link_routing(life_course_ids), '_source': encode_document({'link_id': li['link_id'], 'life_course_ids': life_course_ids, 'link': li, 'person_appearance': []}) } for (li, life_course_ids) in links)
+
+    bulk_insert_actions(sink, actions, requests=requests)
+
+
+def link_routing(life_course_ids):
+    """
+    Returns the routing of a link document, the smallest of the ids of the
+    life courses it belongs to, so that a link is stored in the same shard as
+    the first of its life courses. A link of several life courses is only
+    stored in that shard, not in the shards of its other life courses. Links
+    that belong to no life course are routed by their id, and None is
+    returned.
+    """
+    return str(min(life_course_ids)) if life_course_ids else None
+
+
+class Partition:
+    """
+    One of ``count`` disjoint slices of a build, which are indexed by
+    separate indexer processes into the same indices, see ``csv_index``.
+
+    Documents are assigned to partitions by a stable hash of a key, the
+    first 8 bytes of its BLAKE2b digest: life courses by their id, links by
+    the life course they are routed by, see ``link_routing``, and person
+    appearances by the first of their life courses. Links and person
+    appearances that belong to no life course are assigned by their id. So
+    a life course, the links whose first life course it is, and most of its
+    person appearances are indexed by the same partition.
+
+    Each partition still reads, converts and joins all of the census data,
+    as the owner of a person appearance is known once it is joined. Only
+    the person appearances a partition needs are encoded, spilled to the
+    document assembler and sent, see ``Partition.needs_pa``.
+
+    Attributes:
+        index: The index of the partition, from 0
+        count: The number of partitions
+    """
+
+    def __init__(self, index, count):
+        if not 0 <= index < count:
+            raise ValueError(f'partition {index + 1} is not one of 1 to {count}')
+        self.index = index
+        self.count = count
+
+    @staticmethod
+    def parse(value):
+        """
+        Parse a partition given as 'i/N', the i-th of N partitions, from 1.
+        """
+        (i, n) = value.split('/')
+        return Partition(int(i) - 1, int(n))
+
+    def __str__(self):
+        return f'{self.index + 1}/{self.count}'
+
+    def owns(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest()
+        return int.from_bytes(digest, 'big') % self.count == self.index
+
+    def owns_life_course(self, life_course_id):
+        return self.owns(str(int(life_course_id)))
+
+    def owns_link(self, link_id, life_course_ids):
+        """
+        Whether the partition owns a link, given the ids of its life courses,
+        see ``csv_link_life_courses``.
+        """
+        if life_course_ids:
+            return self.owns_life_course(min(int(lc) for lc in life_course_ids))
+        return self.owns(f'link-{link_id}')
+
+    def owns_pa(self, pa_id, life_course_ids):
+        """
+        Whether the partition owns a person appearance, given its id, see
+        ``PersonAppearance.es_document()``, and the ids of its life courses.
+        """
+        if life_course_ids:
+            return self.owns_life_course(min(int(lc) for lc in life_course_ids))
+        return self.owns(f'pa-{pa_id}')
+
+    def needs_pa(self, pa_id, life_course_ids, link_ids):
+        """
+        Whether the partition needs a person appearance, because it owns the
+        person appearance, one of its life courses or one of its links. The
+        life courses of a link are life courses of both of its person
+        appearances, so a link is owned by the partition of one of the life
+        courses of the person appearance, or by its id. Some person
+        appearances of links of other partitions are needed too.
+        """
+        return (self.owns_pa(pa_id, life_course_ids)
+                or any(self.owns_life_course(lc) for lc in life_course_ids)
+                or any(self.owns(f'link-{link_id}') for link_id in link_ids))
+
+
+def csv_link_life_courses(links, pa_life_courses, link_life_courses):
+    """
+    Find the life courses of links, which are the life courses that both of
+    the person appearances of a link belong to, and record them in a join
+    index.
+
+    Args:
+        links: An iterable of (link_id, row) tuples, see ``csv_read_links``
+        pa_life_courses: A frozen join index mapping pa_id to
+                         [life_course_id]
+        link_life_courses: A join index that (link_id, LINK_KEY_SOURCE,
+                           life_course_id) entries are added to
+
+    Yields:
+        Tuples of link rows and sorted lists of integer life course ids
+    """
+    for batch in batched(links, LOOKUP_BATCH_SIZE):
+        first = join_index_get_many(pa_life_courses, [(row['pa_id1'], row['source_id1']) for (_, row) in batch])
+        second = join_index_get_many(pa_life_courses, [(row['pa_id2'], row['source_id2']) for (_, row) in batch])
+        for ((link_id, row), first_ids, second_ids) in zip(batch, first, second):
+            life_course_ids = sorted(set(int(lc) for lc in first_ids) & set(int(lc) for lc in second_ids))
+            for life_course_id in life_course_ids:
+                link_life_courses.add(link_id, LINK_KEY_SOURCE, life_course_id)
+            yield (row, life_course_ids)
+
+
+def route_link_actions(actions, link_life_courses):
+    """
+    Set the routing of the actions of the 'links' index of an iterable of
+    bulk actions, see ``link_routing``, looking up the life courses of the
+    links in batches.
+
+    Args:
+        actions: An iterable of bulk actions
+        link_life_courses: A frozen join index of the life courses of the
+                           links, see ``csv_link_life_courses``
+
+    Returns:
+        A generator of the bulk actions.
+    """
+    for batch in batched(actions, LOOKUP_BATCH_SIZE):
+        link_ids = [action['_id'] for action in batch if action.get('_index') == 'links']
+        life_course_ids = dict(zip(link_ids, join_index_get_many(link_life_courses, [(link_id, LINK_KEY_SOURCE) for link_id in link_ids])))
+        for action in batch:
+            if action.get('_index') == 'links':
+                action['_routing'] = link_routing(life_course_ids[action['_id']])
+            yield action
+
+
+def csv_pa_bulk_actions(pa, life_courses, links, profile='full'):
+    """
+    Generates the bulk actions for indexing a given person appearance, and
+    adding this person appearance to the relevant links and life courses.
+
+    The person appearance document is encoded once, and the encoded document
+    is spliced into the body of every action.
+
+    Args:
+        pa: A person appearance document or EncodedPa
+        life_courses: A list of life course ids
+        links: A list of link ids
+        profile: One of PA_PROFILES, the fields of the person appearance
+                 added to the links and life courses
+    
+    Returns:
+        A generator of Elasticsearch bulk actions
+    """
+    pa = encode_pa(pa, profile)
+    pa_json = pa.embedded
+
+    yield {
+        '_op_type': 'index',
+        '_index': 'pas',
+        '_id': pa.id,
+        '_source': '{"person_appearance":' + pa.json + '}'
+    }
+
+    for link in links:
+        yield {
+            '_op_type': 'update',
+            '_index': 'links',
+            '_id': link,
+            '_source': PA_APPEND_PREFIX + pa_json + PA_APPEND_SUFFIX
+        }
+
+    for life_course in life_courses:
+        yield {
+            '_op_type': 'update',
+            '_index': 'lifecourses',
+            '_id': life_course,
+            '_source': PA_APPEND_PREFIX + pa_json + PA_APPEND_SUFFIX
+        }
+
+
+def csv_pas_bulk_actions(pas, profile='full'):
+    """
+    Generates bulk actions for the given iterator of person appearance
+    document, life course ids, and link ids tuples.
+
+    Args:
+        pas: A list of tuples containing person appearance documents or
+            EncodedPa tuples, lists of life course ids and lists of link ids,
+            and CensusProgress tuples, which become checkpoint actions.
+        profile: One of PA_PROFILES, see ``csv_pa_bulk_actions``
+
+    Returns:
+        A generator of Elasticsearch bulk actions.
+    """
+    for item in pas:
+        if isinstance(item, CensusProgress):
+            yield checkpoint_action(item)
+            continue
+        (pa, life_courses, links) = item
+        for action in csv_pa_bulk_actions(pa, life_courses, links, profile):
+            yield action
+
+
+def csv_pas_assemble_actions(pas, assembler, profile='full', partition=None):
+    """
+    Generates bulk actions for indexing the given person appearances in the
+    'pas' index, and adds the person appearances to the links and life
+    courses of the assembler, which are indexed afterwards.
+
+    Args:
+        pas: A list of tuples containing person appearance documents or
+            EncodedPa tuples, lists of life course ids and lists of link ids,
+            and CensusProgress tuples, which become checkpoint actions.
+        assembler: A DocumentAssembler
+        profile: One of PA_PROFILES, the fields of the person appearances
+                 added to the links and life courses
+        partition: A Partition, if only its person appearances are indexed
+                   and only its life courses are assembled. ``pas`` should
+                   only have the person appearances the partition needs,
+                   see ``csv_census_pas``. They are added to all of their
+                   links, of which the assembler only emits the links of
+                   the partition.
+
+    Returns:
+        A generator of Elasticsearch bulk actions.
+    """
+    for item in pas:
+        if isinstance(item, CensusProgress):
+            yield checkpoint_action(item)
+            continue
+        (pa, life_courses, links) = item
+        pa = encode_pa(pa, profile)
+        if partition is None:
+            assembler.add_pa(pa, life_courses, links)
+        else:
+            assembler.add_pa(pa, [lc for lc in life_courses if partition.owns_life_course(lc)], links)
+            if not partition.owns_pa(pa.id, life_courses):
+                continue
+
+        yield {
+            '_op_type': 'index',
+            '_index': 'pas',
+            '_id': pa.id,
+            '_source': '{"person_appearance":' + pa.json + '}'
+        }
+
+
+def csv_assembled_life_course_actions(assembler):
+    """
+    Generates bulk actions for indexing the complete life course documents of
+    the given assembler.
+
+    Args:
+        assembler: A DocumentAssembler containing all person appearances
+
+    Returns:
+        A generator of Elasticsearch bulk actions.
+    """
+    for (life_course_id, _, pas) in assembler.documents('lifecourses'):
+        yield {
+            '_op_type': 'index',
+            '_index': 'lifecourses',
+            '_id': life_course_id,
+            '_source': '{"life_course_id":' + encode_document(life_course_id) + ',"person_appearance":[' + ','.join(pas) + ']}'
+        }
+
+
+def csv_assembled_link_actions(assembler, link_life_courses=None):
+    """
+    Generates bulk actions for indexing the complete link documents of the
+    given assembler.
+
+    Args:
+        assembler: A DocumentAssembler containing all person appearances
+        link_life_courses: A frozen join index of the life courses of the
+                           links, see ``csv_link_life_courses``, by which the
+                           links are routed, if any
+
+    Returns:
+        A generator of Elasticsearch bulk actions.
+    """
+    for batch in batched(assembler.documents('links'), LOOKUP_BATCH_SIZE):
+        if link_life_courses is None:
+            life_course_ids = [None] * len(batch)
+        else:
+            life_course_ids = join_index_get_many(link_life_courses, [(link_id, LINK_KEY_SOURCE) for (link_id, _, _) in batch])
+
+        for ((link_id, link, pas), link_lcs) in zip(batch, life_course_ids):
+            action = {
+                '_op_type': 'index',
+                '_index': 'links',
+                '_id': link_id,
+                '_source': '{"link_id":' + encode_document(link_id) + ',"link":' + link + ',"person_appearance":[' + ','.join(pas) + ']}'
+            }
+            if link_lcs is not None:
+                action['_routing'] = link_routing(link_lcs)
+                action['_source'] = '{"link_id":' + encode_document(link_id) + ',"life_course_ids":' + encode_document(sorted(link_lcs)) + ',"link":' + link + ',"person_appearance":[' + ','.join(pas) + ']}'
+            yield action
+
+
+def manifest_delta_actions(kind, actions, manifest):
+    """
+    Record the documents of the index actions of an index in a manifest, and
+    generate the actions of the documents that are new or changed since the
+    previous build, followed by delete actions for the documents of the
+    previous build that are gone. A document whose routing changed is
+    deleted with its previous routing before it is indexed again.
+
+    Args:
+        kind: The alias of the index of the actions
+        actions: An iterable of 'index' bulk actions for the whole index
+        manifest: A ContentManifest
+
+    Returns:
+        A generator of Elasticsearch bulk actions.
+    """
+    total = 0
+    changed = 0
+    deleted = 0
+    for batch in batched(actions, LOOKUP_BATCH_SIZE):
+        documents = [(action['_id'], action['_source'], action.get('_routing')) for action in batch if action['_op_type'] != 'checkpoint']
+        (ids, moved) = manifest.changed(kind, documents)
+        total += len(documents)
+        for action in batch:
+            if action['_op_type'] == 'checkpoint':
+                yield action
+            elif str(action['_id']) in ids:
+                changed += 1
+                if str(action['_id']) in moved:
+                    yield {'_op_type': 'delete', '_index': kind, '_id': action['_id'], '_routing': moved[str(action['_id'])]}
+                yield action
+
+    for (doc_id, routing) in manifest.removed(kind):
+        deleted += 1
+        yield {'_op_type': 'delete', '_index': kind, '_id': doc_id, '_routing': routing}
+
+    print(f' => -> {kind}: {changed} of {total} documents new or changed, {deleted} deleted')
+
+
+def batched(iterable, n):
+    """
+    Returns a generator of lists of ``n`` consecutive items of an iterable,
+    the last of which may be shorter.
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, n))
+        if not batch:
+            return
+        yield batch
+
+
+def csv_read_pas(sources, csv_files, pa_life_courses, pa_links, fast_csv='never', cache_dir=None, partition=None):
+    """
+    Reads CSV files containing person appearance data, and generates tuples of
+    person appearance documents, lists of life course ids, and lists of link
+    ids.
+
+    Args:
+        sources: A dictionary mapping source_id to Source objects
+        csv_files: An iterator of pathlib.Path-like objects that can be opened.
+        pa_life_courses: A join index mapping pa_id to [life_course_id]
+        pa_links: A join index mapping pa_id to [link_id]
+        fast_csv: One of FAST_CSV_MODES, whether files are read with the
+                  fast reader for files without quoted values.
+        cache_dir: A pathlib.Path of the directory of the columnar cache
+                   files the files are read from, see ``columnar_cache``,
+                   or None to read the CSV files
+        partition: A Partition, if only the person appearances it needs are
+                   generated, see ``csv_join_pas``
+
+    Returns:
+        A generator, generating tuples of person appearance documents, lists
+        of life course ids, and lists of link ids
+    """
+    for csv_path in csv_files:
+        print(f' => -> Indexing census data from {csv_path}')
+        if cache_dir is not None:
+            yield from columnar_read_pas(sources, csv_path, cache_dir, pa_life_courses, pa_links, fast_csv, partition)
+            continue
+
+        rows = csv_numbered_rows(csv_path, csv_use_fast_reader(csv_path, fast_csv))
+        try:
+            (_, header) = next(rows)
+            converter = PersonAppearanceBatchConverter(header, getSourceIdByFilePath(sources, csv_path.name))
+        except Exception as e:
+            print(f" => -> Error: {repr(e)} file={csv_path}")
+            rows.close()
+            continue
+
+        for block in batched((numbered for numbered in rows if numbered[1]), PA_BATCH_ROWS):
+            pas = csv_convert_pas(converter, block, f'file={csv_path}')
+            for batch in batched(pas, LOOKUP_BATCH_SIZE):
+                METRICS.count('indexer_rows_parsed_total', len(batch), file=csv_path.name)
+                yield from csv_join_pas(batch, pa_life_courses, pa_links, partition)
+
+
+def columnar_read_pas(sources, csv_path, cache_dir, pa_life_courses, pa_links, fast_csv='auto', partition=None):
+    """
+    Reads the person appearances of a census CSV file from its columnar cache
+    file in blocks of PA_BATCH_ROWS rows, see ``csv_read_pas``.
+    """
+    try:
+        cache_path = columnar_cache(csv_path, cache_dir, fast_csv)
+        (converter, columns) = columnar_pa_converter(cache_path, getSourceIdByFilePath(sources, csv_path.name))
+    except Exception as e:
+        print(f" => -> Error: {repr(e)} file={csv_path}")
+        return
+
+    first_row = 0
+    for block in parquet.ParquetFile(str(cache_path)).iter_batches(batch_size=PA_BATCH_ROWS, columns=columns):
+        pas = columnar_convert_pas(block, converter, cache_path, first_row)
+        first_row += block.num_rows
+        for batch in batched(pas, LOOKUP_BATCH_SIZE):
+            METRICS.count('indexer_rows_parsed_total', len(batch), file=csv_path.name)
+            yield from csv_join_pas(batch, pa_life_courses, pa_links, partition)
+
+
+def csv_join_pas(batch, pa_life_courses, pa_links, partition=None):
+    """
+    Look up the life course and link ids of a batch of person appearances.
+
+    Args:
+        batch: A list of tuples of (pa_id, source_id) keys and person
+               appearance documents
+        pa_life_courses: A join index mapping pa_id to [life_course_id]
+        pa_links: A join index mapping pa_id to [link_id]
+        partition: A Partition, if only the person appearances it needs are
+                   generated, see ``Partition.needs_pa``
+
+    Returns:
+        A generator of tuples of person appearance documents, lists of life
+        course ids, and lists of link ids
+    """
+    keys = [key for (key, _) in batch]
+    life_course_ids = join_index_get_many(pa_life_courses, keys)
+    link_ids = join_index_get_many(pa_links, keys)
+
+    for ((_, document), life_courses, links) in zip(batch, life_course_ids, link_ids):
+        if partition is None or partition.needs_pa(document['id'], life_courses, links):
+            yield (document, life_courses, links)
+
+
+# The join indices of a census worker process, see csv_init_worker
+WORKER_JOIN_INDICES = None
+
+
+def csv_init_worker(pa_life_courses, pa_links):
+    """
+    Initialize a forked census worker process with the join indices of the
+    parent process. In-memory indices are shared copy-on-write, while disk
+    indices are reopened, as SQLite connections must not be used across forks.
+    """
+    global WORKER_JOIN_INDICES
+    WORKER_JOIN_INDICES = tuple(
+        SqliteJoinIndex.open(index.path) if isinstance(index, SqliteJoinIndex) else index
+        for index in (pa_life_courses, pa_links)
+    )
+
+
+def csv_convert_range(csv_path, header, source_id, start, end, fast, profile='full', partition=None):
+    """
+    Parse, convert, join and encode the person appearances in a byte range of
+    a census CSV file. Runs in a census worker process.
+
+    Args:
+        csv_path: A pathlib.Path of the CSV file
+        header: A list of the column names of the CSV file
+        source_id: The source id of the person appearances in the file
+        start: The offset of the first line of the range
+        end: The offset after the last line of the range
+        fast: If true the range is read with ``read_csv_rows``
+        profile: One of PA_PROFILES, see ``encode_pa``
+        partition: A Partition, if only the person appearances it needs are
+                   encoded, see ``csv_join_pas``
+
+    Returns:
+        A list of tuples of EncodedPa tuples, lists of life course ids, and
+        lists of link ids.
+    """
+    (pa_life_courses, pa_links) = WORKER_JOIN_INDICES
+    converter = PersonAppearanceBatchConverter(header, source_id)
+
+    if fast:
+        rows = read_csv_rows(csv_path, start=start, end=end)
+    else:
+        with csv_path.open('rb') as csvfile:
+            csvfile.seek(start)
+            data = csvfile.read(end - start).decode('utf-8')
+        rows = csv.reader(io.StringIO(data), delimiter='$', quotechar='"')
+
+    batch = []
+    for block in batched(((line_num, row) for (line_num, row) in enumerate(rows, start=1) if row), PA_BATCH_ROWS):
+        batch.extend(csv_convert_pas(converter, block, f'range={start}-{end} file={csv_path}'))
+
+    return [(encode_pa(document, profile), life_courses, links) for (document, life_courses, links) in csv_join_pas(batch, pa_life_courses, pa_links, partition)]
+
+
+def columnar_convert_range(cache_path, source_id, row_group, first_row, profile='full', partition=None):
+    """
+    Convert, join and encode the person appearances of a row group of a
+    census cache file, see ``csv_convert_range``. Runs in a census worker
+    process.
+
+    Args:
+        cache_path: A pathlib.Path of the cache file
+        source_id: The source id of the person appearances in the file
+        row_group: The index of the row group
+        first_row: The number of the first row of the row group
+        profile: One of PA_PROFILES, see ``encode_pa``
+        partition: A Partition, see ``csv_convert_range``
+
+    Returns:
+        A list of tuples of EncodedPa tuples, lists of life course ids, and
+        lists of link ids.
+    """
+    (pa_life_courses, pa_links) = WORKER_JOIN_INDICES
+    (converter, columns) = columnar_pa_converter(cache_path, source_id)
+    table = parquet.ParquetFile(str(cache_path)).read_row_group(row_group, columns=columns)
+    batch = columnar_convert_pas(table, converter, cache_path, first_row)
+
+    return [(encode_pa(document, profile), life_courses, links) for (document, life_courses, links) in csv_join_pas(batch, pa_life_courses, pa_links, partition)]
+
+
+def csv_census_ranges(csv_path, source_id, fast_csv, checkpoint, profile='full', partition=None):
+    """
+    Split a census CSV file into byte ranges, from the offset of the
+    checkpoint if any.
+
+    Returns:
+        A list of (progress_path, end, job) tuples of the ranges, where the
+        offset ``end`` of the file ``progress_path`` has been read once the
+        job, a function and its arguments, is done.
+    """
+    with csv_path.open('rb') as csvfile:
+        header_line = csvfile.readline()
+        header = next(csv.reader([header_line.decode('utf-8').rstrip('\r\n')], delimiter='$', quotechar='"'))
+    PersonAppearanceBatchConverter(header, source_id)
+
+    start = len(header_line)
+    if checkpoint is not None and checkpoint.census_offset(csv_path) > start:
+        start = checkpoint.census_offset(csv_path)
+        print(f' => -> Resuming {csv_path} at byte {start}')
+
+    fast = csv_use_fast_reader(csv_path, fast_csv)
+    return [(csv_path, end, (csv_convert_range, csv_path, header, source_id, start, end, fast, profile, partition)) for (start, end) in split_byte_ranges(csv_path, start, quoted=not fast)]
+
+
+def columnar_census_ranges(cache_path, source_id, checkpoint, profile='full', partition=None):
+    """
+    Split a census cache file into its row groups, from the row of the
+    checkpoint if any, see ``csv_census_ranges``. The progress of the file
+    is the number of rows that have been read.
+    """
+    columnar_pa_converter(cache_path, source_id)
+    offset = checkpoint.census_offset(cache_path) if checkpoint is not None else 0
+    if offset > 0:
+        print(f' => -> Resuming {cache_path} at row {offset}')
+
+    ranges = []
+    end = 0
+    metadata = parquet.ParquetFile(str(cache_path)).metadata
+    for row_group in range(metadata.num_row_groups):
+        (start, end) = (end, end + metadata.row_group(row_group).num_rows)
+        if end > offset:
+            ranges.append((cache_path, end, (columnar_convert_range, cache_path, source_id, row_group, start, profile, partition)))
+    return ranges
+
+
+def split_byte_ranges(csv_path, start, range_bytes=None, quoted=False):
+    """
+    Split a file into byte ranges of about ``range_bytes`` bytes that start
+    and end on line boundaries.
+
+    Args:
+        csv_path: A pathlib.Path of the file
+        start: The offset of the first line of the first range
+        range_bytes: The approximate size of each range, RANGE_BYTES if not
+                     given
+        quoted: Whether the file may have quoted values spanning multiple
+                lines. The ranges then end on the boundaries of the rows
+                the csv module reads, which takes a pass over the file.
+
+    Returns:
+        A list of (start, end) tuples.
+    """
+    if range_bytes is None:
+        range_bytes = RANGE_BYTES
+    if quoted:
+        return split_csv_row_ranges(csv_path, start, range_bytes)
+
+    ranges = []
+    size = csv_path.stat().st_size
+    with csv_path.open('rb') as f:
+        while start < size:
+            f.seek(min(start + range_bytes, size))
+            f.readline()
+            end = min(f.tell(), size)
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def split_csv_row_ranges(csv_path, start, range_bytes):
+    """
+    Split a file into byte ranges of about ``range_bytes`` bytes that end
+    on the boundaries of the rows read by the csv module, see
+    ``split_byte_ranges``.
+    """
+    offset = start
+
+    def lines():
+        nonlocal offset
+        with csv_path.open('rb') as csvfile:
+            csvfile.seek(start)
+            for line in csvfile:
+                offset += len(line)
+                yield line.decode('utf-8')
+
+    # the reader reads the lines of a row, and no further, before the row
+    # is generated
+    ranges = []
+    for _ in csv.reader(lines(), delimiter='$', quotechar='"'):
+        if offset - start >= range_bytes:
+            ranges.append((start, offset))
+            start = offset
+    if offset > start:
+        ranges.append((start, offset))
+    return ranges
+
+
+def csv_read_pas_parallel(sources, csv_files, pa_life_courses, pa_links, workers, fast_csv='never', checkpoint=None, profile='full', cache_dir=None, partition=None):
+    """
+    Reads CSV files containing person appearance data in a pool of worker
+    processes, and generates tuples of EncodedPa tuples, lists of life course
+    ids, and lists of link ids, in the order of the files.
+
+    Each file is split into byte ranges on line boundaries, which are parsed,
+    converted and encoded by the workers. At most two ranges per worker are
+    in flight, so memory usage is bounded. Files that are not read with the
+    fast reader are split on the boundaries of their rows, so that quoted
+    values spanning multiple lines are not split. With a single worker the
+    ranges are read in the current process. Files read from their columnar cache files are split into row
+    groups instead, which support values spanning multiple lines.
+
+    Args:
+        sources: A dictionary mapping source_id to Source objects
+        csv_files: An iterator of pathlib.Path objects
+        pa_life_courses: A join index mapping pa_id to [life_course_id]
+        pa_links: A join index mapping pa_id to [link_id]
+        workers: The number of worker processes
+        fast_csv: One of FAST_CSV_MODES, whether files are read with the
+                  fast reader for files without quoted values.
+        checkpoint: A BuildCheckpoint. Files are read from the offset of the
+                    checkpoint, and a CensusProgress tuple is generated after
+                    the person appearances of each range.
+        profile: One of PA_PROFILES, see ``encode_pa``
+        cache_dir: A pathlib.Path of the directory of the columnar cache
+                   files the files are read from, see ``columnar_cache``,
+                   or None to read the CSV files
+        partition: A Partition, if only the person appearances it needs are
+                   encoded, see ``csv_join_pas``
+
+    Returns:
+        A generator, generating tuples of EncodedPa tuples, lists of life
+        course ids, and lists of link ids
+    """
+    if workers > 1:
+        context = multiprocessing.get_context('fork')
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=csv_init_worker, initargs=(pa_life_courses, pa_links))
+    else:
+        csv_init_worker(pa_life_courses, pa_links)
+        pool = InlineExecutor()
+
+    with pool:
+        for csv_path in csv_files:
+            print(f' => -> Indexing census data from {csv_path} with {workers} workers')
+            try:
+                source_id = getSourceIdByFilePath(sources, csv_path.name)
+                if cache_dir is not None:
+                    ranges = columnar_census_ranges(columnar_cache(csv_path, cache_dir, fast_csv), source_id, checkpoint, profile, partition)
+                else:
+                    ranges = csv_census_ranges(csv_path, source_id, fast_csv, checkpoint, profile, partition)
+            except Exception as e:
+                print(f" => -> Error: {repr(e)} file={csv_path}")
+                continue
+
+            in_flight = deque()
+            for (progress_path, end, job) in ranges:
+                if len(in_flight) == 2 * workers:
+                    yield from csv_range_results(in_flight.popleft(), csv_path, checkpoint)
+                in_flight.append((pool.submit(*job), progress_path, end))
+                METRICS.set('indexer_queue_depth', len(in_flight), queue='census_ranges')
+
+            while in_flight:
+                yield from csv_range_results(in_flight.popleft(), csv_path, checkpoint)
+            METRICS.set('indexer_queue_depth', 0, queue='census_ranges')
+
+
+def csv_range_results(in_flight, csv_path, checkpoint):
+    """
+    Generates the person appearances of a range submitted by
+    ``csv_read_pas_parallel``, followed by the progress of the file if
+    there is a checkpoint.
+    """
+    (future, progress_path, end) = in_flight
+    pas = future.result()
+    METRICS.count('indexer_rows_parsed_total', len(pas), file=csv_path.name)
+    yield from pas
+    if checkpoint is not None:
+        yield CensusProgress(str(progress_path), end)
+
+
+class InlineExecutor:
+    """
+    An executor that runs the submitted functions in the current process
+    when they are submitted.
+    """
+
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+def csv_census_pas(sources, csv_dir, pa_life_courses, pa_links, workers=1, fast_csv='auto', checkpoint=None, profile='full', cache_dir=None, partition=None):
+    """
+    Reads the census and burial CSV files of a directory, either in the
+    current process or in a pool of ``workers`` processes, using the fast
+    reader according to ``fast_csv``.
+
+    With an enabled BuildCheckpoint the files are read in byte ranges, also
+    with a single worker, and the progress of each file is generated as
+    CensusProgress tuples, see ``csv_read_pas_parallel``. Person appearances
+    read in byte ranges are encoded with the PA_PROFILES ``profile``. With a
+    ``cache_dir`` the files are read from their columnar cache files, see
+    ``columnar_cache``. With a ``partition`` only the person appearances it
+    needs are generated, see ``Partition.needs_pa``.
+
+    Returns:
+        A generator, generating tuples of person appearance documents or
+        EncodedPa tuples, lists of life course ids, and lists of link ids
+    """
+    csv_files = [f for f in csv_dir.iterdir() if f.suffix == '.csv' and (f.stem.startswith('census') or f.stem.startswith('cph_burials'))]
+    if checkpoint is not None and checkpoint.enabled:
+        return csv_read_pas_parallel(sources, csv_files, pa_life_courses, pa_links, workers, fast_csv, checkpoint, profile, cache_dir, partition)
+    if workers > 1:
+        return csv_read_pas_parallel(sources, csv_files, pa_life_courses, pa_links, workers, fast_csv, profile=profile, cache_dir=cache_dir, partition=partition)
+    return csv_read_pas(sources, csv_files, pa_life_courses, pa_links, fast_csv, cache_dir, partition)
+
+
+def csv_load_sources(csv_dir, cache_dir=None):
+    """
+    Load the sources of a directory of link lives data.
+
+    Args:
+        csv_dir: A pathlib.Path of the directory containing the source data
+        cache_dir: A pathlib.Path of the directory of the columnar cache
+                   files, see ``csv_dict_rows``
+
+    Returns:
+        A dictionary mapping source_id to Source objects
+    """
+    sources = {}
+
+    for csv_path in [f for f in csv_dir.iterdir() if f.suffix == '.csv' and f.stem.startswith('sources')]:
+        print(f' => Loading sources data from {csv_path}')
+        for item in csv_dict_rows(csv_path, cache_dir):
+            source_id = item['source_id']
+
+            # add the soure to the sources dict
+            sources[source_id] = Source.from_dict(item)
+
+
+    print(f' => -> Loaded {len(sources)} sources')
+
+    return sources
+
+
+def csv_read_life_courses(csv_dir, pa_life_courses, cache_dir=None):
+    """
+    Read the life courses of a directory of link lives data one row at a time,
+    adding the person appearances of each life course to a join index as the
+    row is read.
+
+    Args:
+        csv_dir: A pathlib.Path of the directory containing the life course data
+        pa_life_courses: A join index that (pa_id, source_id, life_course_id)
+                         entries are added to
+        cache_dir: A pathlib.Path of the directory of the columnar cache
+                   files, see ``csv_dict_rows``
+
+    Yields:
+        (life_course_id, row) tuples
+    """
+    count = 0
+
+    for csv_path in [f for f in csv_dir.iterdir() if f.suffix == '.csv' and f.stem.startswith('life_courses')]:
+        print(f' => Loading life course data from {csv_path}')
+        for item in csv_dict_rows(csv_path, cache_dir):
+            life_course_id = item['']
+            count += 1
+
+            # Original way: Source defined in specific source column
+            # extract the columns of the life course csv that are pa_ids
+            #pa_ids_src = [(key, val) for (key, val) in item.items() if val is not None and key not in ('', 'occurences')]
+
+            # get source id and pa id from comma separated pa_ids and sources fields
+            pa_ids_src = zip(item['sources'].split(","),item['pa_ids'].split(","))
+            #print(next(pa_ids_src))
+            # add each pa_id-source_id combination to the pa_life_course index
+            for source_id, pa_id in pa_ids_src:
+                pa_life_courses.add(pa_id, source_id, life_course_id)
+
+            yield (life_course_id, item)
+
+    print(f' => -> Loaded {count} life courses')
+
+
+def csv_read_links(csv_dir, sources, pa_links, cache_dir=None):
+    """
+    Read the links of a directory of link lives data one row at a time, adding
+    the two person appearances of each link to a join index as the row is
+    read.
 
     Args:
-        method_id: The unique identifier of the method.
+        csv_dir: A pathlib.Path of the directory containing the link data
+        sources: A dictionary mapping source_id to Source objects
+        pa_links: A join index that (pa_id, source_id, link_id) entries are
+                  added to
+        cache_dir: A pathlib.Path of the directory of the columnar cache
+                   files, see ``csv_dict_rows``
+
+    Yields:
+        (link_id, row) tuples
+    """
+    count = 0
 
-    Returns:
-        A dictionary containing the method metadata information, ie. the 'method'
-        and 'description' of the source.
+    for csv_path in [f for f in csv_dir.iterdir() if f.suffix == '.csv' and f.stem.startswith('links')]:
+        print(f' => Loading link data from {csv_path}')
+        for item in csv_dict_rows(csv_path, cache_dir):
+            link_id = item['link_id']
+            count += 1
+
+            method = method_info(item['method_id'])
+
+            item['method_type'] = method['type']
+            item['method_subtype1'] = method['subtype1']
+            item['method_description'] = method['description']
+
+            # add the pa_ids to the pa_links index
+            # get info for the first pa in the link
+            pa_id_1 = item['pa_id1']
+            source_id_1 = item['source_id1']
+            source_1 = sources[source_id_1]
+
+            # get info for the secoond pa in the link
+            pa_id_2 = item['pa_id2']
+            source_id_2 = item['source_id2']
+            source_2 = sources[source_id_2]
+
+            # add each info to the pa_links index
+            for pa_id, source_id in [(pa_id_1, source_1.source_id), (pa_id_2, source_2.source_id)]:
+                pa_links.add(pa_id, source_id, link_id)
+
+            yield (link_id, item)
+
+    print(f' => -> Loaded {count} links')
+
+
+def csv_join_index_report(path):
     """
+    Report the memory footprint of the dict and compact join indices of the
+    person appearances to life courses and links for a directory of link lives
+    data.
 
-    methods = {
-        '0': { 'type': 'Rule Based', 'subtype1': 'primary', 'description': 'rule based links made from personal information only (age, gender, name, birth place)' },
-        '1': { 'type': 'Rule Based', 'subtype1': 'household', 'description': 'links based on household links made by primary links' },
-        '2': { 'type': 'Manual', 'subtype1': '', 'description': 'hand made links' }
+    Args:
+        path: Path to the directory containing life course, link and source data.
+    """
+    csv_dir = Path(path)
+    sources = csv_load_sources(csv_dir)
+
+    for (name, load) in [
+        ('pa -> life courses', lambda index: deque(csv_read_life_courses(csv_dir, index), maxlen=0)),
+        ('pa -> links', lambda index: deque(csv_read_links(csv_dir, sources, index), maxlen=0))
+    ]:
+        dict_index = DictJoinIndex()
+        load(dict_index)
+        dict_size = deep_sizeof(dict_index)
+        entries = len(dict_index)
+        del dict_index
+
+        compact_index = CompactJoinIndex()
+        load(compact_index)
+        compact_index.freeze()
+
+        print(f' => {name}: {entries} person appearances')
+        print(f' => -> dict: {dict_size / 2**20:.1f} MB')
+        print(f' => -> compact: {compact_index.nbytes / 2**20:.1f} MB ({dict_size / max(compact_index.nbytes, 1):.1f}x smaller)')
+
+
+def csv_convert(path, cache_dir, fast_csv='auto'):
+    """
+    Convert the CSV files of a directory of link lives data to columnar cache
+    files, see ``columnar_cache``, and report the sizes of the files. Files
+    that did not change since they were converted are not converted again.
+
+    Args:
+        path: Path to the directory containing life course, link and source data.
+        cache_dir: Path to the directory of the cache files
+        fast_csv: One of FAST_CSV_MODES, how the CSV files are read
+    """
+    csv_dir = Path(path)
+    cache_dir = Path(cache_dir)
+
+    for csv_path in columnar_csv_files(csv_dir):
+        print(f' => {csv_path.name}')
+        start = time.perf_counter()
+        cache_path = columnar_cache(csv_path, cache_dir, fast_csv)
+        csv_size = csv_path.stat().st_size
+        cache_size = cache_path.stat().st_size
+        print(f' => -> {csv_size / 2**20:.1f} MB CSV, {cache_size / 2**20:.1f} MB cached ({csv_size / max(cache_size, 1):.1f}x smaller) in {time.perf_counter() - start:.1f}s')
+
+
+def index_mappings(profile='full', mapping_profile='standard'):
+    """
+    Returns the Elasticsearch mappings of each index, keyed by alias, with
+    the person appearances of the links and life courses of one of
+    PA_PROFILES, and the person appearance fields mapped in one of
+    MAPPING_PROFILES.
+    """
+    return {
+        'sources': mappings_index_sources(),
+        'links': mappings_index_links(profile, mapping_profile),
+        'lifecourses': mappings_index_lifecourses(profile, mapping_profile),
+        'pas': mappings_index_pas(mapping_profile)
     }
-    
-    return methods[str(method_id)]    
 
-def getSourceIdByFilePath(sources, filename):
-    for s in sources:
-        if sources[s].filename is not None and filename.find(sources[s].filename) != -1:
-            return sources[s].source_id
-    raise Exception(f'could not map filename {filename} to source')
 
-def bulk_insert_actions(es, actions):
-    i = 0
-    for success, info in parallel_bulk(es, actions, chunk_size=CHUNK_SIZE):
-        i += 1
+def use_build_indices(timestamp):
+    """
+    Point ALIAS_INDEX_MAPPING to the indices of the build with the given
+    timestamp.
+    """
+    for alias in ALIAS_INDEX_MAPPING:
+        ALIAS_INDEX_MAPPING[alias] = f'{alias}_{timestamp}'
 
-        if i%10000 == 0:
-            print(f'indexed {i} documents')
 
-        if not success:
-            print('A document failed:', info)
+def valid_build_timestamp(timestamp):
+    """
+    Returns whether a string is the timestamp of a build, see
+    BUILD_TIMESTAMP_FORMAT.
+    """
+    try:
+        datetime.strptime(timestamp, BUILD_TIMESTAMP_FORMAT)
+    except ValueError:
+        return False
+    return True
+
 
-def csv_index_sources(es, sources):
+def index_shard_counts(csv_dir, shard_input_bytes=SHARD_INPUT_BYTES):
     """
-    Bulk indexes documents in the 'life_courses' index.
-    
-    This only creates the empty life course documents without any person
-    appearances, which are added to this index by the `csv_index_pa` function.
+    Compute the number of primary shards of each index from the size of the
+    CSV files it is built from: the census files for the 'pas' index, and
+    the census files with the life course or link files for the
+    'lifecourses' and 'links' indices, which embed the person appearances.
+
+    Args:
+        csv_dir: A pathlib.Path of the directory of link lives data
+        shard_input_bytes: The number of bytes of input per shard
+
+    Returns:
+        A dictionary mapping each alias to a number of shards.
+    """
+    def input_bytes(*prefixes):
+        return sum(f.stat().st_size for f in csv_dir.iterdir() if f.suffix == '.csv' and f.stem.startswith(prefixes))
+
+    census = input_bytes('census', 'cph_burials')
+    sizes = {
+        'sources': 0,
+        'pas': census,
+        'lifecourses': census + input_bytes('life_courses'),
+        'links': census + input_bytes('links')
+    }
+    return {alias: max(1, ceil(size / shard_input_bytes)) for (alias, size) in sizes.items()}
+
+
+def create_build_indices(es, timestamp, profile='full', mapping_profile='standard', shards=None, exist_ok=False):
+    """
+    Create a timestamped index for each alias, with its mappings and the
+    build time settings, and point ALIAS_INDEX_MAPPING to the new indices.
 
     Args:
         es: An Elasticsearch client
-        life_courses: An iterable of life course objects
-        bulk_helper: Helper function for Elasticsearch _bulk endpoint
+        timestamp: The timestamp of the build, which suffixes the index names
+        profile: One of PA_PROFILES, the person appearance fields of the
+                 links and life courses
+        mapping_profile: One of MAPPING_PROFILES, how the person appearance
+                         fields are mapped
+        shards: A dictionary mapping aliases to the number of primary shards
+                of their indices, see ``index_shard_counts``. The default of
+                Elasticsearch is used for the other indices.
+        exist_ok: Whether indices of the build that exist are used as they
+                  are, such as those created by another partition of the
+                  build
     """
-   # for s in sources:
-    #    print(s.es_document())
-    actions = [{'_op_type': 'index', '_index': ALIAS_INDEX_MAPPING['sources'], '_id': s.source_id, "source": s.es_document() } for s in sources]
-    bulk_insert_actions(es, actions)
+    use_build_indices(timestamp)
+    for (alias, mappings) in index_mappings(profile, mapping_profile).items():
+        if exist_ok and es.indices.exists(index=ALIAS_INDEX_MAPPING[alias]):
+            print(f' => Using the existing {alias} index {ALIAS_INDEX_MAPPING[alias]}')
+            continue
+        settings = {**INDEX_SETTINGS, **BUILD_SETTINGS}
+        if shards and alias in shards:
+            settings['index.number_of_shards'] = shards[alias]
+        print(f' => Creating {alias} index {ALIAS_INDEX_MAPPING[alias]}{f" with {shards[alias]} shards" if shards and alias in shards else ""}')
+        try:
+            es.indices.create(index=ALIAS_INDEX_MAPPING[alias], body={
+                'settings': settings,
+                'mappings': mappings
+            })
+        except RequestError as e:
+            # another partition created the index in the meantime
+            if not (exist_ok and e.error == 'resource_already_exists_exception'):
+                raise
+
 
-def csv_index_life_courses(es, life_courses):
+def finish_build_indices(es, replicas=0, max_segments=FORCE_MERGE_SEGMENTS):
     """
-    Bulk indexes documents in the 'life_courses' index.
-    
-    This only creates the empty life course documents without any person
-    appearances, which are added to this index by the `csv_index_pa` function.
+    Prepare the indices of ALIAS_INDEX_MAPPING for searching once they are
+    loaded: restore the production settings, refresh and force merge the
+    indices, and wait until they are healthy.
 
     Args:
         es: An Elasticsearch client
-        life_courses: An iterable of life course objects
-        bulk_helper: Helper function for Elasticsearch _bulk endpoint
+        replicas: The number of replicas of the indices
+        max_segments: The number of segments each shard is merged to
     """
-    actions = [{'_op_type': 'index', '_index': ALIAS_INDEX_MAPPING['lifecourses'], '_id': lc[''], 'life_course_id': lc[''], 'person_appearance': [] } for lc in life_courses]
-    bulk_insert_actions(es, actions)
+    indices = ','.join(ALIAS_INDEX_MAPPING.values())
+
+    print(f' => Restoring production settings')
+    es.indices.put_settings(index=indices, body={**PRODUCTION_SETTINGS, 'index.number_of_replicas': replicas})
+
+    print(f' => Refreshing indices')
+    es.indices.refresh(index=indices, request_timeout=BUILD_TIMEOUT_SECONDS)
+
+    print(f' => Force merging indices to {max_segments} segments')
+    es.indices.forcemerge(index=indices, max_num_segments=max_segments, request_timeout=BUILD_TIMEOUT_SECONDS)
 
+    print(f' => Waiting for the indices to be healthy')
+    health = es.cluster.health(index=indices, wait_for_status='green', timeout=f'{BUILD_TIMEOUT_SECONDS}s', request_timeout=BUILD_TIMEOUT_SECONDS + 30)
+    if health['timed_out']:
+        raise Exception(f'indices did not become healthy, status {health["status"]}')
 
-def csv_index_links(es, links):
+
+def partition_marker_id(timestamp, partition):
+    return f'{timestamp}_{partition.index + 1}-of-{partition.count}'
+
+
+def mark_partition_done(es, timestamp, partition, failures=0):
     """
-    Bulk indexes documents in the 'links' index.
+    Record that a partition of a build is indexed, with the number of its
+    documents that failed, in PARTITION_INDEX.
 
-    This only creates the link documents with link metadata, without any person
-    appearances, which are added to this index by the `csv_index_pas` function.
-    
     Args:
         es: An Elasticsearch client
-        link: The link object
-        bulk_helper: Helper function for Elasticsearch _bulk endpoint
+        timestamp: The timestamp of the build
+        partition: The Partition
+        failures: The number of documents of the partition that failed
     """
-    actions = [{'_op_type': 'index', '_index': ALIAS_INDEX_MAPPING['links'], '_id': li['link_id'], 'link_id': li['link_id'], 'link': li, 'person_appearance': [] } for li in links]
-    
-    bulk_insert_actions(es, actions)
+    es.index(index=PARTITION_INDEX, id=partition_marker_id(timestamp, partition), body={
+        'build': timestamp,
+        'partition': partition.index + 1,
+        'partitions': partition.count,
+        'failures': failures
+    }, refresh='true')
 
 
-def csv_pa_bulk_actions(pa, life_courses, links):
+def wait_for_partitions(es, timestamp, count, timeout=BUILD_TIMEOUT_SECONDS, poll_seconds=PARTITION_POLL_SECONDS):
     """
-    Generates the bulk actions for indexing a given person appearance, and
-    adding this person appearance to the relevant links and life courses.
+    Wait until all partitions of a build are marked done, see
+    ``mark_partition_done``.
 
     Args:
-        pa: A PersonAppearance object
-        life_courses: A list of life course ids
-        links: A list of link ids
-    
+        es: An Elasticsearch client
+        timestamp: The timestamp of the build
+        count: The number of partitions of the build
+        timeout: The number of seconds to wait at most
+        poll_seconds: The number of seconds between checks
+
     Returns:
-        A generator of Elasticsearch bulk actions
+        A list of the markers of the partitions.
     """
-    yield {
-        '_op_type': 'index',
-        '_index': ALIAS_INDEX_MAPPING['pas'],
-        '_id': pa.id,
-        "person_appearance": pa.es_document()
-    }
+    ids = [partition_marker_id(timestamp, Partition(i, count)) for i in range(count)]
+    deadline = time.monotonic() + timeout
+    while True:
+        markers = []
+        if es.indices.exists(index=PARTITION_INDEX):
+            markers = [doc['_source'] for doc in es.mget(index=PARTITION_INDEX, body={'ids': ids})['docs'] if doc.get('found')]
+        if len(markers) == count:
+            return markers
+        if time.monotonic() >= deadline:
+            raise Exception(f'{count - len(markers)} of the {count} partitions of build {timestamp} are not done')
+        print(f' => -> {len(markers)} of {count} partitions done')
+        time.sleep(poll_seconds)
+
+
+def clear_partitions(es, timestamp, count):
+    """
+    Delete the markers of the partitions of a build once it is finished.
+    """
+    for i in range(count):
+        es.delete(index=PARTITION_INDEX, id=partition_marker_id(timestamp, Partition(i, count)), ignore=404)
 
-    for link in links:
-        yield {
-            '_op_type': 'update',
-            '_index': ALIAS_INDEX_MAPPING['links'],
-            '_id': link,
-            'script': {
-                "source": "ctx._source.person_appearance.add(params.pa)",
-                "params": {
-                    "pa": pa.es_document()
-                }
-            }
-        }
 
-    for life_course in life_courses:
+def swap_aliases(es):
+    """
+    Point each alias to its index in ALIAS_INDEX_MAPPING, and away from the
+    indices it pointed to before, in a single atomic request.
 
-        yield {
-            '_op_type': 'update',
-            '_index': ALIAS_INDEX_MAPPING['lifecourses'],
-            '_id': life_course,
-            'script': {
-                "source": "ctx._source.person_appearance.add(params.pa)",
-                "lang": "painless",
-                "params": {
-                    "pa": pa.es_document()
-                }
-            }
-        }
+    Args:
+        es: An Elasticsearch client
+    """
+    actions = []
+    for (alias, index) in ALIAS_INDEX_MAPPING.items():
+        if es.indices.exists_alias(name=alias):
+            for old_index in es.indices.get_alias(name=alias):
+                if old_index != index:
+                    actions.append({'remove': {'index': old_index, 'alias': alias}})
+        actions.append({'add': {'index': index, 'alias': alias}})
+
+    es.indices.update_aliases(body={'actions': actions})
 
 
-def csv_pas_bulk_actions(pas):
+def use_live_indices(es):
     """
-    Generates bulk actions for the given iterator of PersonAppearance, life
-    course ids, and link ids tuples.
+    Point ALIAS_INDEX_MAPPING to the indices the aliases point to, to apply
+    changes to the live indices.
 
     Args:
-        pas: A list of tuples containing PersonAppearance objects, lists of life
-            course ids and lists of link ids.
-        
-    Returns:
-        A generator of Elasticsearch bulk actions.
+        es: An Elasticsearch client
     """
-    for (pa, life_courses, links) in pas:
-        for action in csv_pa_bulk_actions(pa, life_courses, links):
-            yield action
+    for alias in ALIAS_INDEX_MAPPING:
+        indices = list(es.indices.get_alias(name=alias)) if es.indices.exists_alias(name=alias) else []
+        if len(indices) != 1:
+            raise Exception(f'alias {alias} points to {len(indices)} indices, expected 1')
+        ALIAS_INDEX_MAPPING[alias] = indices[0]
 
 
-def csv_read_pas(sources, csv_files, pa_life_courses, pa_links):
+def clone_live_indices(es, timestamp):
     """
-    Reads CSV files containing person appearance data, and generates tuples of
-    PersonAppearance objects, lists of life course ids, and lists of link ids.
+    Clone the indices the aliases point to into a new build with the build
+    time settings, and point ALIAS_INDEX_MAPPING to the clones.
+
+    The live indices are write blocked while they are cloned.
 
     Args:
-        csv_files: An iterator of pathlib.Path-like objects that can be opened.
-        pa_life_courses: A dictionary mapping pa_id to [life_course_id]
-        pa_links: A dictionary mapping pa_id to [link_id]
+        es: An Elasticsearch client
+        timestamp: The timestamp of the build, which suffixes the index names
+    """
+    use_live_indices(es)
+    for (alias, live_index) in ALIAS_INDEX_MAPPING.items():
+        ALIAS_INDEX_MAPPING[alias] = f'{alias}_{timestamp}'
+        print(f' => Cloning {live_index} to {ALIAS_INDEX_MAPPING[alias]}')
+        es.indices.put_settings(index=live_index, body={'index.blocks.write': True})
+        try:
+            es.indices.clone(index=live_index, target=ALIAS_INDEX_MAPPING[alias], body={
+                'settings': {'index.blocks.write': None, **BUILD_SETTINGS}
+            })
+        finally:
+            es.indices.put_settings(index=live_index, body={'index.blocks.write': None})
+
+
+def es_builds(es):
+    """
+    List the builds of the indices, which are the indices named
+    '<alias>_<timestamp>'.
+
+    Args:
+        es: An Elasticsearch client
 
     Returns:
-        A generator, generating tuples of PersonAppearance objects, lists of
-        life course ids, and lists of link ids
+        A list of (timestamp, indices) tuples ordered from oldest to newest,
+        where indices maps each alias to the row of the index in the
+        Elasticsearch cat indices API.
     """
-    for csv_path in csv_files:
-        print(f' => -> Indexing census data from {csv_path}')
-        line = 1
-        with csv_path.open('r', encoding='utf-8') as csvfile:
-            for item in csv.DictReader(csvfile, delimiter='$', quotechar='"', ):
-                line += 1
-                try:
-                    source_id = getSourceIdByFilePath(sources, csv_path.name)
-                    item['source_id'] = source_id
-                    pa = PersonAppearance.from_dict(item)
-                except Exception as e:
-                    print(f" => -> Error: {repr(e)} line={line} file={csv_path}")
-                    continue
-                
-                # retrieve the life course ids that the person appearance belongs to
-                life_course_ids = []
+    builds = {}
+    rows = es.cat.indices(index=','.join(f'{alias}_*' for alias in ALIAS_INDEX_MAPPING), format='json', bytes='b')
+    for row in rows:
+        (alias, _, timestamp) = row['index'].partition('_')
+        if alias not in ALIAS_INDEX_MAPPING or not valid_build_timestamp(timestamp):
+            continue
+        builds.setdefault(timestamp, {})[alias] = row
 
-                if (pa.pa_id, pa.source_id) in pa_life_courses:
-                    life_course_ids = pa_life_courses[(pa.pa_id, pa.source_id)]
-                
-                link_ids = []
-                if (pa.pa_id, pa.source_id) in pa_links:
-                    link_ids = pa_links[(pa.pa_id, pa.source_id)]
+    return sorted(builds.items(), key=lambda build: datetime.strptime(build[0], BUILD_TIMESTAMP_FORMAT))
 
-                yield (pa, life_course_ids, link_ids)
 
+def es_live_builds(es):
+    """
+    Returns the set of timestamps of the builds that any alias points to.
+    """
+    live = set()
+    for alias in ALIAS_INDEX_MAPPING:
+        if es.indices.exists_alias(name=alias):
+            for index in es.indices.get_alias(name=alias):
+                live.add(index.partition('_')[2])
+    return live
 
-def csv_index(es, path):
+
+def retire_builds(es, keep_builds=KEEP_BUILDS):
     """
-    Perform the indexing of a directory of link lives data.
+    Remove the builds superseded by the live build, to be called after the
+    aliases are swapped.
+
+    The newest ``keep_builds`` builds, and the builds the aliases point to,
+    are kept. Kept builds that are not live are closed, so that they use no
+    memory but can be opened to roll back to them, and older builds are
+    deleted.
 
     Args:
         es: An Elasticsearch client
-        path: Path to the directory containing life course, link and source data.
+        keep_builds: The number of builds to keep, at least 1
     """
-    csv_dir = Path(path)
-    sources = {}
-    life_courses = {}
-    links = {}
-    pa_life_courses = {}
-    pa_links = {}
+    builds = es_builds(es)
+    live = es_live_builds(es)
+    kept = set(timestamp for (timestamp, _) in builds[-keep_builds:])
 
-    for csv_path in [f for f in csv_dir.iterdir() if f.suffix == '.csv' and f.stem.startswith('sources')]:
-        print(f' => Loading sources data from {csv_path}')
-        with csv_path.open('r', encoding='utf-8') as csvfile:
-            for item in csv.DictReader(csvfile, delimiter='$', quotechar='"'):
-                source_id = item['source_id']
+    for (timestamp, indices) in builds:
+        if timestamp in live:
+            continue
 
-                # add the soure to the sources dict
-                sources[source_id] = Source.from_dict(item)
+        names = ','.join(row['index'] for row in indices.values())
+        if timestamp in kept:
+            if any(row['status'] != 'close' for row in indices.values()):
+                print(f' => Closing build {timestamp}')
+                es.indices.close(index=names)
+        else:
+            print(f' => Deleting build {timestamp}')
+            es.indices.delete(index=names)
 
 
-    print(f' => -> Loaded {len(sources)} sources')
+def print_builds(es):
+    """
+    Print the builds of the indices with their size and document counts.
 
-    for csv_path in [f for f in csv_dir.iterdir() if f.suffix == '.csv' and f.stem.startswith('life_courses')]:
-        print(f' => Loading life course data from {csv_path}')
-        with csv_path.open('r', encoding='utf-8') as csvfile:
-            for item in csv.DictReader(csvfile, delimiter='$', quotechar='"'):
-                life_course_id = item['']
+    Args:
+        es: An Elasticsearch client
+    """
+    live = es_live_builds(es)
+    for (timestamp, indices) in es_builds(es):
+        size = sum(int(row['store.size'] or 0) for row in indices.values())
+        print(f'{timestamp}{" (live)" if timestamp in live else ""}: {size / 2**20:.1f} MB')
+        for (alias, row) in sorted(indices.items()):
+            print(f' => {row["index"]}: {row["status"]}, {row["docs.count"] or "-"} documents, {int(row["store.size"] or 0) / 2**20:.1f} MB')
 
-                # add the life course to the life courses dict
-                life_courses[life_course_id] = item
 
-                # Original way: Source defined in specific source column
-                # extract the columns of the life course csv that are pa_ids
-                #pa_ids_src = [(key, val) for (key, val) in item.items() if val is not None and key not in ('', 'occurences')]
+def indices_profile(es):
+    """
+    Returns the profile of the person appearances embedded in the links and
+    life courses indices ALIAS_INDEX_MAPPING points to, see PA_PROFILES.
+    Indices created before the profiles are of the 'full' profile.
+    """
+    profiles = set()
+    for alias in ('links', 'lifecourses'):
+        for mapping in es.indices.get_mapping(index=ALIAS_INDEX_MAPPING[alias]).values():
+            profiles.add(mapping['mappings'].get('_meta', {}).get('pa_profile', 'full'))
+    if len(profiles) != 1:
+        raise Exception(f'the links and lifecourses indices have different profiles: {", ".join(sorted(profiles))}')
+    return profiles.pop()
 
-                # get source id and pa id from comma separated pa_ids and sources fields
-                pa_ids_src = zip(item['sources'].split(","),item['pa_ids'].split(","))
-                #print(next(pa_ids_src))
-                # add each pa_id-source_id combination to the pa_life_course dict
-                for source_id, pa_id in pa_ids_src:
-                    if (pa_id, source_id) not in pa_life_courses:
-                        pa_life_courses[(pa_id, source_id)] = set()
-                    pa_life_courses[(pa_id, source_id)].add(life_course_id)
 
-    print(f' => -> Loaded {len(life_courses)} life courses')
+def print_build_report(es, profile, seconds):
+    """
+    Print the number of documents and the size of each index the documents
+    were indexed into, with the profile and the time of the build, to
+    compare the profiles.
 
-    for csv_path in [f for f in csv_dir.iterdir() if f.suffix == '.csv' and f.stem.startswith('links')]:
-        print(f' => Loading link data from {csv_path}')
-        with csv_path.open() as csvfile:
-            for item in csv.DictReader(csvfile, delimiter='$', quotechar='"'):
-                link_id = item['link_id']
+    Args:
+        es: An Elasticsearch client
+        profile: The profile of the build, see PA_PROFILES
+        seconds: The number of seconds the build took
+    """
+    rows = es.cat.indices(index=','.join(ALIAS_INDEX_MAPPING.values()), format='json', bytes='b')
+    size = sum(int(row['store.size'] or 0) for row in rows)
+    print(f'Build report: profile {profile}, {seconds:.1f} s, {size / 2**20:.1f} MB')
+    for row in sorted(rows, key=lambda row: row['index']):
+        print(f' => {row["index"]}: {row["docs.count"] or "-"} documents, {int(row["store.size"] or 0) / 2**20:.1f} MB')
+
+
+def mapping_comparison_queries(pa):
+    """
+    Returns the queries of a comparison of the mapping profiles keyed by
+    name, which search for the values of a sample person appearance
+    document ``pa``. The queries are valid in every mapping profile.
+    """
+    def nested(query):
+        return {'query': {'nested': {'path': 'person_appearance', 'query': query}}}
+
+    return {
+        'name match': nested({'match': {'person_appearance.name': pa.get('name', '')}}),
+        'name phrase': nested({'match_phrase': {'person_appearance.name': pa.get('name', '')}}),
+        'parish match': nested({'match': {'person_appearance.parish': pa.get('parish', '')}}),
+        'gender filter': nested({'bool': {'filter': {'term': {'person_appearance.gender_std': pa.get('gender_std', '')}}}}),
+        'family name sort': {
+            'query': {'match_all': {}},
+            'sort': [{'person_appearance.family_names_sortable': {'order': 'asc', 'nested': {'path': 'person_appearance'}}}]
+        }
+    }
+
+
+def compare_mapping_profiles(es, csv_dir, profile='full', build_mode='update', repeat=COMPARE_QUERY_REPEAT, keep=False):
+    """
+    Index a directory of link lives data once in each of MAPPING_PROFILES,
+    into indices named '<alias>_compare-<mapping profile>', and measure the
+    time of the build, the size of the indices and the latency of the
+    queries of ``mapping_comparison_queries`` on the 'pas' and
+    'lifecourses' indices.
+
+    Args:
+        es: An Elasticsearch client
+        csv_dir: The path of the directory of link lives data
+        profile: One of PA_PROFILES
+        build_mode: One of BUILD_MODES
+        repeat: The number of times each query is run
+        keep: Whether the indices are kept, instead of being deleted once
+              they are measured
+
+    Returns:
+        A list of dictionaries, one for each mapping profile, with the
+        seconds of the build, the documents and bytes of each index keyed by
+        alias, and the median milliseconds of each query keyed by
+        '<alias> <query name>'.
+    """
+    results = []
+    queries = None
+    for mapping_profile in MAPPING_PROFILES:
+        print(f'Indexing with the {mapping_profile} mapping profile')
+        timestamp = f'compare-{mapping_profile}'
+        es.indices.delete(index=','.join(f'{alias}_{timestamp}' for alias in ALIAS_INDEX_MAPPING), ignore_unavailable=True)
+        create_build_indices(es, timestamp, profile, mapping_profile)
+        try:
+            start = time.perf_counter()
+            csv_index(ElasticsearchSink(es), csv_dir, build_mode=build_mode, profile=profile)
+            finish_build_indices(es)
+            result = {'mapping_profile': mapping_profile, 'seconds': time.perf_counter() - start, 'docs': {}, 'bytes': {}, 'latency_ms': {}}
+
+            for row in es.cat.indices(index=','.join(ALIAS_INDEX_MAPPING.values()), format='json', bytes='b'):
+                alias = row['index'].partition('_')[0]
+                result['docs'][alias] = int(row['docs.count'] or 0)
+                result['bytes'][alias] = int(row['store.size'] or 0)
+
+            if queries is None:
+                hits = es.search(index=ALIAS_INDEX_MAPPING['pas'], body={'size': 1, **mapping_comparison_queries({})['family name sort']})['hits']['hits']
+                queries = mapping_comparison_queries(hits[0]['_source']['person_appearance'] if hits else {})
+            print(f' => Running each query {repeat} times')
+            for alias in ('pas', 'lifecourses'):
+                for (name, body) in queries.items():
+                    took = sorted(es.search(index=ALIAS_INDEX_MAPPING[alias], body=body, request_cache=False)['took'] for _ in range(repeat))
+                    result['latency_ms'][f'{alias} {name}'] = took[len(took) // 2]
+            results.append(result)
+        finally:
+            if not keep:
+                es.indices.delete(index=','.join(ALIAS_INDEX_MAPPING.values()))
+
+    return results
+
+
+def print_mapping_comparison(results):
+    """
+    Print the results of ``compare_mapping_profiles``, with the size of
+    each mapping profile relative to the first.
+    """
+    base = results[0]
+    print('Mapping profiles:')
+    for result in results:
+        size = sum(result['bytes'].values())
+        print(f' => {result["mapping_profile"]}: {result["seconds"]:.1f} s, {size / 2**20:.1f} MB ({size / max(sum(base["bytes"].values()), 1):.2f}x)')
+        for (alias, size) in sorted(result['bytes'].items()):
+            print(f' => -> {alias}: {result["docs"][alias]} documents, {size / 2**20:.1f} MB ({size / max(base["bytes"][alias], 1):.2f}x)')
+    print('Median query latencies:')
+    for query in base['latency_ms']:
+        print(f' => {query}: ' + ', '.join(f'{result["mapping_profile"]} {result["latency_ms"][query]} ms' for result in results))
+
+
+def csv_index(sink, path, build_mode='update', join_index='compact', work_dir=None, workers=1, fast_csv='auto', manifest=None, build=None, profile='full', cache_dir=None, pipelines=None, partition=None):
+    """
+    Perform the indexing of a directory of link lives data.
+
+    Args:
+        sink: A sink for the bulk actions, see ``ElasticsearchSink``
+        path: Path to the directory containing life course, link and source data.
+        build_mode: Either 'update', where empty link and life course documents
+                    are indexed first and person appearances are added to them
+                    by scripted updates, or 'assemble', where link and life
+                    course documents are assembled by the indexer and indexed
+                    once, after the census data has been read.
+        join_index: The type of the maps of person appearances to life
+                    courses and links, one of JOIN_INDEX_TYPES. With 'disk'
+                    the maps are stored in SQLite files instead of in memory.
+        work_dir: Directory for the temporary files of the indexer. The
+                  system temporary directory is used if not given.
+        workers: The number of processes parsing the census data. Values of
+                 the census data must not span multiple lines if more than
+                 one worker is used.
+        fast_csv: One of FAST_CSV_MODES. Census files are read with a fast
+                  reader without support for quoted values if 'always', or
+                  if 'auto' and the file contains no quote characters.
+        manifest: A ContentManifest the person appearance, link and life
+                  course documents are recorded in, in the 'assemble' build
+                  mode. Only the documents that changed since the previous
+                  manifest are indexed, and the documents that are gone are
+                  deleted.
+        build: The timestamp of the build. If given, the progress of the run
+               is checkpointed in the work directory of the build, see
+               ``build_work_path``, and a run of a build that failed is
+               resumed from its checkpoint. The census files are then read
+               in byte ranges, so their values must not span multiple
+               lines. The work directory is kept, and must be removed when
+               the build is done.
+        profile: One of PA_PROFILES, the fields of the person appearances
+                 embedded in the link and life course documents. The
+                 indices must have been created with the same profile.
+        cache_dir: Directory of the columnar cache files the CSV files are
+                   read from, see ``columnar_cache``. The CSV files that
+                   have no cache file or changed are converted first. The
+                   CSV files are read directly if not given.
+        pipelines: A dictionary mapping each alias to the number of bulk
+                   requests in flight of its pipeline, if the indices are
+                   loaded by concurrent pipelines, see ``csv_pipelines``.
+                   The indices are loaded one after the other if not given.
+                   The stage of the census data, which also updates the
+                   links and life courses in the 'update' build mode, has
+                   the budget of 'pas'.
+        partition: A Partition, if only the documents of the partition are
+                   indexed, in the 'assemble' build mode. Each partition
+                   reads, converts and joins all of the data, but encodes,
+                   assembles and sends only the person appearances it
+                   needs, see ``Partition.needs_pa``, and its share of the
+                   documents. The sources are indexed by the first
+                   partition.
+    """
+    if partition is not None and build_mode != 'assemble':
+        raise Exception('partitioned builds require the assemble build mode')
+    csv_dir = Path(path)
+    cache_dir = Path(cache_dir) if cache_dir is not None else None
+    if build is not None:
+        work_path = build_work_path(work_dir, build)
+        work_path.mkdir(parents=True, exist_ok=True)
+        checkpoint = BuildCheckpoint(str(work_path / CHECKPOINT_FILE), build_mode)
+        csv_index_work_path(sink, csv_dir, work_path, build_mode, join_index, workers, fast_csv, manifest, checkpoint, profile, cache_dir, pipelines, partition)
+        return
+
+    work_path = Path(tempfile.mkdtemp(prefix='indexer-', dir=work_dir))
+    try:
+        csv_index_work_path(sink, csv_dir, work_path, build_mode, join_index, workers, fast_csv, manifest, profile=profile, cache_dir=cache_dir, pipelines=pipelines, partition=partition)
+    finally:
+        shutil.rmtree(work_path)
+
+
+def build_work_path(work_dir, build):
+    """
+    Returns the pathlib.Path of the work directory of a build, in
+    ``work_dir`` or in the system temporary directory.
+    """
+    return Path(work_dir or tempfile.gettempdir()) / f'indexer-{build}'
+
+
+def csv_stage(summary, checkpoint, name, run, load=None):
+    """
+    Run a stage of an indexing run unless it was done by a previous run of
+    the build, and record in the checkpoint that it is done.
 
-                method = method_info(item['method_id'])
+    Args:
+        summary: A RunSummary the stage is recorded in
+        checkpoint: A BuildCheckpoint
+        name: The name of the stage
+        run: A function running the stage
+        load: A function that is called instead of ``run`` if the stage is
+              done, to load what the following stages need
+    """
+    with summary.stage(name):
+        if checkpoint.done(name):
+            print(f' => -> Done by a previous run')
+            if load is not None:
+                load()
+            return
+        run()
+        checkpoint.finish(name)
 
-                item['method_type'] = method['type']
-                item['method_subtype1'] = method['subtype1']
-                item['method_description'] = method['description']
 
-                # add the link to the link dict
-                links[link_id] = item
+def csv_pipelines(pipelines, *runs, summary=None, name=None):
+    """
+    Run independent pipelines of stages one after the other, or concurrently
+    if ``pipelines`` is given.
+
+    Args:
+        pipelines: A dictionary of the budgets of the pipelines, see
+                   ``csv_index``, or None
+        runs: Functions running the stages of each pipeline. When they run
+              concurrently, the last one runs in the calling thread and the
+              others in threads of their own, and the first exception of
+              any of them is raised once all of them are done.
+        summary: A RunSummary in which concurrent pipelines are recorded as
+                 the combined stage ``name``, see ``RunSummary.concurrent``
+        name: The name of the combined stage
+    """
+    if pipelines is None:
+        for run in runs:
+            run()
+        return
+
+    error = None
+    with (summary or RunSummary()).concurrent(name or 'Concurrent pipelines'), ThreadPoolExecutor(len(runs) - 1) as executor:
+        futures = [executor.submit(run) for run in runs[:-1]]
+        try:
+            runs[-1]()
+        except Exception as e:
+            error = e
+        for future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                error = error or e
+    if error is not None:
+        raise error
 
-                # add the pa_ids to the pa_links dictionary
-                # get info for the first pa in the link
-                pa_id_1 = item['pa_id1']
-                source_id_1 = item['source_id1']
-                source_1 = sources[source_id_1]
 
-                # get info for the secoond pa in the link
-                pa_id_2 = item['pa_id2']
-                source_id_2 = item['source_id2']
-                source_2 = sources[source_id_2]
+def csv_index_work_path(sink, csv_dir, work_path, build_mode, join_index, workers, fast_csv, manifest=None, checkpoint=None, profile='full', cache_dir=None, pipelines=None, partition=None):
+    """
+    Perform the indexing of a directory of link lives data, keeping temporary
+    files in ``work_path``. See ``csv_index``.
 
-                # add each info to the pa_links dictioanry
-                for pa_id, source_id in [(pa_id_1, source_1.source_id), (pa_id_2, source_2.source_id)]:
-                    if (pa_id, source_id) not in pa_links:
-                        pa_links[(pa_id, source_id)] = set()
-                    pa_links[(pa_id, source_id)].add(link_id)
-                    
-    print(f' => -> Loaded {len(links)} links')
+    The life course and link files are streamed: each row is added to the
+    join indices and indexed, or recorded by the document assembler, as it is
+    read, so the rows are never all held in memory.
 
-    print(f' => Indexing sources')
-    csv_index_sources(es, sources.values())
+    The sources depend on nothing, so with ``pipelines`` they are indexed
+    while the other indices are loaded. In the 'update' build mode the
+    census data is indexed by scripted updates of the empty links and life
+    courses, so those stages run one after the other.
+    """
+    summary = RunSummary()
+    checkpoint = checkpoint or BuildCheckpoint(None, build_mode)
+    pa_life_courses = new_join_index(join_index, work_path / 'pa_life_courses.sqlite')
+    pa_links = new_join_index(join_index, work_path / 'pa_links.sqlite')
+    link_life_courses = new_join_index(join_index, work_path / 'link_life_courses.sqlite')
+    requests = (pipelines or {}).get
+
+    with summary.stage('Loading sources'):
+        sources = csv_load_sources(csv_dir, cache_dir)
+
+    def index_sources():
+        if partition is None or partition.index == 0:
+            csv_stage(summary, checkpoint, 'Indexing sources', lambda: csv_index_sources(sink, sources.values(), requests('sources')))
+
+    def index_updates():
+        csv_stage(summary, checkpoint, 'Indexing empty life courses',
+                  lambda: csv_index_life_courses(sink, (lc for (_, lc) in csv_read_life_courses(csv_dir, pa_life_courses, cache_dir)), requests('lifecourses')),
+                  lambda: deque(csv_read_life_courses(csv_dir, pa_life_courses, cache_dir), maxlen=0))
+
+        # the life courses of the links are looked up as the links are read
+        pa_life_courses.freeze()
+        links = lambda: csv_link_life_courses(csv_read_links(csv_dir, sources, pa_links, cache_dir), pa_life_courses, link_life_courses)
+        csv_stage(summary, checkpoint, 'Indexing empty links',
+                  lambda: csv_index_links(sink, links(), requests('links')),
+                  lambda: deque(links(), maxlen=0))
+
+        pa_links.freeze()
+        link_life_courses.freeze()
+
+        pas = csv_census_pas(sources, csv_dir, pa_life_courses, pa_links, workers, fast_csv, checkpoint, profile, cache_dir)
+        csv_stage(summary, checkpoint, 'Indexing source data',
+                  lambda: bulk_insert_actions(sink, route_link_actions(csv_pas_bulk_actions(pas, profile), link_life_courses), checkpoint.advance, requests('pas')))
+
+    if build_mode == 'assemble':
+        csv_pipelines(pipelines, index_sources, lambda: csv_index_assembled(sink, csv_dir, work_path, sources, pa_life_courses, pa_links, workers, fast_csv, summary, manifest, checkpoint, profile, link_life_courses, cache_dir, pipelines, partition),
+                      summary=summary, name='Indexing sources and census data')
+    else:
+        csv_pipelines(pipelines, index_sources, index_updates, summary=summary, name='Indexing sources and census data')
 
-    print(f' => Indexing empty life courses')
-    csv_index_life_courses(es, life_courses.values())
+    summary.report()
 
-    print(f' => Indexing empty links')
-    csv_index_links(es, links.values())
 
-    print(f' => Indexing source data')
-    pas = csv_read_pas(sources, [f for f in csv_dir.iterdir() if f.stem.startswith('census') or f.stem.startswith('cph_burials')], pa_life_courses, pa_links)
+def csv_index_assembled(sink, csv_dir, work_path, sources, pa_life_courses, pa_links, workers=1, fast_csv='auto', summary=None, manifest=None, checkpoint=None, profile='full', link_life_courses=None, cache_dir=None, pipelines=None, partition=None):
+    """
+    Index the census data, and the link and life course documents assembled
+    from it, such that each link and life course is indexed exactly once.
 
-    bulk_insert_actions(es, csv_pas_bulk_actions(pas))
+    Args:
+        sink: A sink for the bulk actions, see ``ElasticsearchSink``
+        csv_dir: A pathlib.Path of the directory containing the census data
+        work_path: A pathlib.Path of the directory for temporary files
+        sources: A dictionary mapping source_id to Source objects
+        pa_life_courses: An empty join index for the life courses
+        pa_links: An empty join index for the links
+        workers: The number of processes parsing the census data
+        fast_csv: One of FAST_CSV_MODES
+        summary: A RunSummary the stages are recorded in
+        manifest: A ContentManifest, if only changed documents are indexed
+        checkpoint: A BuildCheckpoint the progress is recorded in
+        profile: One of PA_PROFILES
+        link_life_courses: An empty join index for the life courses of the
+                           links, by which the links are routed
+        cache_dir: A pathlib.Path of the directory of the columnar cache
+                   files, or None
+        pipelines: The budgets of concurrent pipelines, see ``csv_index``.
+                   The assembled life courses and links are then indexed
+                   concurrently, unless their documents are recorded in a
+                   manifest.
+        partition: A Partition, if only its documents are indexed
+    """
+    summary = summary or RunSummary()
+    requests = (pipelines or {}).get
+    checkpoint = checkpoint or BuildCheckpoint(None, 'assemble')
+    link_life_courses = link_life_courses if link_life_courses is not None else DictJoinIndex()
+
+    def delta(kind, actions):
+        return actions if manifest is None else manifest_delta_actions(kind, actions, manifest)
+
+    def record_life_courses():
+        for (life_course_id, _) in csv_read_life_courses(csv_dir, pa_life_courses, cache_dir):
+            if partition is None or partition.owns_life_course(life_course_id):
+                assembler.add_document('lifecourses', life_course_id)
+        assembler.commit()
+
+    def links():
+        return csv_link_life_courses(csv_read_links(csv_dir, sources, pa_links, cache_dir), pa_life_courses, link_life_courses)
+
+    def record_links():
+        for (link, life_course_ids) in links():
+            if partition is None or partition.owns_link(link['link_id'], life_course_ids):
+                assembler.add_document('links', link['link_id'], encode_document(link))
+        assembler.commit()
+
+    def acknowledge(progress):
+        # the person appearances of the acknowledged ranges must be in the
+        # assembler file before the checkpoint is advanced past them
+        assembler.commit()
+        checkpoint.advance(progress)
+
+    assembler = DocumentAssembler(str(work_path / 'assembler.sqlite'))
+    try:
+        csv_stage(summary, checkpoint, 'Recording life courses', record_life_courses,
+                  lambda: deque(csv_read_life_courses(csv_dir, pa_life_courses, cache_dir), maxlen=0))
+
+        # the life courses of the links are looked up as the links are read
+        pa_life_courses.freeze()
+        csv_stage(summary, checkpoint, 'Recording links', record_links,
+                  lambda: deque(links(), maxlen=0))
+
+        pa_links.freeze()
+        link_life_courses.freeze()
+
+        pas = csv_census_pas(sources, csv_dir, pa_life_courses, pa_links, workers, fast_csv, checkpoint, profile, cache_dir, partition)
+        csv_stage(summary, checkpoint, 'Indexing source data',
+                  lambda: bulk_insert_actions(sink, delta('pas', csv_pas_assemble_actions(pas, assembler, profile, partition)), acknowledge, requests('pas')))
+
+        # the manifest records the documents of both indices in one file
+        csv_pipelines(pipelines if manifest is None else None,
+                      lambda: csv_stage(summary, checkpoint, 'Indexing assembled life courses',
+                                        lambda: bulk_insert_actions(sink, delta('lifecourses', csv_assembled_life_course_actions(assembler)), requests=requests('lifecourses'))),
+                      lambda: csv_stage(summary, checkpoint, 'Indexing assembled links',
+                                        lambda: bulk_insert_actions(sink, delta('links', csv_assembled_link_actions(assembler, link_life_courses)), requests=requests('links'))),
+                      summary=summary, name='Indexing assembled life courses and links')
+    finally:
+        assembler.close()
 
 
 if __name__ == "__main__":
@@ -901,9 +4759,115 @@ if __name__ == "__main__":
 
     index_parser = subparsers.add_parser('index')
     index_parser.add_argument('--csv-dir', type=lambda p: Path(p).resolve(), required=True)
-    index_parser.add_argument('--es-host', required=True)
+    index_parser.add_argument('--es-host', default=None, help='The Elasticsearch host, required with the elasticsearch sink')
+    index_parser.add_argument('--sink', choices=SINK_TYPES, default='elasticsearch', help='Send the documents to Elasticsearch, write them to bulk files, or discard them')
+    index_parser.add_argument('--pipeline', choices=BULK_PIPELINES, default='threads', help='Send the bulk requests of the elasticsearch sink from a thread pool, or from an asyncio pipeline')
+    index_parser.add_argument('--bulk-requests', type=int, default=BULK_THREADS, help='The maximum number of bulk requests in flight')
+    index_parser.add_argument('--concurrent-indices', action='store_true', help='Load the indices in concurrent pipelines where their data allows it')
+    index_parser.add_argument('--index-requests', type=lambda s: {alias: int(n) for (alias, n) in (part.split('=') for part in s.split(','))}, default={}, metavar='ALIAS=N,...', help='The maximum number of bulk requests in flight of the pipelines of some indices, --bulk-requests by default')
+    index_parser.add_argument('--bulk-dir', type=lambda p: Path(p).resolve(), default=None, help='The directory the bulk files of the ndjson sink are written to')
+    index_parser.add_argument('--bulk-file-mb', type=int, default=BULK_FILE_BYTES // 2**20, help='The size in MB of uncompressed NDJSON after which bulk files are rotated')
+    index_parser.add_argument('--build-mode', choices=BUILD_MODES, default='update')
+    index_parser.add_argument('--join-index', choices=JOIN_INDEX_TYPES, default='compact')
+    index_parser.add_argument('--work-dir', type=lambda p: Path(p).resolve(), default=None)
+    index_parser.add_argument('--workers', type=int, default=1, help='The number of processes parsing the census data')
+    index_parser.add_argument('--fast-csv', choices=FAST_CSV_MODES, default='auto', help='Read census files without quoted values with a fast reader')
+    index_parser.add_argument('--cache-dir', type=lambda p: Path(p).resolve(), default=None, help='Read the CSV files from columnar cache files in this directory, converting the files that changed')
+    index_parser.add_argument('--replicas', type=int, default=0, help='The number of replicas of the indices once they are built')
+    index_parser.add_argument('--max-segments', type=int, default=FORCE_MERGE_SEGMENTS, help='The number of segments the indices are force merged to once they are built')
+    index_parser.add_argument('--keep-builds', type=int, default=KEEP_BUILDS, help='The number of builds to keep, including the new build. Older builds are deleted and kept builds other than the new one are closed')
+
+    index_parser.add_argument('--manifest', type=lambda p: Path(p).resolve(), default=None, help='Record a content hash of every document in this file, in the assemble build mode')
+    index_parser.add_argument('--delta', choices=DELTA_TARGETS, default=None, help='Only index the documents that changed since the build of the manifest, into the live indices or into a clone of them')
+
+    index_parser.add_argument('--resume', default=None, metavar='BUILD', help='Resume the failed run of the build with this timestamp from its checkpoint')
+    index_parser.add_argument('--build', default=None, help='The timestamp of the build, shared by the partitions of a partitioned build')
+    index_parser.add_argument('--partition', type=Partition.parse, default=None, metavar='I/N', help='Only index the documents of the I-th of N partitions of the build, from 1, in the assemble build mode')
+    index_parser.add_argument('--no-checkpoint', action='store_true', help='Do not checkpoint the progress of the run, which cannot be resumed then')
+
+    index_parser.add_argument('--profile', choices=PA_PROFILES, default='full', help='The fields of the person appearances embedded in the links and life courses')
+    index_parser.add_argument('--mapping-profile', choices=MAPPING_PROFILES, default='standard', help='How the person appearance fields of new indices are mapped')
+    index_parser.add_argument('--shards', type=int, default=None, help='The number of primary shards of each index, computed from the size of the CSV files by default')
+
+    index_parser.add_argument('--metrics-json', type=lambda p: Path(p).resolve(), default=None, help='Append the metrics of the run to this JSON lines file periodically')
+    index_parser.add_argument('--metrics-prom', type=lambda p: Path(p).resolve(), default=None, help='Write the metrics of the run to this Prometheus textfile periodically')
+    index_parser.add_argument('--metrics-interval', type=float, default=METRICS_INTERVAL_SECONDS, help='The number of seconds between writes of the metrics')
+
+    replay_parser = subparsers.add_parser('replay')
+    replay_parser.add_argument('--es-host', required=True)
+    replay_parser.add_argument('--bulk-dir', type=lambda p: Path(p).resolve(), required=True)
+    replay_parser.add_argument('--workers', type=int, default=BULK_THREADS, help='The number of bulk files replayed in parallel')
+    replay_parser.add_argument('--profile', choices=PA_PROFILES, default='full', help='The profile the bulk files were written with')
+    replay_parser.add_argument('--mapping-profile', choices=MAPPING_PROFILES, default='standard', help='How the person appearance fields of the indices are mapped')
+    replay_parser.add_argument('--shards', type=int, default=None, help='The number of primary shards of each index')
+    replay_parser.add_argument('--replicas', type=int, default=0, help='The number of replicas of the indices once they are built')
+    replay_parser.add_argument('--max-segments', type=int, default=FORCE_MERGE_SEGMENTS, help='The number of segments the indices are force merged to once they are built')
+    replay_parser.add_argument('--keep-builds', type=int, default=KEEP_BUILDS, help='The number of builds to keep, including the new build')
+
+    partitions_parser = subparsers.add_parser('finish-partitions')
+    partitions_parser.add_argument('--es-host', required=True)
+    partitions_parser.add_argument('--build', required=True, help='The timestamp of the partitioned build')
+    partitions_parser.add_argument('--partitions', type=int, required=True, help='The number of partitions of the build')
+    partitions_parser.add_argument('--timeout', type=float, default=BUILD_TIMEOUT_SECONDS, help='The number of seconds to wait for the partitions')
+    partitions_parser.add_argument('--replicas', type=int, default=0, help='The number of replicas of the indices once they are built')
+    partitions_parser.add_argument('--max-segments', type=int, default=FORCE_MERGE_SEGMENTS, help='The number of segments the indices are force merged to once they are built')
+    partitions_parser.add_argument('--keep-builds', type=int, default=KEEP_BUILDS, help='The number of builds to keep, including the new build')
+
+    builds_parser = subparsers.add_parser('list-builds')
+    builds_parser.add_argument('--es-host', required=True)
+
+    report_parser = subparsers.add_parser('join-index-report')
+    report_parser.add_argument('--csv-dir', type=lambda p: Path(p).resolve(), required=True)
+
+    convert_parser = subparsers.add_parser('convert')
+    convert_parser.add_argument('--csv-dir', type=lambda p: Path(p).resolve(), required=True)
+    convert_parser.add_argument('--cache-dir', type=lambda p: Path(p).resolve(), required=True, help='The directory the columnar cache files are written to')
+    convert_parser.add_argument('--fast-csv', choices=FAST_CSV_MODES, default='auto', help='Read files without quoted values with a fast reader')
+
+    compare_parser = subparsers.add_parser('compare-mappings')
+    compare_parser.add_argument('--es-host', required=True)
+    compare_parser.add_argument('--csv-dir', type=lambda p: Path(p).resolve(), required=True)
+    compare_parser.add_argument('--profile', choices=PA_PROFILES, default='full', help='The fields of the person appearances embedded in the links and life courses')
+    compare_parser.add_argument('--build-mode', choices=BUILD_MODES, default='update')
+    compare_parser.add_argument('--repeat', type=int, default=COMPARE_QUERY_REPEAT, help='The number of times each query is run')
+    compare_parser.add_argument('--keep', action='store_true', help='Keep the indices of the comparison')
 
     args = parser.parse_args()
+
+    if args.cmd in ('index', 'replay', 'finish-partitions') and args.keep_builds < 1:
+        parser.error('--keep-builds must be at least 1')
+    if args.cmd in ('index', 'replay') and args.shards is not None and args.shards < 1:
+        parser.error('--shards must be at least 1')
+    if args.cmd == 'index' and args.sink == 'elasticsearch' and not args.es_host:
+        parser.error('--es-host is required with the elasticsearch sink')
+    if args.cmd == 'index' and (args.bulk_requests < 1 or any(n < 1 for n in args.index_requests.values())):
+        parser.error('--bulk-requests and --index-requests must be at least 1')
+    if args.cmd == 'index' and set(args.index_requests) - set(ALIAS_INDEX_MAPPING):
+        parser.error(f'--index-requests expects the aliases {", ".join(ALIAS_INDEX_MAPPING)}')
+    if args.cmd == 'index' and args.index_requests and not args.concurrent_indices:
+        parser.error('--index-requests requires --concurrent-indices')
+    if args.cmd == 'index' and args.sink == 'ndjson' and not args.bulk_dir:
+        parser.error('--bulk-dir is required with the ndjson sink')
+    if args.cmd == 'index' and args.sink != 'elasticsearch' and args.delta:
+        parser.error('--delta requires the elasticsearch sink')
+    if args.cmd == 'index' and (args.manifest or args.delta) and args.build_mode != 'assemble':
+        parser.error('--manifest and --delta require --build-mode assemble')
+    if args.cmd == 'index' and args.delta and not (args.manifest and args.manifest.is_file()):
+        parser.error('--delta requires the --manifest of a previous build')
+    if args.cmd == 'index' and args.resume and (args.manifest or args.no_checkpoint):
+        parser.error('--resume cannot be used with --manifest or --no-checkpoint')
+    if args.cmd in ('index', 'convert') and args.cache_dir == args.csv_dir:
+        parser.error('--cache-dir must not be the --csv-dir')
+    if args.cmd in ('index', 'finish-partitions') and args.build is not None and not valid_build_timestamp(args.build):
+        parser.error(f'--build must be a timestamp like {datetime.now().strftime(BUILD_TIMESTAMP_FORMAT)}')
+    if args.cmd == 'index' and args.build and args.resume:
+        parser.error('--build cannot be used with --resume')
+    if args.cmd == 'index' and args.partition and (args.build_mode != 'assemble' or args.manifest or args.delta):
+        parser.error('--partition requires --build-mode assemble, without --manifest or --delta')
+    if args.cmd == 'index' and args.partition and not (args.build or args.resume):
+        parser.error('--partition requires the --build timestamp shared by the partitions')
+    if args.cmd == 'finish-partitions' and args.partitions < 1:
+        parser.error('--partitions must be at least 1')
     
     if args.cmd == 'delete':
         es = Elasticsearch(hosts=[args.es_host],timeout=30)
@@ -915,64 +4879,168 @@ if __name__ == "__main__":
             except:
                 pass
 
-    elif args.cmd == 'index':
+    elif args.cmd == 'finish-partitions':
         es = Elasticsearch(hosts=[args.es_host],timeout=30)
+        start = time.perf_counter()
+        use_build_indices(args.build)
+
+        print(f"Waiting for the {args.partitions} partitions of build {args.build}")
+        markers = wait_for_partitions(es, args.build, args.partitions, args.timeout)
+        failures = sum(marker['failures'] for marker in markers)
+        if failures:
+            print(f'Error: {failures} documents of the partitions failed, the aliases were not changed')
+            sys.exit(1)
 
-        # Converting datetime object to string
-        dateTimeObj = datetime.now()
-        timestampStr = dateTimeObj.strftime("%d-%m-%Y_%H-%M-%S")
+        print("Finishing indices")
+        finish_build_indices(es, replicas=args.replicas, max_segments=args.max_segments)
+        print_build_report(es, indices_profile(es), time.perf_counter() - start)
+
+        print(" => Changing aliases")
+        swap_aliases(es)
+        clear_partitions(es, args.build, args.partitions)
 
-        print(" => Creating index alias mappings")
+        print("Retiring old builds")
+        retire_builds(es, args.keep_builds)
 
-        ALIAS_INDEX_MAPPING['sources'] =        f'sources_{timestampStr}'
-        ALIAS_INDEX_MAPPING['links'] =          f'links_{timestampStr}'
-        ALIAS_INDEX_MAPPING['lifecourses'] =    f'lifecourses_{timestampStr}'
-        ALIAS_INDEX_MAPPING['pas'] =            f'pas_{timestampStr}'
+    elif args.cmd == 'list-builds':
+        es = Elasticsearch(hosts=[args.es_host],timeout=30)
+        print_builds(es)
 
-        print("Setting up indices")
+    elif args.cmd == 'join-index-report':
+        csv_join_index_report(str(args.csv_dir))
 
-        print(" => Creating sources index")
-        es.indices.create(ALIAS_INDEX_MAPPING['sources'])
-        
-        print(" => Putting sources mapping")
-        es.indices.put_mapping(index=ALIAS_INDEX_MAPPING['sources'], body=mappings_index_sources())
+    elif args.cmd == 'convert':
+        csv_convert(str(args.csv_dir), str(args.cache_dir), args.fast_csv)
+
+    elif args.cmd == 'compare-mappings':
+        es = Elasticsearch(hosts=[args.es_host],timeout=30)
+        print_mapping_comparison(compare_mapping_profiles(es, str(args.csv_dir), args.profile, args.build_mode, args.repeat, args.keep))
+
+    elif args.cmd == 'replay':
+        es = Elasticsearch(hosts=[args.es_host],timeout=30)
+        timestampStr = datetime.now().strftime(BUILD_TIMESTAMP_FORMAT)
+        start = time.perf_counter()
 
-        print(" => Creating links index")
-        es.indices.create(ALIAS_INDEX_MAPPING['links'])
+        print("Setting up indices")
+        shards = {alias: args.shards for alias in ALIAS_INDEX_MAPPING} if args.shards else None
+        create_build_indices(es, timestampStr, args.profile, args.mapping_profile, shards)
 
-        print(" => Putting links mapping")
-        es.indices.put_mapping(index=ALIAS_INDEX_MAPPING['links'], body=mappings_index_links())
+        print(f'Replaying bulk files at {args.bulk_dir}')
+        if replay_bulk_files(es, args.bulk_dir, args.workers):
+            print(f'Error: Documents failed, the aliases were not changed')
+            sys.exit(1)
 
-        print(" => Creating lifecourses index")
-        es.indices.create(ALIAS_INDEX_MAPPING['lifecourses'])  
+        print("Finishing indices")
+        finish_build_indices(es, replicas=args.replicas, max_segments=args.max_segments)
+        print_build_report(es, args.profile, time.perf_counter() - start)
 
-        print(" => Putting lifecourse mapping")
-        es.indices.put_mapping(index=ALIAS_INDEX_MAPPING['lifecourses'], body=mappings_index_lifecourses())         
+        print(" => Changing aliases")
+        swap_aliases(es)
 
-        print(" => Creating pas index")
-        es.indices.create(ALIAS_INDEX_MAPPING['pas'])
+        print("Retiring old builds")
+        retire_builds(es, args.keep_builds)
 
-        print(" => Putting pas mapping")
-        es.indices.put_mapping(index=ALIAS_INDEX_MAPPING['pas'], body=mappings_index_pas())
+    elif args.cmd == 'index':
+        es = Elasticsearch(hosts=[args.es_host],timeout=30) if args.sink == 'elasticsearch' else None
+        start = time.perf_counter()
 
+        # Converting datetime object to string
+        dateTimeObj = datetime.now()
+        timestampStr = args.resume or args.build or dateTimeObj.strftime(BUILD_TIMESTAMP_FORMAT)
 
         if not args.csv_dir.is_dir():
             print(f'Error: Path does not exist or is not a directory: {args.csv_dir}')
             sys.exit(1)
+
+        # runs with a manifest are not checkpointed, as the manifest of an
+        # interrupted run is incomplete
+        # the partitions of a build may share a work directory
+        work_build = timestampStr if args.partition is None else partition_marker_id(timestampStr, args.partition)
+        build = None if args.no_checkpoint or args.manifest else work_build
+        if args.resume and not (build_work_path(args.work_dir, work_build) / CHECKPOINT_FILE).is_file():
+            print(f'Error: No checkpoint of build {args.resume} in {build_work_path(args.work_dir, work_build)}')
+            sys.exit(1)
+
+        if args.sink == 'ndjson':
+            sink = NdjsonBulkFileSink(args.bulk_dir, args.bulk_file_mb * 2**20)
+        elif args.sink == 'null':
+            sink = NullSink()
+        elif args.pipeline == 'asyncio':
+            sink = AsyncElasticsearchSink(lambda: AsyncElasticsearch(hosts=[args.es_host],timeout=30), thread_count=args.bulk_requests)
+        else:
+            sink = ElasticsearchSink(es, thread_count=args.bulk_requests)
+
+        if args.sink == 'elasticsearch':
+            print("Setting up indices")
+            if args.resume:
+                print(f" => Resuming build {args.resume}")
+                use_build_indices(args.resume)
+            elif args.delta == 'live':
+                use_live_indices(es)
+            elif args.delta == 'clone':
+                clone_live_indices(es, timestampStr)
+            else:
+                shards = {alias: args.shards for alias in ALIAS_INDEX_MAPPING} if args.shards else index_shard_counts(args.csv_dir)
+                create_build_indices(es, timestampStr, args.profile, args.mapping_profile, shards, exist_ok=args.partition is not None)
+            profile = indices_profile(es)
+            if profile != args.profile:
+                print(f'Error: The indices were created with the {profile} profile, not {args.profile}')
+                sys.exit(1)
+
+        pipelines = None
+        if args.concurrent_indices:
+            pipelines = {alias: args.index_requests.get(alias, args.bulk_requests) for alias in ALIAS_INDEX_MAPPING}
+
+        manifest = None
+        if args.manifest:
+            manifest = ContentManifest(f'{args.manifest}.new', args.manifest if args.delta else None)
+
         print(f'Indexing csv files at {args.csv_dir}')
+        METRICS.start(args.metrics_json, args.metrics_prom, args.metrics_interval)
         try:
-            csv_index(es, str(args.csv_dir))
+            csv_index(sink, str(args.csv_dir), build_mode=args.build_mode, join_index=args.join_index, work_dir=args.work_dir, workers=args.workers, fast_csv=args.fast_csv, manifest=manifest, build=build, profile=args.profile, cache_dir=args.cache_dir, pipelines=pipelines, partition=args.partition)
         except RequestError as e:
             print(f'Error: A request exception occured')
             print(f' => Status code: {e.status_code}, error message: {e.error}')
             print(repr(e.info))
-
-        print(" => Changing aliases")
-        #es.indices.delete_alias('source*','_all')
-        es.indices.put_alias(ALIAS_INDEX_MAPPING['sources'], 'sources')
-        es.indices.put_alias(ALIAS_INDEX_MAPPING['links'], 'links')
-        es.indices.put_alias(ALIAS_INDEX_MAPPING['lifecourses'], 'lifecourses')
-        es.indices.put_alias(ALIAS_INDEX_MAPPING['pas'], 'pas')
+            print(f'Error: The aliases were not changed')
+            if build:
+                print(f' => The build can be resumed with --resume {timestampStr}{f" --partition {args.partition}" if args.partition else ""}')
+            sys.exit(1)
+        except Exception:
+            if build:
+                print(f'Error: The build can be resumed with --resume {timestampStr}{f" --partition {args.partition}" if args.partition else ""}')
+            raise
+        finally:
+            METRICS.stop()
+            if manifest:
+                manifest.close()
+
+        sink.close()
+
+        if args.delta == 'live':
+            print(" => Refreshing live indices")
+            es.indices.refresh(index=','.join(ALIAS_INDEX_MAPPING.values()))
+        elif args.sink == 'elasticsearch' and args.partition:
+            print(f"Marking partition {args.partition} of build {timestampStr} done")
+            mark_partition_done(es, timestampStr, args.partition, METRICS.totals().get('indexer_bulk_failures_total', 0))
+            print(f" => The build is finished by finish-partitions --build {timestampStr} --partitions {args.partition.count}")
+        elif args.sink == 'elasticsearch':
+            print("Finishing indices")
+            finish_build_indices(es, replicas=args.replicas, max_segments=args.max_segments)
+            print_build_report(es, args.profile, time.perf_counter() - start)
+
+            print(" => Changing aliases")
+            swap_aliases(es)
+
+            print("Retiring old builds")
+            retire_builds(es, args.keep_builds)
+
+        if args.manifest:
+            os.replace(f'{args.manifest}.new', args.manifest)
+
+        if build:
+            shutil.rmtree(build_work_path(args.work_dir, build))
 
     else:
         print('Error: Invalid command')
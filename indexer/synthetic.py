@@ -0,0 +1,247 @@
+"""
+Generate synthetic link lives datasets in the format read by ``index.py``,
+for measuring the performance of the indexer without the production data.
+
+A dataset consists of a sources file, a census file per census source, a
+burials file, and the life courses and links between the person appearances
+of the census and burial files. Each life course follows a person through a
+number of sources, in order of their year, and is linked by a link between
+each pair of consecutive person appearances.
+"""
+import csv
+import random
+from pathlib import Path
+
+
+# (source_id, year, type, description, filename) of the sources
+SOURCES = [
+    (1, 1787, 'census', 'Folketælling 1787', 'census_1787'),
+    (2, 1801, 'census', 'Folketælling 1801', 'census_1801'),
+    (3, 1834, 'census', 'Folketælling 1834', 'census_1834'),
+    (4, 1840, 'census', 'Folketælling 1840', 'census_1840'),
+    (5, 1845, 'census', 'Folketælling 1845', 'census_1845'),
+    (6, 1850, 'census', 'Folketælling 1850', 'census_1850'),
+    (7, 1860, 'census', 'Folketælling 1860', 'census_1860'),
+    (8, 1880, 'census', 'Folketælling 1880', 'census_1880'),
+    (9, 1901, 'census', 'Folketælling 1901', 'census_1901'),
+    (10, 1940, 'burials', 'Københavnske begravelser 1861-1940', 'cph_burials'),
+]
+
+# The default distribution of the number of person appearances of a life
+# course, as a dictionary of length to relative weight
+LIFE_COURSE_LENGTHS = {2: 50, 3: 25, 4: 13, 5: 7, 6: 3, 8: 2}
+
+CENSUS_COLUMNS = [
+    'id', 'transcription_id', 'source_year', 'event_type', 'gender', 'gender_clean', 'age', 'age_clean',
+    'name', 'name_clean', 'first_names', 'patronyms', 'family_names', 'all_possible_patronyms',
+    'all_possible_family_names', 'marital_status', 'marital_status_clean', 'household_position',
+    'hh_id', 'occupation', 'parish', 'district', 'county', 'role', 'birth_place', 'birth_place_clean',
+    'first_names_clean', 'lastname_clean', 'transcription_code', 'source_reference'
+]
+
+BURIAL_COLUMNS = [
+    'id', 'transcription_id', 'source_year', 'event_type', 'gender', 'gender_clean', 'name', 'name_clean',
+    'first_names', 'family_names', 'all_possible_family_names', 'marital_status', 'occupation', 'parish',
+    'street', 'street_number', 'floor', 'dateOfBirth', 'dateOfDeath', 'yearOfBirth', 'ageYears',
+    'ageMonths', 'birth_place', 'role', 'first_names_clean', 'lastname_clean', 'id_cph'
+]
+
+FIRST_NAMES = {
+    'm': ['Anders', 'Hans', 'Jens', 'Niels', 'Peder', 'Søren', 'Christian', 'Rasmus', 'Lars', 'Ole', 'Johan', 'Frederik'],
+    'k': ['Ane', 'Maren', 'Karen', 'Kirstine', 'Else', 'Mette', 'Johanne', 'Inger', 'Dorthe', 'Marie', 'Birthe', 'Sophie']
+}
+FAMILY_NAMES = ['Jensen', 'Nielsen', 'Hansen', 'Pedersen', 'Andersen', 'Christensen', 'Larsen', 'Sørensen', 'Rasmussen', 'Madsen', 'Kristensen', 'Olsen']
+PARISHES = ['Vor Frue', 'Helligånds', 'Sankt Nikolaj', 'Holmens', 'Trinitatis', 'Garnisons', 'Aarhus Domsogn', 'Odense Sankt Knud', 'Ribe Domsogn', 'Viborg']
+COUNTIES = ['Københavns', 'Aarhus', 'Odense', 'Ribe', 'Viborg', 'Sorø', 'Holbæk', 'Vejle']
+OCCUPATIONS = ['Husmand', 'Gaardmand', 'Tjenestekarl', 'Tjenestepige', 'Skomager', 'Smed', 'Skrædder', 'Arbejdsmand', 'Indsidder', 'Væver', '']
+POSITIONS = ['Husfader', 'Hustru', 'Søn', 'Datter', 'Tjenestefolk', 'Logerende']
+MARITAL_STATUSES = ['gift', 'ugift', 'enke', 'enkemand']
+
+
+def generate_dataset(csv_dir, pas_per_source=10000, census_sources=5, burials=True, link_density=0.6,
+                     life_course_lengths=None, seed=0):
+    """
+    Write a synthetic link lives dataset to a directory.
+
+    Args:
+        csv_dir: Path of the directory the CSV files are written to
+        pas_per_source: The number of person appearances of each source
+        census_sources: The number of census sources, at most 9
+        burials: If true, a burials source is written as well
+        link_density: The fraction of the person appearances that belong to
+                      a life course
+        life_course_lengths: A dictionary mapping the number of person
+                             appearances of a life course to its relative
+                             weight, LIFE_COURSE_LENGTHS if not given. Lengths
+                             are limited to the number of sources.
+        seed: The seed of the random number generator
+
+    Returns:
+        A dictionary with the number of sources, person appearances, life
+        courses and links of the dataset.
+    """
+    csv_dir = Path(csv_dir)
+    csv_dir.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(seed)
+
+    sources = SOURCES[:census_sources] + (SOURCES[-1:] if burials else [])
+    write_sources(csv_dir / 'sources.csv', sources)
+
+    for source in sources:
+        write_pas(csv_dir / f'{source[4]}.csv', source, pas_per_source, rng)
+
+    (life_courses, links) = write_life_courses(csv_dir, sources, pas_per_source, link_density,
+                                                life_course_lengths or LIFE_COURSE_LENGTHS, rng)
+
+    return {
+        'sources': len(sources),
+        'pas': len(sources) * pas_per_source,
+        'life_courses': life_courses,
+        'links': links
+    }
+
+
+def writer(f):
+    return csv.writer(f, delimiter='$', quotechar='"', lineterminator='\n')
+
+
+def write_sources(path, sources):
+    with path.open('w', encoding='utf-8') as f:
+        w = writer(f)
+        w.writerow(['source_id', 'year', 'type', 'description', 'link', 'filename', 'institution'])
+        for (source_id, year, source_type, description, filename) in sources:
+            w.writerow([source_id, year, source_type, description, '', filename, 'Rigsarkivet'])
+
+
+def write_pas(path, source, count, rng):
+    """
+    Write the person appearances of a source, with pa ids 0 to ``count``.
+    """
+    (_, year, source_type, _, _) = source
+    with path.open('w', encoding='utf-8') as f:
+        w = writer(f)
+        if source_type == 'burials':
+            w.writerow(BURIAL_COLUMNS)
+            for pa_id in range(count):
+                w.writerow(burial_row(pa_id, year, rng))
+        else:
+            w.writerow(CENSUS_COLUMNS)
+            for pa_id in range(count):
+                w.writerow(census_row(pa_id, year, rng))
+
+
+def person(rng):
+    """
+    Returns a random gender, first names, patronym and family name.
+    """
+    gender = rng.choice('mk')
+    first_names = rng.sample(FIRST_NAMES[gender], rng.choice([1, 1, 2, 3]))
+    patronym = rng.choice(FIRST_NAMES['m']) + ('sen' if gender == 'm' else 'sdatter')
+    family_name = rng.choice(FAMILY_NAMES)
+    return (gender, first_names, patronym, family_name)
+
+
+def census_row(pa_id, year, rng):
+    (gender, first_names, patronym, family_name) = person(rng)
+    name = ' '.join(first_names + [patronym, family_name])
+    age = rng.randint(0, 90)
+    parish = rng.choice(PARISHES)
+    return [
+        pa_id, rng.randint(1, 10**7), year, 'census', gender, gender, age, float(age),
+        name, name.lower(), ','.join(n.lower() for n in first_names), patronym.lower(), family_name.lower(),
+        f'{patronym.lower()},{family_name.lower()}', family_name.lower(), rng.choice(MARITAL_STATUSES),
+        rng.choice(MARITAL_STATUSES), rng.choice(POSITIONS), pa_id // 5, rng.choice(OCCUPATIONS), parish,
+        f'{parish} herred', rng.choice(COUNTIES), 'Registreret', rng.choice(PARISHES) + ' sogn', parish.lower(),
+        ' '.join(first_names).lower(), family_name.lower(), f'FT-{year}-{pa_id}', f'B{rng.randint(1, 9999)}'
+    ]
+
+
+def burial_row(pa_id, year, rng):
+    (gender, first_names, _, family_name) = person(rng)
+    name = ' '.join(first_names + [family_name])
+    birth_year = rng.randint(year - 90, year)
+    return [
+        pa_id, rng.randint(1, 10**7), year, 'burial', gender, gender, name, name.lower(),
+        ','.join(n.lower() for n in first_names), family_name.lower(), family_name.lower(),
+        rng.choice(MARITAL_STATUSES), rng.choice(OCCUPATIONS), rng.choice(PARISHES), 'Nørregade',
+        rng.randint(1, 120), rng.choice(['', 'st', '1', '2', '3']), f'{birth_year}-0{rng.randint(1, 9)}-1{rng.randint(0, 9)}',
+        f'{year}-0{rng.randint(1, 9)}-2{rng.randint(0, 8)}', birth_year, year - birth_year, rng.randint(0, 11),
+        rng.choice(PARISHES), 'Afdøde', ' '.join(first_names).lower(), family_name.lower(), rng.randint(1, 10**6)
+    ]
+
+
+def write_life_courses(csv_dir, sources, pas_per_source, link_density, life_course_lengths, rng):
+    """
+    Write life courses through random unused person appearances of the
+    sources, until ``link_density`` of the person appearances are used, and a
+    link between each pair of consecutive person appearances of each life
+    course.
+
+    Returns:
+        A tuple of the number of life courses and links.
+    """
+    lengths = [length for length in life_course_lengths if length <= len(sources)]
+    weights = [life_course_lengths[length] for length in lengths]
+
+    # the unused pa ids of each source, in random order
+    unused = []
+    for _ in sources:
+        pa_ids = list(range(pas_per_source))
+        rng.shuffle(pa_ids)
+        unused.append(pa_ids)
+
+    target = int(link_density * len(sources) * pas_per_source)
+    linked = 0
+    life_course_id = 0
+    link_id = 0
+
+    with (csv_dir / 'life_courses.csv').open('w', encoding='utf-8') as lc_file, \
+            (csv_dir / 'links.csv').open('w', encoding='utf-8') as link_file:
+        lc_writer = writer(lc_file)
+        link_writer = writer(link_file)
+        lc_writer.writerow(['', 'sources', 'pa_ids', 'occurences'])
+        link_writer.writerow(['link_id', 'iteration', 'method_id', 'score', 'duplicates', 'pa_id1', 'source_id1', 'pa_id2', 'source_id2'])
+
+        while linked < target:
+            length = rng.choices(lengths, weights)[0]
+            indices = sorted(rng.sample([i for i in range(len(sources)) if unused[i]], min(length, sum(1 for pa_ids in unused if pa_ids))))
+            if len(indices) < 2:
+                break
+
+            members = [(sources[i][0], unused[i].pop()) for i in indices]
+            lc_writer.writerow([
+                life_course_id,
+                ','.join(str(source_id) for (source_id, _) in members),
+                ','.join(str(pa_id) for (_, pa_id) in members),
+                len(members)
+            ])
+            for ((source_id1, pa_id1), (source_id2, pa_id2)) in zip(members, members[1:]):
+                link_writer.writerow([link_id, rng.randint(1, 3), rng.choice('0012'), round(rng.uniform(0.5, 1.0), 3), 0, pa_id1, source_id1, pa_id2, source_id2])
+                link_id += 1
+
+            life_course_id += 1
+            linked += len(members)
+
+    return (life_course_id, link_id)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Generate a synthetic link lives dataset')
+    parser.add_argument('--csv-dir', type=lambda p: Path(p).resolve(), required=True)
+    parser.add_argument('--pas-per-source', type=int, default=10000)
+    parser.add_argument('--census-sources', type=int, default=5, choices=range(1, 10))
+    parser.add_argument('--no-burials', action='store_true')
+    parser.add_argument('--link-density', type=float, default=0.6, help='The fraction of the person appearances that belong to a life course')
+    parser.add_argument('--life-course-lengths', default=None, help='The distribution of life course lengths, as comma separated length:weight pairs, such as 2:50,3:30,4:20')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    lengths = None
+    if args.life_course_lengths:
+        lengths = {int(length): float(weight) for (length, weight) in (pair.split(':') for pair in args.life_course_lengths.split(','))}
+
+    counts = generate_dataset(args.csv_dir, args.pas_per_source, args.census_sources, not args.no_burials,
+                              args.link_density, lengths, args.seed)
+    print(f' => Wrote {counts["pas"]} person appearances in {counts["sources"]} sources, {counts["life_courses"]} life courses and {counts["links"]} links to {args.csv_dir}')
@@ -1,6 +1,17 @@
+import asyncio
+import gc
+import json
+import os
+import tempfile
 import unittest
+from collections import deque
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import MagicMock, patch, call
-from index import PersonAppearance, csv_pa_bulk_actions, csv_pas_bulk_actions, csv_read_pas
+import pyarrow.parquet as parquet
+from synthetic import generate_dataset
+from benchmark import compare_results, StubBulkHandler
+from index import ALIAS_INDEX_MAPPING, link_routing, PA_LAST_UPDATED, PA_APPEND_SCRIPT, Partition, wait_for_partitions, BUILD_MODES, csv_index, csv_pipelines, columnar_cache, expand_bulk_action, csv_link_life_courses, route_link_actions, csv_assembled_link_actions, index_shard_counts, compare_mapping_profiles, print_mapping_comparison, PA_DOCUMENT_KEYS, mapping_pa_properties, ElasticsearchSink, NdjsonBulkFileSink, NullSink, read_bulk_file, replay_bulk_files, csv_load_sources, csv_census_pas, IndexerMetrics, RunSummary, METRICS, AdaptiveBulkSender, AsyncBulkSender, AsyncElasticsearchSink, BuildCheckpoint, CensusProgress, checkpoint_action, ContentManifest, manifest_delta_actions, create_build_indices, finish_build_indices, swap_aliases, es_builds, retire_builds, PersonAppearance, PersonAppearanceConverter, PersonAppearanceBatchConverter, gc_paused, Source, DocumentAssembler, CompactJoinIndex, DictJoinIndex, SqliteJoinIndex, csv_pa_bulk_actions, csv_pas_bulk_actions, csv_read_pas, csv_read_pas_parallel, encode_pa, split_byte_ranges, csv_read_links, csv_read_life_courses, read_csv, read_csv_rows, csv_has_quotes
 
 
 class TestPersonAppearance(unittest.TestCase):
@@ -11,7 +22,7 @@ class TestPersonAppearance(unittest.TestCase):
     
     def test_from_dict_unique_id(self):
         pa = PersonAppearance.from_dict({'id': 12345, 'source_id': 1, 'source_year': 1845, 'name': 'Bo Larsen'})
-        self.assertEqual(pa.id, '1845-12345')
+        self.assertEqual(pa.id, '1-12345')
     
     def test_from_dict_missing_none(self):
         pa = PersonAppearance.from_dict({'id': 12345, 'source_id': 1, 'source_year': 1845, 'name': 'Bo Larsen'})
@@ -23,7 +34,7 @@ class TestPersonAppearance(unittest.TestCase):
             getattr(pa, 'unknown_field')
     
     def test_from_dict_unknown_field_raise_invalid(self):
-        with self.assertRaises(AttributeError):
+        with self.assertRaisesRegex(Exception, 'unknown_field'):
             PersonAppearance.from_dict({'id': 12345, 'source_id': 1, 'source_year': 1845, 'name': 'Bo Larsen', 'unknown_field': 'unknown_value'}, raise_invalid=True)
     
     def test_from_dict_missing_id(self):
@@ -33,6 +44,7 @@ class TestPersonAppearance(unittest.TestCase):
     def test_from_dict_all_valid_fields(self):
         d = {
             'id': 12345,
+            'source_id': 4,
             'gender': 'a',
             'gender_clean': 'b',
             'gender_std': 'c',
@@ -151,6 +163,7 @@ class TestPersonAppearance(unittest.TestCase):
     def test_from_dict_es_document_relation(self):
         d = {
             'id': '12345',
+            'source_id': '1',
             'gender': 'a',
             'gender_clean': 'b',
             'gender_std': 'c',
@@ -225,158 +238,1040 @@ class TestPersonAppearance(unittest.TestCase):
         d['maiden_patronyms'] = [d['maiden_patronyms']]
         d['all_possible_patronyms'] = [d['all_possible_patronyms']]
         d['all_possible_family_names'] = [d['all_possible_family_names']]
-        
+
+        # the special fields derived from the raw values
+        d['first_names_sortable'] = 'g'
+        d['family_names_sortable'] = 'n'
+        d['last_updated'] = PA_LAST_UPDATED
+
         self.assertEqual(pa.es_document(), d)
 
 
+@patch.dict(ALIAS_INDEX_MAPPING, {'sources': 'sources_2', 'pas': 'pas_2', 'links': 'links_2', 'lifecourses': 'lifecourses_2'})
 class TestElasticSearchHelpers(unittest.TestCase):
 
     def test_csv_pa_bulk_action_no_links_no_life_courses(self):
-        iterator = csv_pa_bulk_actions(PersonAppearance(123, 1), [], [])
+        iterator = csv_pa_bulk_actions(PersonAppearance(123, 1).es_document(), [], [])
 
         action = next(iterator)
         self.assertEqual(action.get('_op_type'), 'index')
         self.assertEqual(action.get('_index'), 'pas')
         self.assertEqual(action.get('_id'), '1-123')
-        self.assertEqual(action.get('person_appearance').get('pa_id'), 123)
+        self.assertEqual(json.loads(action.get('_source')).get('person_appearance').get('pa_id'), 123)
 
         with self.assertRaises(StopIteration):
             next(iterator)
     
     def test_csv_pa_bulk_action(self):
-        iterator = csv_pa_bulk_actions(PersonAppearance(123, 1), [2], [3])
+        iterator = csv_pa_bulk_actions(PersonAppearance(123, 1).es_document(), [2], [3])
 
         action = next(iterator)
         self.assertEqual(action.get('_op_type'), 'index')
         self.assertEqual(action.get('_index'), 'pas')
         self.assertEqual(action.get('_id'), '1-123')
-        self.assertEqual(action.get('person_appearance').get('pa_id'), 123)
+        self.assertEqual(json.loads(action.get('_source')).get('person_appearance').get('pa_id'), 123)
 
         action = next(iterator)
         self.assertEqual(action.get('_op_type'), 'update')
         self.assertEqual(action.get('_index'), 'links')
         self.assertEqual(action.get('_id'), 3)
-        self.assertIn('script', action.keys())
-        self.assertEqual(action.get('script').get('params').get('pa').get('pa_id'), 123)
+        self.assertIn('script', json.loads(action.get('_source')))
+        self.assertEqual(json.loads(action.get('_source')).get('script').get('params').get('pa').get('pa_id'), 123)
+        link_body = action.get('_source')
 
         action = next(iterator)
         self.assertEqual(action.get('_op_type'), 'update')
         self.assertEqual(action.get('_index'), 'lifecourses')
         self.assertEqual(action.get('_id'), 2)
-        self.assertIn('script', action.keys())
-        self.assertEqual(action.get('script').get('params').get('pa').get('pa_id'), 123)
+        self.assertEqual(action.get('_source'), link_body)
+        self.assertEqual(json.loads(action.get('_source')).get('script').get('source'), PA_APPEND_SCRIPT)
+        self.assertEqual(json.loads(action.get('_source')).get('script').get('lang'), 'painless')
+        self.assertEqual(json.loads(action.get('_source')).get('script').get('params').get('pa').get('pa_id'), 123)
 
         with self.assertRaises(StopIteration):
             next(iterator)
 
     def test_csv_pas_bulk_actions(self):
-        pas = [(PersonAppearance(123, 1), [1], [1]), (PersonAppearance(234, 2), [1], [1, 2]), (PersonAppearance(345, 3), [1], [2])]
+        pas = [(PersonAppearance(123, 1).es_document(), [1], [1]), (PersonAppearance(234, 2).es_document(), [1], [1, 2]), (PersonAppearance(345, 3).es_document(), [1], [2])]
         iterator = csv_pas_bulk_actions(pas)
         
         action = next(iterator)
         self.assertEqual(action.get('_op_type'), 'index')
         self.assertEqual(action.get('_index'), 'pas')
         self.assertEqual(action.get('_id'), '1-123')
-        self.assertEqual(action.get('person_appearance').get('pa_id'), 123)
+        self.assertEqual(json.loads(action.get('_source')).get('person_appearance').get('pa_id'), 123)
 
         action = next(iterator)
         self.assertEqual(action.get('_op_type'), 'update')
         self.assertEqual(action.get('_index'), 'links')
         self.assertEqual(action.get('_id'), 1)
-        self.assertIn('script', action.keys())
-        self.assertEqual(action.get('script').get('params').get('pa').get('pa_id'), 123)
+        self.assertIn('script', json.loads(action.get('_source')))
+        self.assertEqual(json.loads(action.get('_source')).get('script').get('params').get('pa').get('pa_id'), 123)
 
         action = next(iterator)
         self.assertEqual(action.get('_op_type'), 'update')
         self.assertEqual(action.get('_index'), 'lifecourses')
         self.assertEqual(action.get('_id'), 1)
-        self.assertIn('script', action.keys())
-        self.assertEqual(action.get('script').get('params').get('pa').get('pa_id'), 123)
+        self.assertIn('script', json.loads(action.get('_source')))
+        self.assertEqual(json.loads(action.get('_source')).get('script').get('params').get('pa').get('pa_id'), 123)
 
         action = next(iterator)
         self.assertEqual(action.get('_op_type'), 'index')
         self.assertEqual(action.get('_index'), 'pas')
         self.assertEqual(action.get('_id'), '2-234')
-        self.assertEqual(action.get('person_appearance').get('pa_id'), 234)
+        self.assertEqual(json.loads(action.get('_source')).get('person_appearance').get('pa_id'), 234)
 
         action = next(iterator)
         self.assertEqual(action.get('_op_type'), 'update')
         self.assertEqual(action.get('_index'), 'links')
         self.assertEqual(action.get('_id'), 1)
-        self.assertIn('script', action.keys())
-        self.assertEqual(action.get('script').get('params').get('pa').get('pa_id'), 234)
+        self.assertIn('script', json.loads(action.get('_source')))
+        self.assertEqual(json.loads(action.get('_source')).get('script').get('params').get('pa').get('pa_id'), 234)
 
         action = next(iterator)
         self.assertEqual(action.get('_op_type'), 'update')
         self.assertEqual(action.get('_index'), 'links')
         self.assertEqual(action.get('_id'), 2)
-        self.assertIn('script', action.keys())
-        self.assertEqual(action.get('script').get('params').get('pa').get('pa_id'), 234)
+        self.assertIn('script', json.loads(action.get('_source')))
+        self.assertEqual(json.loads(action.get('_source')).get('script').get('params').get('pa').get('pa_id'), 234)
 
         action = next(iterator)
         self.assertEqual(action.get('_op_type'), 'update')
         self.assertEqual(action.get('_index'), 'lifecourses')
         self.assertEqual(action.get('_id'), 1)
-        self.assertIn('script', action.keys())
-        self.assertEqual(action.get('script').get('params').get('pa').get('pa_id'), 234)
+        self.assertIn('script', json.loads(action.get('_source')))
+        self.assertEqual(json.loads(action.get('_source')).get('script').get('params').get('pa').get('pa_id'), 234)
 
         action = next(iterator)
         self.assertEqual(action.get('_op_type'), 'index')
         self.assertEqual(action.get('_index'), 'pas')
         self.assertEqual(action.get('_id'), '3-345')
-        self.assertEqual(action.get('person_appearance').get('pa_id'), 345)
+        self.assertEqual(json.loads(action.get('_source')).get('person_appearance').get('pa_id'), 345)
 
         action = next(iterator)
         self.assertEqual(action.get('_op_type'), 'update')
         self.assertEqual(action.get('_index'), 'links')
         self.assertEqual(action.get('_id'), 2)
-        self.assertIn('script', action.keys())
-        self.assertEqual(action.get('script').get('params').get('pa').get('pa_id'), 345)
+        self.assertIn('script', json.loads(action.get('_source')))
+        self.assertEqual(json.loads(action.get('_source')).get('script').get('params').get('pa').get('pa_id'), 345)
 
         action = next(iterator)
         self.assertEqual(action.get('_op_type'), 'update')
         self.assertEqual(action.get('_index'), 'lifecourses')
         self.assertEqual(action.get('_id'), 1)
-        self.assertIn('script', action.keys())
-        self.assertEqual(action.get('script').get('params').get('pa').get('pa_id'), 345)
+        self.assertIn('script', json.loads(action.get('_source')))
+        self.assertEqual(json.loads(action.get('_source')).get('script').get('params').get('pa').get('pa_id'), 345)
 
         with self.assertRaises(StopIteration):
             next(iterator)
 
+    def test_csv_pa_bulk_action_profiles(self):
+        pa = PersonAppearance(123, 1)
+        pa.name = 'Peder Hansen'
+        pa.occupation = 'smed'
+        pa.transcriber_comments = 'illegible'
+        document = pa.es_document()
+
+        for (profile, keys) in (('full', ['id', 'name', 'occupation', 'transcriber_comments']), ('summary', ['id', 'name', 'occupation']), ('reference', ['id', 'pa_id', 'source_id'])):
+            [pas_action, link_action] = list(csv_pa_bulk_actions(document, [], [3], profile))
+            self.assertEqual(json.loads(pas_action['_source'])['person_appearance'], document)
+            embedded = json.loads(link_action['_source'])['script']['params']['pa']
+            self.assertTrue(all(key in embedded for key in keys))
+            if profile != 'full':
+                self.assertNotIn('transcriber_comments', embedded)
+            if profile == 'reference':
+                self.assertEqual(embedded, {'id': '1-123', 'pa_id': 123, 'source_id': 1})
+
+    def test_expand_bulk_action_routing(self):
+        (action_line, body) = expand_bulk_action({'_op_type': 'update', '_index': 'links', '_id': 3, '_source': '{}', '_routing': '2'}, {'links': 'links_2'})
+        self.assertEqual(action_line, {'update': {'_index': 'links_2', '_id': 3, 'routing': '2'}})
+        (action_line, _) = expand_bulk_action({'_op_type': 'index', '_index': 'links', '_id': 3, '_source': '{}', '_routing': None})
+        self.assertEqual(action_line, {'index': {'_index': 'links', '_id': 3}})
+
+    def test_link_life_courses_and_routing(self):
+        pa_life_courses = DictJoinIndex()
+        for (pa_id, life_course_id) in (('1', 4), ('1', 9), ('2', 9), ('2', 4), ('3', 6)):
+            pa_life_courses.add(pa_id, '1', life_course_id)
+        links = [('10', {'link_id': '10', 'pa_id1': '1', 'source_id1': '1', 'pa_id2': '2', 'source_id2': '1'}),
+                 ('11', {'link_id': '11', 'pa_id1': '2', 'source_id1': '1', 'pa_id2': '3', 'source_id2': '1'})]
+        link_life_courses = CompactJoinIndex()
+
+        self.assertEqual([life_course_ids for (_, life_course_ids) in csv_link_life_courses(links, pa_life_courses, link_life_courses)], [[4, 9], []])
+        link_life_courses.freeze()
+
+        pas = [(PersonAppearance(2, 1).es_document(), [4, 9], ['10', '11'])]
+        actions = list(route_link_actions(csv_pas_bulk_actions(pas), link_life_courses))
+        self.assertEqual([(action['_index'], action.get('_routing')) for action in actions], [('pas', None), ('links', '4'), ('links', None), ('lifecourses', None), ('lifecourses', None)])
+
+    def test_link_routing_several_life_courses(self):
+        self.assertEqual(link_routing([7, 3, 12]), '3')
+        self.assertIsNone(link_routing([]))
+
+        pa_life_courses = DictJoinIndex()
+        for (pa_id, life_course_id) in (('1', 7), ('1', 3), ('2', 3), ('2', 7)):
+            pa_life_courses.add(pa_id, '1', life_course_id)
+        links = [('10', {'link_id': '10', 'pa_id1': '1', 'source_id1': '1', 'pa_id2': '2', 'source_id2': '1'})]
+        link_life_courses = DictJoinIndex()
+        [(_, life_course_ids)] = list(csv_link_life_courses(links, pa_life_courses, link_life_courses))
+        link_life_courses.freeze()
+
+        # the link belongs to both life courses, but is only routed by the first
+        self.assertEqual(life_course_ids, [3, 7])
+        pas = [(PersonAppearance(1, 1).es_document(), [3, 7], ['10'])]
+        routings = [action['_routing'] for action in route_link_actions(csv_pas_bulk_actions(pas), link_life_courses) if action['_index'] == 'links']
+        self.assertEqual(routings, ['3'])
+        for partition in (Partition(i, 4) for i in range(4)):
+            self.assertEqual(partition.owns_link('10', [7, 3]), partition.owns_life_course(3))
+
+    def test_assembled_link_actions_routing(self):
+        assembler = DocumentAssembler()
+        try:
+            assembler.add_document('links', '10', '{"link_id":"10"}')
+            assembler.add_pa(encode_pa(PersonAppearance(1, 1).es_document()), [], ['10'])
+            link_life_courses = DictJoinIndex()
+            link_life_courses.add('10', 0, 4)
+
+            [action] = list(csv_assembled_link_actions(assembler, link_life_courses))
+            self.assertEqual(action['_routing'], '4')
+            self.assertEqual(json.loads(action['_source'])['life_course_ids'], [4])
+        finally:
+            assembler.close()
+
+
+class TestAdaptiveBulkSender(unittest.TestCase):
+
+    def actions(self, n):
+        return [{'_op_type': 'index', '_index': 'pas', '_id': i, '_source': '{"id":%d}' % i} for i in range(n)]
+
+    def bulk_response(self, body, statuses=None):
+        ids = [json.loads(line)['index']['_id'] for line in body[::2]]
+        return {'items': [{'index': {'_id': i, 'status': (statuses or {}).get(i, 201)}} for i in ids]}
+
+    def test_send_batches_by_bytes(self):
+        es = MagicMock()
+        es.bulk.side_effect = lambda body: self.bulk_response(body)
+        sender = AdaptiveBulkSender(es, thread_count=2, start_bytes=100, min_bytes=50)
+
+        results = list(sender.send(self.actions(10)))
+
+        self.assertEqual([info['index']['_id'] for (_, info) in results], list(range(10)))
+        self.assertTrue(all(success for (success, _) in results))
+        self.assertGreater(es.bulk.call_count, 1)
+        self.assertEqual(es.bulk.call_args_list[0].kwargs['body'][:2], ['{"index":{"_index":"pas","_id":0}}', '{"id":0}'])
+        self.assertEqual(sender.in_flight, 0)
+
+    def test_retry_rejected_documents(self):
+        es = MagicMock()
+        es.bulk.side_effect = [
+            self.bulk_response(['{"index":{"_id":0}}', '', '{"index":{"_id":1}}', ''], {1: 429}),
+            self.bulk_response(['{"index":{"_id":1}}', ''])
+        ]
+        sender = AdaptiveBulkSender(es, start_bytes=2**20, min_bytes=2**10, backoff_seconds=0)
+
+        results = list(sender.send(self.actions(2)))
+
+        self.assertEqual([success for (success, _) in results], [True, True])
+        self.assertEqual(es.bulk.call_args_list[1].kwargs['body'], ['{"index":{"_index":"pas","_id":1}}', '{"id":1}'])
+        self.assertEqual(sender.retries, 1)
+        self.assertEqual(sender.batch_bytes, 2**19 + 2**10)
+
+    def test_retry_rejected_request(self):
+        error = Exception('rejected')
+        error.status_code = 503
+        es = MagicMock()
+        es.bulk.side_effect = [error, self.bulk_response(['{"index":{"_id":0}}', ''])]
+        sender = AdaptiveBulkSender(es, backoff_seconds=0)
+
+        self.assertEqual([success for (success, _) in sender.send(self.actions(1))], [True])
+        self.assertEqual(es.bulk.call_count, 2)
+
+    def test_failed_after_max_retries(self):
+        es = MagicMock()
+        es.bulk.side_effect = lambda body: self.bulk_response(body, {0: 429})
+        sender = AdaptiveBulkSender(es, max_retries=2, backoff_seconds=0)
+
+        [(success, info)] = list(sender.send(self.actions(1)))
+
+        self.assertFalse(success)
+        self.assertEqual(info['index']['status'], 429)
+        self.assertEqual(es.bulk.call_count, 3)
+
+    def test_send_acknowledge_checkpoints(self):
+        es = MagicMock()
+        es.bulk.side_effect = lambda body: self.bulk_response(body)
+        sender = AdaptiveBulkSender(es, start_bytes=100, min_bytes=50)
+        acknowledged = []
+
+        def acknowledge(checkpoint):
+            acknowledged.append((checkpoint, es.bulk.call_count))
+
+        actions = self.actions(6)
+        results = list(sender.send(actions[:3] + [checkpoint_action('a')] + actions[3:] + [checkpoint_action('b')], acknowledge))
+
+        self.assertEqual(len(results), 6)
+        self.assertEqual([checkpoint for (checkpoint, _) in acknowledged], ['a', 'b'])
+        self.assertEqual(acknowledged[-1][1], es.bulk.call_count)
+
+    def test_send_delete(self):
+        es = MagicMock()
+        es.bulk.side_effect = lambda body: {'items': [{'delete': {'_id': 1, 'status': 200}}]}
+        sender = AdaptiveBulkSender(es)
+
+        self.assertEqual([success for (success, _) in sender.send([{'_op_type': 'delete', '_index': 'pas', '_id': 1}])], [True])
+        self.assertEqual(es.bulk.call_args.kwargs['body'], ['{"delete":{"_index":"pas","_id":1}}'])
+
+
+class AsyncBulkClient:
+    """
+    A stand-in for the bulk API of an AsyncElasticsearch client, which
+    responds with ``respond`` and records the bodies and the largest number
+    of concurrent requests.
+    """
+
+    def __init__(self, respond):
+        self.respond = respond
+        self.bodies = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.closed = False
+
+    async def bulk(self, body):
+        self.bodies.append(body)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.001)
+            return self.respond(body)
+        finally:
+            self.in_flight -= 1
+
+    async def close(self):
+        self.closed = True
+
+
+class TestAsyncBulkSender(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def actions(self, n):
+        return [{'_op_type': 'index', '_index': 'pas', '_id': i, '_source': '{"id":%d}' % i} for i in range(n)]
+
+    def bulk_response(self, body, statuses=None):
+        ids = [json.loads(line)['index']['_id'] for line in body[::2]]
+        return {'items': [{'index': {'_id': i, 'status': (statuses or {}).get(i, 201)}} for i in ids]}
+
+    def test_send_in_order(self):
+        es = AsyncBulkClient(self.bulk_response)
+        sender = AsyncBulkSender(es, self.loop, queue_batches=2, thread_count=2, start_bytes=100, min_bytes=50)
+        acknowledged = []
+
+        actions = self.actions(20)
+        results = list(sender.send(actions[:10] + [checkpoint_action('a')] + actions[10:], acknowledged.append))
+
+        self.assertEqual([info['index']['_id'] for (_, info) in results], list(range(20)))
+        self.assertEqual(acknowledged, ['a'])
+        self.assertGreater(len(es.bodies), 2)
+        self.assertEqual(es.max_in_flight, 2)
+        self.assertEqual((sender.in_flight, sender.queued), (0, 0))
+
+    def test_retry_rejected_documents(self):
+        responses = iter([{1: 429}, {}])
+        es = AsyncBulkClient(lambda body: self.bulk_response(body, next(responses)))
+        sender = AsyncBulkSender(es, self.loop, start_bytes=2**20, backoff_seconds=0)
+
+        self.assertEqual([success for (success, _) in sender.send(self.actions(2))], [True, True])
+        self.assertEqual(es.bodies[1], ['{"index":{"_index":"pas","_id":1}}', '{"id":1}'])
+        self.assertEqual(sender.retries, 1)
+
+    def test_build_error(self):
+        def actions():
+            yield from self.actions(2)
+            raise ValueError('bad row')
+
+        es = AsyncBulkClient(self.bulk_response)
+        sender = AsyncBulkSender(es, self.loop, start_bytes=10)
+        results = []
+        with self.assertRaises(ValueError):
+            for result in sender.send(actions()):
+                results.append(result)
+        self.assertEqual(len(results), 2)
+
+    def test_close_early(self):
+        es = AsyncBulkClient(self.bulk_response)
+        sender = AsyncBulkSender(es, self.loop, start_bytes=10)
+        results = sender.send(self.actions(50))
+        next(results)
+        results.close()
+
+        self.assertEqual([success for (success, _) in sender.send(self.actions(1))], [True])
+        self.assertEqual(sender.in_flight, 0)
+
+
+class TestSinks(unittest.TestCase):
+
+    def actions(self, n):
+        return [{'_op_type': 'index', '_index': 'pas', '_id': i, '_source': '{"id":%d}' % i} for i in range(n)]
+
+    @patch.dict(ALIAS_INDEX_MAPPING, {'pas': 'pas_2'})
+    def test_elasticsearch_sink_indices(self):
+        es = MagicMock()
+        es.bulk.side_effect = lambda body: {'items': [{'index': {'_id': 0, 'status': 201}}]}
+        sink = ElasticsearchSink(es)
+
+        self.assertEqual([success for (success, _) in sink.send(self.actions(1))], [True])
+        self.assertEqual(es.bulk.call_args.kwargs['body'], ['{"index":{"_index":"pas_2","_id":0}}', '{"id":0}'])
+
+    @patch.dict(ALIAS_INDEX_MAPPING, {'pas': 'pas_2'})
+    def test_async_elasticsearch_sink(self):
+        clients = []
+
+        def client():
+            clients.append(AsyncBulkClient(lambda body: {'items': [{'index': {'_id': 0, 'status': 201}}]}))
+            return clients[-1]
+
+        sink = AsyncElasticsearchSink(client)
+        self.assertEqual([success for (success, _) in sink.send(self.actions(1))], [True])
+        self.assertEqual([success for (success, _) in sink.send(self.actions(1), requests=1)], [True])
+
+        self.assertEqual(clients[0].bodies, [['{"index":{"_index":"pas_2","_id":0}}', '{"id":0}']])
+        self.assertTrue(all(es.closed for es in clients))
+        self.assertEqual(sink.sender.thread_count, 1)
+
+    def test_elasticsearch_sink_requests(self):
+        es = MagicMock()
+        es.bulk.side_effect = lambda body: {'items': [{'index': {'_id': 0, 'status': 201}}]}
+        sink = ElasticsearchSink(es, thread_count=4)
+
+        list(sink.send(self.actions(1), requests=2))
+        self.assertEqual(sink.sender.thread_count, 2)
+        list(sink.send(self.actions(1)))
+        self.assertEqual(sink.sender.thread_count, 4)
+
+        # each thread has the sender of its own calls
+        with ThreadPoolExecutor(1) as executor:
+            executor.submit(lambda: list(sink.send(self.actions(1), requests=1))).result()
+        self.assertEqual(sink.sender.thread_count, 4)
+
+    def test_null_sink(self):
+        sink = NullSink()
+        acknowledged = []
+
+        results = list(sink.send(self.actions(2) + [checkpoint_action('a')], acknowledged.append))
+
+        self.assertEqual(results, [(True, None), (True, None)])
+        self.assertEqual(acknowledged, ['a'])
+        self.assertEqual((sink.actions, sink.bytes), (2, 2 * len('{"index":{"_index":"pas","_id":0}}\n{"id":0}\n')))
+
+    def test_ndjson_sink_rotates_files(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            sink = NdjsonBulkFileSink(tmp_dir, max_bytes=100)
+            acknowledged = []
+            actions = self.actions(4)
+
+            def acknowledge(checkpoint):
+                acknowledged.append((checkpoint, sorted(os.listdir(tmp_dir))))
+
+            list(sink.send(actions[:1] + [checkpoint_action('a')] + actions[1:], acknowledge))
+            list(sink.send([{'_op_type': 'delete', '_index': 'pas', '_id': 9}]))
+
+            self.assertEqual(sorted(os.listdir(tmp_dir)), ['bulk-00000-00000.ndjson.gz', 'bulk-00000-00001.ndjson.gz', 'bulk-00001-00000.ndjson.gz'])
+            self.assertEqual(acknowledged, [('a', ['bulk-00000-00000.ndjson.gz'])])
+            lines = [lines for name in ('bulk-00000-00000.ndjson.gz', 'bulk-00000-00001.ndjson.gz') for lines in read_bulk_file(os.path.join(tmp_dir, name))]
+            self.assertEqual(lines[0], ('{"index":{"_index":"pas","_id":0}}', '{"id":0}'))
+            self.assertEqual(len(lines), 4)
+            self.assertEqual(list(read_bulk_file(os.path.join(tmp_dir, 'bulk-00001-00000.ndjson.gz'), {'pas': 'pas_2'})), [('{"delete":{"_index":"pas_2","_id":9}}',)])
+
+            self.assertEqual(NdjsonBulkFileSink(tmp_dir).group, 2)
+
+    @patch('builtins.print')
+    @patch.dict(ALIAS_INDEX_MAPPING, {'pas': 'pas_2'})
+    def test_replay_bulk_files(self, mock_print):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            sink = NdjsonBulkFileSink(tmp_dir, max_bytes=100)
+            list(sink.send(self.actions(4)))
+            list(sink.send([{'_op_type': 'delete', '_index': 'pas', '_id': 0}]))
+
+            es = MagicMock()
+            bodies = []
+
+            def bulk(body):
+                bodies.append(body)
+                return {'items': [{next(iter(json.loads(line))): {'status': 200}} for line in body if '_index' in line]}
+
+            es.bulk.side_effect = bulk
+            self.assertEqual(replay_bulk_files(es, tmp_dir, workers=2), 0)
+
+            lines = [line for body in bodies for line in body]
+            self.assertEqual(len(lines), 9)
+            self.assertEqual(lines[-1], '{"delete":{"_index":"pas_2","_id":0}}')
+            self.assertTrue(all('"pas_2"' in line for line in lines if '_index' in line))
+
+
+class TestIndexLifecycle(unittest.TestCase):
+
+    @patch('builtins.print')
+    @patch.dict(ALIAS_INDEX_MAPPING, {'sources': None, 'pas': None, 'links': None, 'lifecourses': None})
+    def test_create_build_indices(self, mock_print):
+        es = MagicMock()
+        create_build_indices(es, '01-01-2021_00-00-00')
+
+        self.assertEqual(ALIAS_INDEX_MAPPING['pas'], 'pas_01-01-2021_00-00-00')
+        self.assertEqual(es.indices.create.call_count, 4)
+        body = es.indices.create.call_args_list[0].kwargs['body']
+        self.assertEqual(body['settings']['index.refresh_interval'], -1)
+        self.assertEqual(body['settings']['index.number_of_replicas'], 0)
+        self.assertIn('properties', body['mappings'])
+        es.indices.put_mapping.assert_not_called()
+
+    @patch('builtins.print')
+    @patch.dict(ALIAS_INDEX_MAPPING, {'sources': None, 'pas': None, 'links': None, 'lifecourses': None})
+    def test_create_build_indices_profile(self, mock_print):
+        es = MagicMock()
+        create_build_indices(es, '01-01-2021_00-00-00', 'reference')
+
+        mappings = {call.kwargs['index']: call.kwargs['body']['mappings'] for call in es.indices.create.call_args_list}
+        links = mappings['links_01-01-2021_00-00-00']
+        self.assertEqual(links['_meta'], {'pa_profile': 'reference', 'mapping_profile': 'standard'})
+        self.assertEqual(sorted(links['properties']['person_appearance']['properties']), ['id', 'pa_id', 'source_id'])
+        self.assertEqual(mappings['pas_01-01-2021_00-00-00']['properties']['person_appearance']['properties'], mapping_pa_properties())
+
+    @patch('builtins.print')
+    @patch.dict(ALIAS_INDEX_MAPPING, {'sources': None, 'pas': None, 'links': None, 'lifecourses': None})
+    def test_create_build_indices_shards(self, mock_print):
+        es = MagicMock()
+        create_build_indices(es, '01-01-2021_00-00-00', shards={'pas': 3})
+
+        settings = {call.kwargs['index']: call.kwargs['body']['settings'] for call in es.indices.create.call_args_list}
+        self.assertEqual(settings['pas_01-01-2021_00-00-00']['index.number_of_shards'], 3)
+        self.assertNotIn('index.number_of_shards', settings['links_01-01-2021_00-00-00'])
+        # the life courses and links have nested fields, which cannot be sorted
+        self.assertFalse(any(key.startswith('index.sort') for index_settings in settings.values() for key in index_settings))
+
+    def test_index_shard_counts(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for (name, size) in (('census_1845.csv', 300), ('cph_burials.csv', 100), ('links.csv', 250), ('life_courses.csv', 50), ('sources.csv', 10)):
+                Path(tmp_dir, name).write_bytes(b'x' * size)
+
+            self.assertEqual(index_shard_counts(Path(tmp_dir), 200), {'sources': 1, 'pas': 2, 'lifecourses': 3, 'links': 4})
+
+    def test_lean_mapping_profile(self):
+        standard = mapping_pa_properties()
+        lean = mapping_pa_properties(mapping_profile='lean')
+
+        self.assertEqual(set(lean), set(standard))
+        self.assertEqual(lean['transcriber_comments'], {'type': 'text', 'index': False})
+        self.assertEqual(lean['name'], standard['name'])
+        self.assertEqual(lean['gender'], {'type': 'text', 'norms': False, 'index_options': 'docs'})
+        self.assertEqual(lean['parish']['fields']['keyword']['type'], 'keyword')
+        self.assertEqual(lean['family_names_sortable'], standard['family_names_sortable'])
+        self.assertEqual(lean['hh_id'], standard['hh_id'])
+
+    @patch('builtins.print')
+    @patch('index.finish_build_indices')
+    @patch('index.csv_index')
+    @patch.dict(ALIAS_INDEX_MAPPING, {'sources': None, 'pas': None, 'links': None, 'lifecourses': None})
+    def test_compare_mapping_profiles(self, mock_csv_index, mock_finish, mock_print):
+        es = MagicMock()
+        es.cat.indices.side_effect = lambda index, **kwargs: [{'index': name, 'docs.count': '10', 'store.size': '2048' if 'standard' in name else '1024'} for name in index.split(',')]
+        es.search.return_value = {'took': 3, 'hits': {'hits': [{'_source': {'person_appearance': {'name': 'Peder Hansen'}}}]}}
+
+        results = compare_mapping_profiles(es, '/data', repeat=2)
+
+        self.assertEqual([result['mapping_profile'] for result in results], ['standard', 'lean'])
+        self.assertEqual(results[1]['bytes']['pas'], 1024)
+        self.assertEqual(results[0]['latency_ms']['lifecourses name match'], 3)
+        self.assertEqual(mock_csv_index.call_count, 2)
+        created = {call.kwargs['index']: call.kwargs['body']['mappings'] for call in es.indices.create.call_args_list}
+        self.assertEqual(created['pas_compare-lean']['_meta'], {'mapping_profile': 'lean'})
+        searched = es.search.call_args_list[-1].kwargs
+        self.assertFalse(searched['request_cache'])
+        self.assertEqual([call.kwargs['index'] for call in es.indices.delete.call_args_list[1::2]], ['sources_compare-standard,pas_compare-standard,links_compare-standard,lifecourses_compare-standard', 'sources_compare-lean,pas_compare-lean,links_compare-lean,lifecourses_compare-lean'])
+        print_mapping_comparison(results)
+
+    @patch('builtins.print')
+    @patch.dict(ALIAS_INDEX_MAPPING, {'sources': 's_2', 'pas': 'p_2', 'links': 'l_2', 'lifecourses': 'lc_2'})
+    def test_finish_build_indices_unhealthy(self, mock_print):
+        es = MagicMock()
+        es.cluster.health.return_value = {'timed_out': True, 'status': 'yellow'}
+
+        with self.assertRaises(Exception):
+            finish_build_indices(es, max_segments=2)
+        es.indices.put_settings.assert_called_once()
+        self.assertEqual(es.indices.forcemerge.call_args.kwargs['max_num_segments'], 2)
+
+    @patch.dict(ALIAS_INDEX_MAPPING, {'sources': 's_2', 'pas': 'p_2', 'links': 'l_2', 'lifecourses': 'lc_2'})
+    def test_swap_aliases(self):
+        es = MagicMock()
+        es.indices.exists_alias.side_effect = lambda name: name == 'pas'
+        es.indices.get_alias.return_value = {'p_1': {'aliases': {'pas': {}}}}
+
+        swap_aliases(es)
+
+        es.indices.update_aliases.assert_called_once()
+        actions = es.indices.update_aliases.call_args.kwargs['body']['actions']
+        self.assertIn({'remove': {'index': 'p_1', 'alias': 'pas'}}, actions)
+        self.assertIn({'add': {'index': 'p_2', 'alias': 'pas'}}, actions)
+        self.assertEqual(len(actions), 5)
+
+
+    def mock_builds_es(self):
+        def row(index, status='open'):
+            return {'index': index, 'status': status, 'docs.count': '10' if status == 'open' else None, 'store.size': '1024' if status == 'open' else None}
+
+        es = MagicMock()
+        es.cat.indices.return_value = [
+            row('pas_02-01-2021_00-00-00'), row('links_02-01-2021_00-00-00'),
+            row('pas_01-02-2021_00-00-00'), row('links_01-02-2021_00-00-00'),
+            row('pas_01-01-2021_00-00-00', 'close'), row('pas_03-01-2021_00-00-00'),
+            row('pas_not-a-build')
+        ]
+        es.indices.exists_alias.side_effect = lambda name: name == 'pas'
+        es.indices.get_alias.return_value = {'pas_01-02-2021_00-00-00': {}}
+        return es
+
+    def test_es_builds(self):
+        builds = es_builds(self.mock_builds_es())
+
+        self.assertEqual([timestamp for (timestamp, _) in builds], ['01-01-2021_00-00-00', '02-01-2021_00-00-00', '03-01-2021_00-00-00', '01-02-2021_00-00-00'])
+        self.assertEqual(sorted(builds[1][1]), ['links', 'pas'])
+
+    @patch('builtins.print')
+    def test_retire_builds(self, mock_print):
+        es = self.mock_builds_es()
+
+        retire_builds(es, 2)
+
+        es.indices.close.assert_called_once_with(index='pas_03-01-2021_00-00-00')
+        self.assertEqual([call.kwargs['index'] for call in es.indices.delete.call_args_list], ['pas_01-01-2021_00-00-00', 'pas_02-01-2021_00-00-00,links_02-01-2021_00-00-00'])
+
+
+class TestPartitions(unittest.TestCase):
+
+    def test_parse(self):
+        self.assertEqual((Partition.parse('2/3').index, Partition.parse('2/3').count), (1, 3))
+        self.assertEqual(str(Partition.parse('2/3')), '2/3')
+        for value in ('0/3', '4/3', '3'):
+            with self.assertRaises(ValueError):
+                Partition.parse(value)
+
+    def test_ownership_disjoint(self):
+        partitions = [Partition(i, 4) for i in range(4)]
+        for life_course_id in range(200):
+            self.assertEqual(sum(partition.owns_life_course(life_course_id) for partition in partitions), 1)
+            self.assertEqual([partition.owns_link('7', [life_course_id, life_course_id + 1]) for partition in partitions],
+                             [partition.owns_life_course(life_course_id) for partition in partitions])
+            self.assertEqual(sum(partition.owns_pa(f'1845-{life_course_id}', []) for partition in partitions), 1)
+        self.assertTrue(all(any(partition.owns_life_course(i) for i in range(200)) for partition in partitions))
+
+    @patch('builtins.print')
+    @patch('time.sleep')
+    def test_wait_for_partitions(self, mock_sleep, mock_print):
+        es = MagicMock()
+        es.mget.side_effect = [
+            {'docs': [{'found': True, '_source': {'failures': 0}}, {'found': False}]},
+            {'docs': [{'found': True, '_source': {'failures': 0}}, {'found': True, '_source': {'failures': 2}}]}
+        ]
+        markers = wait_for_partitions(es, '01-01-2021_00-00-00', 2, timeout=60, poll_seconds=1)
+        self.assertEqual([marker['failures'] for marker in markers], [0, 2])
+        self.assertEqual(es.mget.call_args.kwargs['body']['ids'], ['01-01-2021_00-00-00_1-of-2', '01-01-2021_00-00-00_2-of-2'])
+        mock_sleep.assert_called_once_with(1)
+
+        es.mget.side_effect = None
+        es.mget.return_value = {'docs': [{'found': False}, {'found': False}]}
+        with self.assertRaises(Exception):
+            wait_for_partitions(es, '01-01-2021_00-00-00', 2, timeout=0)
+
+
+class TestIndexerMetrics(unittest.TestCase):
+
+    def test_prometheus(self):
+        metrics = IndexerMetrics()
+        metrics.count('indexer_rows_parsed_total', 10, file='census_1845.csv')
+        metrics.count('indexer_rows_parsed_total', 5, file='census_1845.csv')
+        metrics.set('indexer_queue_depth', 2, queue='bulk_requests')
+        metrics.observe('indexer_bulk_request_seconds', 0.3)
+        metrics.observe('indexer_bulk_request_seconds', 100)
+
+        lines = metrics.prometheus().splitlines()
+
+        self.assertIn('# TYPE indexer_rows_parsed_total counter', lines)
+        self.assertIn('indexer_rows_parsed_total{file="census_1845.csv"} 15', lines)
+        self.assertIn('indexer_bulk_retries_total 0', lines)
+        self.assertIn('indexer_queue_depth{queue="bulk_requests"} 2', lines)
+        self.assertIn('indexer_bulk_request_seconds_bucket{le="0.25"} 0', lines)
+        self.assertIn('indexer_bulk_request_seconds_bucket{le="0.5"} 1', lines)
+        self.assertIn('indexer_bulk_request_seconds_bucket{le="+Inf"} 2', lines)
+        self.assertIn('indexer_bulk_request_seconds_count 2', lines)
+
+    def test_write_json_lines(self):
+        metrics = IndexerMetrics()
+        metrics.count('indexer_documents_built_total', 4)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'metrics.jsonl')
+            metrics.write(path)
+            metrics.write(path)
+            with open(path) as f:
+                snapshots = [json.loads(line) for line in f]
+
+        self.assertEqual(len(snapshots), 2)
+        self.assertEqual(snapshots[0]['counters']['indexer_documents_built_total'], 4)
+        self.assertEqual(snapshots[1]['rates']['indexer_documents_built_total'], 0)
+        self.assertIn('indexer_peak_rss_bytes', snapshots[0]['gauges'])
+
+    @patch('builtins.print')
+    def test_run_summary_stage(self, mock_print):
+        summary = RunSummary()
+        with summary.stage('Indexing source data'):
+            METRICS.count('indexer_rows_parsed_total', 7, file='census_1845.csv')
+
+        self.assertEqual(summary.stages[0]['stage'], 'Indexing source data')
+        self.assertEqual(summary.stages[0]['indexer_rows_parsed_total'], 7)
+        summary.report()
+
+    @patch('builtins.print')
+    def test_run_summary_concurrent_stages(self, mock_print):
+        summary = RunSummary()
+
+        def run(name, rows):
+            with summary.stage(name):
+                METRICS.count('indexer_rows_parsed_total', rows, file=name)
+
+        csv_pipelines({}, lambda: run('Indexing sources', 2), lambda: run('Indexing source data', 5), summary=summary, name='Indexing sources and census data')
+
+        stages = {stage['stage']: stage for stage in summary.stages}
+        self.assertEqual(stages['Indexing sources and census data']['indexer_rows_parsed_total'], 7)
+        for name in ('Indexing sources', 'Indexing source data'):
+            self.assertEqual(stages[name]['concurrent'], 'Indexing sources and census data')
+            self.assertNotIn('indexer_rows_parsed_total', stages[name])
+        self.assertIsNone(summary.group)
+        summary.report()
+
+
+class TestBuildCheckpoint(unittest.TestCase):
+
+    def test_save_load(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'checkpoint.json')
+            checkpoint = BuildCheckpoint(path, 'update')
+            checkpoint.finish('Indexing sources')
+            checkpoint.advance(CensusProgress(os.path.join(tmp_dir, 'census_1845.csv'), 120))
+
+            checkpoint = BuildCheckpoint(path, 'update')
+            self.assertTrue(checkpoint.done('Indexing sources'))
+            self.assertFalse(checkpoint.done('Indexing source data'))
+            self.assertEqual(checkpoint.census_offset(Path('census_1845.csv')), 120)
+            self.assertEqual(checkpoint.census_offset(Path('census_1850.csv')), 0)
+
+            with self.assertRaises(Exception):
+                BuildCheckpoint(path, 'assemble')
+
+    def test_disabled(self):
+        checkpoint = BuildCheckpoint(None, 'update')
+        checkpoint.finish('Indexing sources')
+        self.assertFalse(checkpoint.enabled)
+        self.assertTrue(checkpoint.done('Indexing sources'))
+
+
+class TestContentManifest(unittest.TestCase):
+
+    def actions(self, bodies):
+        return [{'_op_type': 'index', '_index': 'pas', '_id': doc_id, '_source': body} for (doc_id, body) in bodies.items()]
+
+    @patch('builtins.print')
+    def test_manifest_delta_actions(self, mock_print):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            previous = ContentManifest(os.path.join(tmp_dir, 'previous.sqlite'))
+            actions = list(manifest_delta_actions('pas', self.actions({1: '{"a":1}', 2: '{"a":2}', 3: '{"a":3}'}), previous))
+            previous.close()
+            self.assertEqual([action['_id'] for action in actions], [1, 2, 3])
+
+            manifest = ContentManifest(os.path.join(tmp_dir, 'manifest.sqlite'), os.path.join(tmp_dir, 'previous.sqlite'))
+            actions = list(manifest_delta_actions('pas', self.actions({1: '{"a":1}', 3: '{"a":4}', 4: '{"a":4}'}), manifest))
+            manifest.close()
+
+            self.assertEqual([(action['_op_type'], action['_id']) for action in actions], [('index', 3), ('index', 4), ('delete', '2')])
+            self.assertEqual(actions[-1]['_index'], 'pas')
+
+    @patch('builtins.print')
+    def test_manifest_delta_actions_routing(self, mock_print):
+        def actions(routings):
+            return [{'_op_type': 'index', '_index': 'links', '_id': doc_id, '_source': '{}', '_routing': routing} for (doc_id, routing) in routings.items()]
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            previous = ContentManifest(os.path.join(tmp_dir, 'previous.sqlite'))
+            list(manifest_delta_actions('links', actions({1: None, 2: '7', 3: '8'}), previous))
+            previous.close()
+
+            manifest = ContentManifest(os.path.join(tmp_dir, 'manifest.sqlite'), os.path.join(tmp_dir, 'previous.sqlite'))
+            delta = list(manifest_delta_actions('links', actions({1: '5', 2: '7'}), manifest))
+            manifest.close()
+
+            self.assertEqual([(action['_op_type'], action['_id'], action['_routing']) for action in delta], [('delete', 1, None), ('index', 1, '5'), ('delete', '3', '8')])
+
+
+class TestDocumentAssembler(unittest.TestCase):
+
+    def setUp(self):
+        self.assembler = DocumentAssembler()
+
+    def tearDown(self):
+        self.assembler.close()
+
+    def add_pa(self, pa, life_courses, links):
+        self.assembler.add_pa(encode_pa(pa.es_document()), life_courses, links)
+
+    def test_documents_grouped_and_ordered(self):
+        self.assembler.add_document('lifecourses', '1')
+        self.assembler.add_document('links', '5', '{"link_id": "5"}')
+        self.add_pa(PersonAppearance(234, 2), ['1'], ['5'])
+        self.add_pa(PersonAppearance(123, 1), ['1'], [])
+
+        [(lc_id, body, pas)] = list(self.assembler.documents('lifecourses'))
+        self.assertEqual(lc_id, '1')
+        self.assertIsNone(body)
+        self.assertEqual([json.loads(pa)['id'] for pa in pas], ['1-123', '2-234'])
+
+        [(link_id, body, pas)] = list(self.assembler.documents('links'))
+        self.assertEqual(link_id, '5')
+        self.assertEqual(body, '{"link_id": "5"}')
+        self.assertEqual([json.loads(pa)['id'] for pa in pas], ['2-234'])
+
+    def test_documents_without_members_and_duplicates(self):
+        self.assembler.add_document('lifecourses', '1')
+        self.assembler.add_document('lifecourses', '2')
+        self.add_pa(PersonAppearance(123, 1), ['1'], [])
+        self.add_pa(PersonAppearance(123, 1), ['1'], [])
+
+        documents = list(self.assembler.documents('lifecourses'))
+        self.assertEqual([(lc_id, len(pas)) for (lc_id, _, pas) in documents], [('1', 1), ('2', 0)])
+
+    def test_documents_embed_profile(self):
+        self.assembler.add_document('lifecourses', '1')
+        self.assembler.add_pa(encode_pa(PersonAppearance(123, 1).es_document(), 'reference'), ['1'], [])
+
+        [(_, _, pas)] = list(self.assembler.documents('lifecourses'))
+        self.assertEqual([json.loads(pa) for pa in pas], [{'id': '1-123', 'pa_id': 123, 'source_id': 1}])
+
+    def test_resumable_file_journaled(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'assembler.sqlite')
+            assembler = DocumentAssembler(path)
+            self.assertEqual(assembler.db.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+            assembler.add_document('lifecourses', '1')
+            assembler.add_pa(encode_pa(PersonAppearance(123, 1).es_document()), ['1'], [])
+            assembler.commit()
+            assembler.close()
+
+            assembler = DocumentAssembler(path)
+            [(_, _, pas)] = list(assembler.documents('lifecourses'))
+            self.assertEqual([json.loads(pa)['id'] for pa in pas], ['1-123'])
+            assembler.close()
+            self.assertTrue(os.path.exists(path))
+        self.assertEqual(self.assembler.db.execute('PRAGMA journal_mode').fetchone()[0], 'off')
+
+
+class TestPersonAppearanceConverter(unittest.TestCase):
+
+    def test_convert_es_document_relation(self):
+        d = {
+            'id': '12345',
+            'id_cph': '67',
+            'gender': 'a',
+            'age_clean': '1.0',
+            'name': 'd',
+            'first_names': 'g,h',
+            'family_names': 'h',
+            'all_possible_patronyms': 'n,o',
+            'hh_id': '2',
+            'transcription_id': '3',
+            'source_year': '1990',
+            'birth_place': '',
+            'dateOfBirth': '1800-01-01',
+            'life_course_id': '7',
+            'first_names_sortable': 'ignored'
+        }
+        converter = PersonAppearanceConverter(list(d.keys()), '4')
+        document = converter.convert(list(d.values()))
+
+        self.assertEqual(document, PersonAppearance.from_dict(dict(d, source_id='4')).es_document())
+        self.assertEqual(list(document.keys()), [key for key in PA_DOCUMENT_KEYS if key in document])
+        self.assertNotIn('birth_place', document)
+
+    def test_convert_schema_types(self):
+        converter = PersonAppearanceConverter(['id', 'ageYears', 'age_clean', 'patronyms', 'hh_id'], '1')
+        document = converter.convert(['123', '3', '4.5', 'a,b', ''])
+
+        self.assertEqual(document, {'id': '1-123', 'pa_id': 123, 'source_id': 1, 'age_clean': 4.5, 'patronyms': ['a', 'b'], 'ageYears': '3', 'last_updated': '2020-11-16'})
+        self.assertEqual(mapping_pa_properties()['ageYears'], {'type': 'integer'})
+        self.assertEqual(set(mapping_pa_properties()), set(PA_DOCUMENT_KEYS))
+
+    def test_convert_short_row(self):
+        converter = PersonAppearanceConverter(['id', 'name', 'hh_id'], '1')
+        document = converter.convert(['123', 'Mads'])
+        self.assertEqual(document['name'], 'Mads')
+        self.assertNotIn('hh_id', document)
+
+    def test_convert_long_row(self):
+        converter = PersonAppearanceConverter(['id', 'name'], '1')
+        with self.assertRaises(ValueError):
+            converter.convert(['123', 'Mads', 'extra'])
+
+    def test_missing_id_column(self):
+        with self.assertRaises(KeyError):
+            PersonAppearanceConverter(['name'], '1')
+
+    def test_key(self):
+        converter = PersonAppearanceConverter(['name', 'id'], '1')
+        self.assertEqual(converter.key(['Mads', '123']), ('123', '1'))
+
+    def test_batch_convert_rows(self):
+        header = ['id', 'id_cph', 'ageYears', 'age_clean', 'first_names', 'patronyms', 'name', 'hh_id', 'unknown']
+        rows = [
+            ['123', '67', '3', '4.5', 'a,b', 'c,d', 'Mads', '2', 'x'],
+            ['124', '', '', '', '', '', '', '', ''],
+            ['125', '68', '3', '4.5', 'a', '', 'Mads'],
+            ['x', '68', '3', '4.5', 'a', '', 'Mads', '', ''],
+            ['126', '69', '3', 'old', 'a', '', 'Mads', '', ''],
+            ['127', '69', '3', '4.5', 'a', '', 'Mads', '', '', 'extra']
+        ]
+        row_converter = PersonAppearanceConverter(header, '4')
+        results = PersonAppearanceBatchConverter(header, '4').convert_rows(rows)
+
+        for (row, result) in zip(rows[:3], results):
+            self.assertEqual(result, (row_converter.key(row), row_converter.convert(row)))
+            self.assertEqual(list(result[1].keys()), list(row_converter.convert(row).keys()))
+        for (row, result) in zip(rows[3:], results[3:]):
+            with self.assertRaises(type(result)) as context:
+                row_converter.convert(row)
+            self.assertEqual(repr(result), repr(context.exception))
+
+    def test_batch_missing_id_column(self):
+        with self.assertRaises(KeyError):
+            PersonAppearanceBatchConverter(['name'], '1')
+
+    def test_gc_paused(self):
+        with gc_paused():
+            with gc_paused():
+                self.assertFalse(gc.isenabled())
+            self.assertFalse(gc.isenabled())
+        self.assertTrue(gc.isenabled())
+
+
+class TestJoinIndex(unittest.TestCase):
+
+    def test_compact_get(self):
+        index = CompactJoinIndex()
+        index.add('123', '1', '10')
+        index.add('123', '1', '5')
+        index.add('123', '1', '10')
+        index.add('123', '2', '7')
+        index.freeze()
+
+        self.assertEqual(index.get(('123', '1')), [5, 10])
+        self.assertEqual(index.get((123, 2)), [7])
+        self.assertEqual(index.get(('124', '1'), []), [])
+        self.assertIn(('123', '2'), index)
+        self.assertEqual(len(index), 2)
+
+    def test_compact_get_many(self):
+        index = CompactJoinIndex()
+        index.add('1', '1', '3')
+        index.add('1', '1', '2')
+        index.add('3', '1', '4')
+        index.freeze()
+
+        self.assertEqual(index.get_many([('3', '1'), ('2', '1'), ('1', '1'), ('9', '9')]), [[4], [], [2, 3], []])
+        self.assertEqual(CompactJoinIndex().get_many([('1', '1')]), [[]])
+
+    def test_sqlite_get_many(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            index = SqliteJoinIndex(os.path.join(tmp_dir, 'index.sqlite'))
+            index.add('1', '1', '3')
+            index.add('1', '1', '2')
+            index.add('1', '1', '2')
+            index.add('3', '1', '4')
+            index.freeze()
+
+            self.assertEqual(index.get_many([('3', '1'), ('2', '1'), ('1', '1')]), [[4], [], [2, 3]])
+            self.assertEqual(index.get(('2', '1'), []), [])
+            index.close()
+
+            # the map of an interrupted run is not reused
+            index = SqliteJoinIndex(os.path.join(tmp_dir, 'index.sqlite'))
+            index.freeze()
+            self.assertEqual(index.get_many([('1', '1')]), [[]])
+            index.close()
+
+    def test_compact_freeze_twice(self):
+        index = CompactJoinIndex()
+        index.add('1', '1', '1')
+        index.freeze()
+        index.add('1', '1', '2')
+        index.add('2', '1', '3')
+        index.freeze()
+
+        self.assertEqual(index.get(('1', '1')), [1, 2])
+        self.assertEqual(index.get(('2', '1')), [3])
+
+    def test_compact_pa_id_out_of_range(self):
+        with self.assertRaises(ValueError):
+            CompactJoinIndex().add(2**32, '1', '1')
+
+    def test_dict_add(self):
+        index = DictJoinIndex()
+        index.add('123', '1', '10')
+        index.add('123', '1', '10')
+        self.assertEqual(index.get(('123', '1')), {'10'})
+
+
 class TestCsvFileHelpers(unittest.TestCase):
 
+    def setUp(self):
+        source = Source('1845')
+        source.filename = 'census_1845'
+        source_1850 = Source('1850')
+        source_1850.filename = 'census_1850'
+        self.sources = {'1845': source, '1850': source_1850}
+
+    def mock_csv(self, name, data):
+        csv_file = MagicMock()
+        csv_file.name = name
+        csv_file.open = unittest.mock.mock_open(read_data=data)
+        return csv_file
+
     @patch('builtins.print')
     def test_csv_read_pas_single_csv_no_life_courses_no_links(self, mock_print):
-        csv1 = MagicMock()
-        csv1.open = unittest.mock.mock_open(read_data="id$source_year$name\n123$1845$Mads")
+        csv1 = self.mock_csv('census_1845.csv', "id$source_year$name\n123$1845$Mads")
         
-        iterator = csv_read_pas([csv1], {}, {})
+        iterator = csv_read_pas(self.sources, [csv1], {}, {})
 
         (pa, [], []) = next(iterator)
-        self.assertEqual(pa.pa_id, '123')
-        self.assertEqual(pa.source_year, '1845')
-        self.assertEqual(pa.name, 'Mads')
-        self.assertIsNone(pa.birth_place)
+        self.assertEqual(pa['id'], '1845-123')
+        self.assertEqual(pa['pa_id'], 123)
+        self.assertEqual(pa['source_year'], 1845)
+        self.assertEqual(pa['name'], 'Mads')
+        self.assertNotIn('birth_place', pa)
 
         with self.assertRaises(StopIteration):
             next(iterator)
         
 
     @patch('builtins.print')
-    def test_csv_read_pas_empty_values_none(self, mock_print):
-        csv1 = MagicMock()
-        csv1.open = unittest.mock.mock_open(read_data="id$source_year$birth_place$name\n123$1845$landsbylille$")
+    def test_csv_read_pas_empty_values_omitted(self, mock_print):
+        csv1 = self.mock_csv('census_1845.csv', "id$source_year$birth_place$name\n123$1845$landsbylille$")
 
-        (pa, _, _) = next(csv_read_pas([csv1], {}, {}))
+        (pa, _, _) = next(csv_read_pas(self.sources, [csv1], {}, {}))
 
-        self.assertIsNone(pa.name)
+        self.assertNotIn('name', pa)
     
     @patch('builtins.print')
     def test_csv_read_pas_multi_csv(self, mock_print):
-        csv1 = MagicMock()
-        csv1.open = unittest.mock.mock_open(read_data="id$source_year$birth_place\n123$1845$landsbylille")
-        csv2 = MagicMock()
-        csv2.open = unittest.mock.mock_open(read_data="id$source_year$first_names\n234$1850$lars ole")
+        csv1 = self.mock_csv('census_1845.csv', "id$source_year$birth_place\n123$1845$landsbylille")
+        csv2 = self.mock_csv('census_1850.csv', "id$source_year$first_names\n234$1850$lars ole")
 
         pa_life_courses = {
             ('123', '1845'): [2]
@@ -387,21 +1282,21 @@ class TestCsvFileHelpers(unittest.TestCase):
             ('123', '1845'): [2, 3]
         }
 
-        iterator = csv_read_pas([csv1, csv2], pa_life_courses, pa_links)
+        iterator = csv_read_pas(self.sources, [csv1, csv2], pa_life_courses, pa_links)
 
         (pa, lcs, lis) = next(iterator)
-        self.assertEqual(pa.pa_id, '123')
-        self.assertEqual(pa.source_year, '1845')
-        self.assertIsNone(pa.first_names)
-        self.assertEqual(pa.birth_place, 'landsbylille')
+        self.assertEqual(pa['pa_id'], 123)
+        self.assertEqual(pa['source_year'], 1845)
+        self.assertNotIn('first_names', pa)
+        self.assertEqual(pa['birth_place'], 'landsbylille')
         self.assertListEqual(lcs, [2])
         self.assertListEqual(lis, [2, 3])
 
         (pa, lcs, lis) = next(iterator)
-        self.assertEqual(pa.pa_id, '234')
-        self.assertEqual(pa.source_year, '1850')
-        self.assertEqual(pa.first_names, 'lars ole')
-        self.assertIsNone(pa.birth_place)
+        self.assertEqual(pa['pa_id'], 234)
+        self.assertEqual(pa['source_year'], 1850)
+        self.assertEqual(pa['first_names'], ['lars ole'])
+        self.assertNotIn('birth_place', pa)
         self.assertListEqual(lcs, [])
         self.assertListEqual(lis, [1])
 
@@ -410,21 +1305,357 @@ class TestCsvFileHelpers(unittest.TestCase):
     
     @patch('builtins.print')
     def test_csv_read_pas_print(self, mock_print):
-        csv1 = MagicMock()
+        csv1 = self.mock_csv('census_1845.csv', "id$source_year$birth_place\n123$1845$landsbylille")
         csv1.__str__ = MagicMock(return_value='mock csv name')
-        csv1.open = unittest.mock.mock_open(read_data="id$source_year$birth_place\n123$1845$landsbylille")
-        next(csv_read_pas([csv1], {}, {}))
+        next(csv_read_pas(self.sources, [csv1], {}, {}))
         mock_print.assert_called_with(' => -> Indexing census data from mock csv name')
     
     @patch('builtins.print')
     def test_csv_read_pas_print_error(self, mock_print):
-        csv1 = MagicMock()
+        csv1 = self.mock_csv('census_1845.csv', "value\nnothing")
         csv1.__str__ = MagicMock(return_value='mock csv name')
-        csv1.open = unittest.mock.mock_open(read_data="value\nnothing")
         with self.assertRaises(StopIteration):
-            next(csv_read_pas([csv1], {}, {}))
+            next(csv_read_pas(self.sources, [csv1], {}, {}))
         self.assertEqual(mock_print.call_count, 2)
-        mock_print.assert_has_calls([call(' => -> Indexing census data from mock csv name'), call(' => -> Error: KeyError(\'id\') line=2 file=mock csv name')])
+        mock_print.assert_has_calls([call(' => -> Indexing census data from mock csv name'), call(' => -> Error: KeyError(\'id\') file=mock csv name')])
+
+    @patch('builtins.print')
+    def test_csv_read_pas_print_row_error(self, mock_print):
+        csv1 = self.mock_csv('census_1845.csv', "id$hh_id\n123$x\n124$2")
+        csv1.__str__ = MagicMock(return_value='mock csv name')
+        (pa, _, _) = next(csv_read_pas(self.sources, [csv1], {}, {}))
+        self.assertEqual(pa['pa_id'], 124)
+        mock_print.assert_has_calls([call(' => -> Error: ValueError("invalid literal for int() with base 10: \'x\'") line=2 file=mock csv name')])
+
+    def test_read_csv_rows(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / 'census_1845.csv'
+            path.write_bytes("id$name\r\n1$æ\r\n\n2$$\n3$c".encode('utf-8'))
+
+            self.assertEqual(list(read_csv_rows(path)), [['id', 'name'], ['1', 'æ'], [], ['2', '', ''], ['3', 'c']])
+            self.assertEqual(list(read_csv_rows(path, start=9, end=14)), [['1', 'æ']])
+            self.assertEqual(list(read_csv(path)), [{'id': '1', 'name': 'æ'}, {'id': '2', 'name': None}, {'id': '3', 'name': 'c'}])
+
+    def test_csv_has_quotes(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / 'census_1845.csv'
+            path.write_text('id$name\n1$"a$b"\n')
+            self.assertTrue(csv_has_quotes(path))
+            path.write_text('id$name\n1$a\n')
+            self.assertFalse(csv_has_quotes(path))
+            path.write_text('')
+            self.assertFalse(csv_has_quotes(path))
+
+    @patch('builtins.print')
+    def test_csv_read_pas_fast_reader(self, mock_print):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / 'census_1845.csv'
+            path.write_text("id$name$first_names$hh_id\n1$Bo$bo,ole$2\n\n2$Mads$$x\n3$Ole$ole$\n")
+
+            fast = list(csv_read_pas(self.sources, [path], {}, {}, fast_csv='always'))
+            self.assertEqual(fast, list(csv_read_pas(self.sources, [path], {}, {}, fast_csv='never')))
+            self.assertEqual([pa['pa_id'] for (pa, _, _) in fast], [1, 3])
+            mock_print.assert_any_call(' => -> Error: ValueError("invalid literal for int() with base 10: \'x\'") line=4 file=' + str(path))
+
+    def test_split_byte_ranges(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / 'census_1845.csv'
+            path.write_bytes(b"id$name\n1$a\n22$bb\n333$ccc\n")
+
+            ranges = split_byte_ranges(path, 8, range_bytes=3)
+            self.assertEqual(ranges, [(8, 12), (12, 18), (18, 26)])
+            self.assertEqual(split_byte_ranges(path, 8, range_bytes=100), [(8, 26)])
+
+    @patch('builtins.print')
+    def test_split_quoted_values(self, mock_print):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            csv_dir = Path(tmp_dir)
+            path = csv_dir / 'census_1845.csv'
+            path.write_bytes(b'id$name$name_clean\n1$"Hans\nJensen"$hans jensen\n2$Bo$bo\n')
+
+            self.assertEqual(split_byte_ranges(path, 19, range_bytes=3, quoted=True), [(19, 47), (47, 55)])
+
+            # a range of the unquoted split would end within the name
+            checkpoint = BuildCheckpoint(os.path.join(tmp_dir, 'checkpoint.json'), 'update')
+            with patch('index.RANGE_BYTES', 3):
+                items = list(csv_census_pas(self.sources, csv_dir, {}, {}, checkpoint=checkpoint))
+            pas = [json.loads(pa.json) for (pa, _, _) in (item for item in items if not isinstance(item, CensusProgress))]
+            self.assertEqual([(pa['name'], pa['name_clean']) for pa in pas], [('Hans\nJensen', 'hans jensen'), ('Bo', 'bo')])
+            self.assertEqual([item.offset for item in items if isinstance(item, CensusProgress)], [47, 55])
+
+    @patch('builtins.print')
+    def test_csv_read_pas_parallel(self, mock_print):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / 'census_1845.csv'
+            path.write_text("id$name$hh_id\n" + "".join(f"{i}$name {i}${i}\n" for i in range(100)))
+
+            pa_links = {('5', '1845'): ['7']}
+            with patch('index.RANGE_BYTES', 64):
+                pas = list(csv_read_pas_parallel(self.sources, [path], {}, pa_links, 2))
+
+            self.assertEqual([pa.pa_id for (pa, _, _) in pas], list(range(100)))
+            self.assertEqual(json.loads(pas[3][0].json)['name'], 'name 3')
+            self.assertEqual(pas[5][2], ['7'])
+            self.assertEqual(pas[6][2], [])
+
+    @patch('builtins.print')
+    def test_csv_read_pas_parallel_checkpoint(self, mock_print):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / 'census_1845.csv'
+            path.write_text("id$name\n" + "".join(f"{i}$name {i}\n" for i in range(10)))
+            checkpoint = BuildCheckpoint(os.path.join(tmp_dir, 'checkpoint.json'), 'update')
+
+            with patch('index.RANGE_BYTES', 20):
+                items = list(csv_read_pas_parallel(self.sources, [path], {}, {}, 1, checkpoint=checkpoint))
+            progress = [item for item in items if isinstance(item, CensusProgress)]
+            self.assertEqual(progress[-1], CensusProgress(str(path), path.stat().st_size))
+
+            checkpoint.advance(progress[1])
+            with patch('index.RANGE_BYTES', 20):
+                resumed = list(csv_read_pas_parallel(self.sources, [path], {}, {}, 1, checkpoint=checkpoint))
+            done = items[:items.index(progress[1]) + 1]
+            pa_ids = [item[0].pa_id for item in done + resumed if not isinstance(item, CensusProgress)]
+            self.assertEqual(pa_ids, list(range(10)))
+
+    @patch('builtins.print')
+    def test_csv_read_links_life_courses_stream(self, mock_print):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            csv_dir = Path(tmp_dir)
+            (csv_dir / 'life_courses.csv').write_text("$sources$pa_ids$occurences\n10$1845,1850$100,200$2\n11$1845$101$1\n")
+            (csv_dir / 'links.csv').write_text("link_id$method_id$pa_id1$source_id1$pa_id2$source_id2$score\n7$0$100$1845$200$1850$0.9\n")
+
+            pa_life_courses = DictJoinIndex()
+            life_courses = csv_read_life_courses(csv_dir, pa_life_courses)
+            (life_course_id, row) = next(life_courses)
+            self.assertEqual((life_course_id, row['pa_ids']), ('10', '100,200'))
+            self.assertEqual(pa_life_courses, {('100', '1845'): {'10'}, ('200', '1850'): {'10'}})
+            self.assertEqual([life_course_id for (life_course_id, _) in life_courses], ['11'])
+
+            pa_links = DictJoinIndex()
+            [(link_id, link)] = list(csv_read_links(csv_dir, self.sources, pa_links))
+            self.assertEqual((link_id, link['score']), ('7', '0.9'))
+            self.assertIn('method_type', link)
+            self.assertEqual(pa_links, {('100', '1845'): {'7'}, ('200', '1850'): {'7'}})
+
+    @patch('builtins.print')
+    def test_columnar_cache(self, mock_print):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / 'census_1845.csv'
+            path.write_text("id$pa_id$hh_id$age_clean$name\n1$007$2$25.0$Bo\n2$8$$31$\n")
+            cache_dir = Path(tmp_dir) / 'cache'
+
+            cache_path = columnar_cache(path, cache_dir)
+            schema = parquet.read_schema(str(cache_path))
+            self.assertEqual([str(field.type) for field in schema], ['int64', 'string', 'int64', 'double', 'string'])
+            self.assertEqual(parquet.read_table(str(cache_path)).column('name').to_pylist(), ['Bo', None])
+
+            with patch('index.convert_columnar') as convert:
+                os.utime(path, ns=(0, 0))
+                self.assertEqual(columnar_cache(path, cache_dir), cache_path)
+                self.assertEqual(columnar_cache(path, cache_dir), cache_path)
+                convert.assert_not_called()
+            mock_print.assert_any_call(f' => -> {path} is unchanged since it was converted')
+
+            path.write_text("id$pa_id$hh_id$age_clean$name\n1$7$x$25.0$Bo\n")
+            columnar_cache(path, cache_dir)
+            self.assertEqual([str(field.type) for field in parquet.read_schema(str(cache_path))], ['int64', 'int64', 'string', 'double', 'string'])
+
+    @patch('builtins.print')
+    def test_csv_read_pas_columnar_cache(self, mock_print):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            csv_dir = Path(tmp_dir) / 'csv'
+            csv_dir.mkdir()
+            path = csv_dir / 'census_1845.csv'
+            path.write_text("id$name$first_names$hh_id$age_clean$id_cph\n" + "".join(f"{i}$name {i}$bo,ole${i}${i}.5${i}\n" for i in range(20)) + "20$$$x$$\n")
+            cache_dir = Path(tmp_dir) / 'cache'
+            pa_links = {('5', '1845'): ['7']}
+
+            pas = list(csv_census_pas(self.sources, csv_dir, {}, pa_links))
+            self.assertEqual(list(csv_census_pas(self.sources, csv_dir, {}, pa_links, cache_dir=cache_dir)), pas)
+            self.assertEqual(len(pas), 20)
+            self.assertTrue((cache_dir / 'census_1845.parquet').exists())
+
+            checkpoint = BuildCheckpoint(os.path.join(tmp_dir, 'checkpoint.json'), 'update')
+            with patch('index.COLUMNAR_ROW_GROUP_ROWS', 8):
+                (cache_dir / 'census_1845.json').unlink()
+                items = list(csv_census_pas(self.sources, csv_dir, {}, pa_links, checkpoint=checkpoint, cache_dir=cache_dir))
+            progress = [item for item in items if isinstance(item, CensusProgress)]
+            self.assertEqual(progress, [CensusProgress(str(cache_dir / 'census_1845.parquet'), end) for end in (8, 16, 21)])
+            encoded = [item for item in items if not isinstance(item, CensusProgress)]
+            self.assertEqual([json.loads(pa.json) for (pa, _, _) in encoded], [pa for (pa, _, _) in pas])
+            self.assertEqual(encoded[5][2], ['7'])
+
+            checkpoint.advance(progress[0])
+            resumed = list(csv_census_pas(self.sources, csv_dir, {}, pa_links, checkpoint=checkpoint, cache_dir=cache_dir))
+            self.assertEqual([item[0].pa_id for item in resumed if not isinstance(item, CensusProgress)], list(range(8, 20)))
+
+    @patch('builtins.print')
+    def test_csv_read_links_life_courses_columnar_cache(self, mock_print):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            csv_dir = Path(tmp_dir)
+            (csv_dir / 'life_courses.csv').write_text("$sources$pa_ids$occurences\n10$1845,1850$100,200$2\n11$1845$101$\n")
+            (csv_dir / 'links.csv').write_text("link_id$method_id$pa_id1$source_id1$pa_id2$source_id2$score\n7$0$100$1845$200$1850$0.90\n")
+            cache_dir = csv_dir / 'cache'
+
+            self.assertEqual(list(csv_read_life_courses(csv_dir, DictJoinIndex(), cache_dir)), list(csv_read_life_courses(csv_dir, DictJoinIndex())))
+            self.assertEqual(list(csv_read_links(csv_dir, self.sources, DictJoinIndex(), cache_dir)), list(csv_read_links(csv_dir, self.sources, DictJoinIndex())))
+            self.assertEqual(json.loads((cache_dir / 'life_courses.json').read_text())['typed'], ['', 'occurences'])
+            self.assertEqual(json.loads((cache_dir / 'links.json').read_text())['typed'], ['link_id', 'method_id', 'pa_id1', 'source_id1', 'pa_id2', 'source_id2'])
+
+
+class TestSyntheticDataset(unittest.TestCase):
+
+    @patch('builtins.print')
+    def test_generate_dataset_consistent(self, mock_print):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            csv_dir = Path(tmp_dir)
+            counts = generate_dataset(csv_dir, pas_per_source=50, census_sources=3, link_density=0.5, seed=1)
+            self.assertEqual((counts['sources'], counts['pas']), (4, 200))
+
+            sources = csv_load_sources(csv_dir)
+            pa_life_courses = DictJoinIndex()
+            pa_links = DictJoinIndex()
+            life_courses = dict(csv_read_life_courses(csv_dir, pa_life_courses))
+            links = dict(csv_read_links(csv_dir, sources, pa_links))
+            self.assertEqual((len(life_courses), len(links)), (counts['life_courses'], counts['links']))
+            self.assertGreaterEqual(len(pa_life_courses), 100)
+
+            pas = list(csv_census_pas(sources, csv_dir, pa_life_courses, pa_links))
+            self.assertEqual(len(pas), 200)
+            self.assertEqual(sum(1 for (_, life_course_ids, _) in pas if life_course_ids), len(pa_life_courses))
+            self.assertEqual(sum(len(link_ids) for (_, _, link_ids) in pas), 2 * len(links))
+
+    @patch('builtins.print')
+    def test_census_pas_disk_join_index(self, mock_print):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            csv_dir = Path(tmp_dir) / 'csv'
+            generate_dataset(csv_dir, pas_per_source=50, census_sources=3, link_density=0.5, seed=1)
+            sources = csv_load_sources(csv_dir)
+
+            def joined(join_indices, **args):
+                (pa_life_courses, pa_links) = join_indices
+                deque(csv_read_life_courses(csv_dir, pa_life_courses), maxlen=0)
+                deque(csv_read_links(csv_dir, sources, pa_links), maxlen=0)
+                pa_life_courses.freeze()
+                pa_links.freeze()
+                pas = csv_census_pas(sources, csv_dir, pa_life_courses, pa_links, **args)
+                return sorted((json.loads(pa.json)['id'] if hasattr(pa, 'json') else pa['id'], sorted(int(lc) for lc in life_course_ids), sorted(int(li) for li in link_ids))
+                              for (pa, life_course_ids, link_ids) in (item for item in pas if not isinstance(item, CensusProgress)))
+
+            expected = joined((DictJoinIndex(), DictJoinIndex()))
+            self.assertTrue(any(life_course_ids for (_, life_course_ids, _) in expected))
+            self.assertTrue(any(link_ids for (_, _, link_ids) in expected))
+
+            def disk(name):
+                return (SqliteJoinIndex(os.path.join(tmp_dir, f'{name}-lcs.sqlite')), SqliteJoinIndex(os.path.join(tmp_dir, f'{name}-links.sqlite')))
+
+            # the workers open the join indices of the parent for lookups
+            self.assertEqual(joined(disk('workers'), workers=2), expected)
+            checkpoint = BuildCheckpoint(os.path.join(tmp_dir, 'checkpoint.json'), 'update')
+            self.assertEqual(joined(disk('checkpoint'), checkpoint=checkpoint), expected)
+
+    @patch('builtins.print')
+    def test_concurrent_pipelines(self, mock_print):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            csv_dir = Path(tmp_dir) / 'csv'
+            generate_dataset(csv_dir, pas_per_source=50, census_sources=3, link_density=0.5, seed=1)
+
+            for build_mode in BUILD_MODES:
+                documents = []
+                for pipelines in (None, {'sources': 1, 'pas': 2, 'links': 1, 'lifecourses': 1}):
+                    bulk_dir = Path(tmp_dir) / f'{build_mode}-{pipelines is not None}'
+                    sink = NdjsonBulkFileSink(bulk_dir)
+                    csv_index(sink, str(csv_dir), build_mode=build_mode, work_dir=tmp_dir, pipelines=pipelines)
+                    documents.append(sorted(lines for path in sorted(bulk_dir.iterdir()) for lines in read_bulk_file(path)))
+                self.assertEqual(documents[0], documents[1])
+
+    def test_csv_pipelines_error(self):
+        ran = []
+
+        def fail():
+            raise ValueError('failed')
+
+        with self.assertRaises(ValueError):
+            csv_pipelines({}, fail, lambda: ran.append('last'))
+        self.assertEqual(ran, ['last'])
+
+        with self.assertRaises(ValueError):
+            csv_pipelines(None, fail, lambda: ran.append('after'))
+        self.assertEqual(ran, ['last'])
+
+    @patch('builtins.print')
+    def test_partitions(self, mock_print):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            csv_dir = Path(tmp_dir) / 'csv'
+            generate_dataset(csv_dir, pas_per_source=50, census_sources=3, link_density=0.5, seed=1)
+
+            def documents(name, partition=None):
+                bulk_dir = Path(tmp_dir) / name
+                csv_index(NdjsonBulkFileSink(bulk_dir), str(csv_dir), build_mode='assemble', work_dir=tmp_dir, partition=partition)
+                return [lines for path in sorted(bulk_dir.iterdir()) for lines in read_bulk_file(path)]
+
+            partitions = [documents(f'partition-{i}', Partition(i, 3)) for i in range(3)]
+            self.assertTrue(all(partitions))
+            self.assertEqual(sorted(lines for partition in partitions for lines in partition), sorted(documents('all')))
+
+            with self.assertRaises(Exception):
+                csv_index(NullSink(), str(csv_dir), build_mode='update', work_dir=tmp_dir, partition=Partition(0, 2))
+
+    @patch('builtins.print')
+    def test_partition_census_pas(self, mock_print):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            csv_dir = Path(tmp_dir) / 'csv'
+            generate_dataset(csv_dir, pas_per_source=50, census_sources=3, link_density=0.5, seed=1)
+            sources = csv_load_sources(csv_dir)
+            (pa_life_courses, pa_links) = (DictJoinIndex(), DictJoinIndex())
+            deque(csv_read_life_courses(csv_dir, pa_life_courses), maxlen=0)
+            deque(csv_read_links(csv_dir, sources, pa_links), maxlen=0)
+            pa_life_courses.freeze()
+            pa_links.freeze()
+
+            def pa_ids(**args):
+                pas = csv_census_pas(sources, csv_dir, pa_life_courses, pa_links, **args)
+                return sorted(pa.id if hasattr(pa, 'id') else pa['id'] for (pa, _, _) in (item for item in pas if not isinstance(item, CensusProgress)))
+
+            every = pa_ids()
+            partitions = [Partition(i, 3) for i in range(3)]
+            needed = [pa_ids(partition=partition) for partition in partitions]
+            # each partition skips the person appearances of the others
+            self.assertTrue(all(len(ids) < len(every) for ids in needed))
+            self.assertEqual(sorted(set(pa_id for ids in needed for pa_id in ids)), every)
+            # the census workers skip them too
+            checkpoint = BuildCheckpoint(os.path.join(tmp_dir, 'checkpoint.json'), 'assemble')
+            self.assertEqual(pa_ids(partition=partitions[1], workers=2), needed[1])
+            self.assertEqual(pa_ids(partition=partitions[1], checkpoint=checkpoint), needed[1])
+
+    def test_generate_dataset_seeded(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            generate_dataset(Path(tmp_dir) / 'a', pas_per_source=20, seed=3)
+            generate_dataset(Path(tmp_dir) / 'b', pas_per_source=20, seed=3)
+            for name in ('census_1845.csv', 'life_courses.csv', 'links.csv'):
+                self.assertEqual((Path(tmp_dir) / 'a' / name).read_text(), (Path(tmp_dir) / 'b' / name).read_text())
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_compare_results(self):
+        baseline = [{'scale': 10, 'stage': 'bulk', 'stage_seconds': 1.0, 'peak_rss_mb': 100}]
+        self.assertEqual(compare_results([{'scale': 10, 'stage': 'bulk', 'stage_seconds': 1.2, 'peak_rss_mb': 100}], baseline), [])
+        self.assertEqual(compare_results([{'scale': 20, 'stage': 'bulk', 'stage_seconds': 9.0, 'peak_rss_mb': 900}], baseline), [])
+        [regression] = compare_results([{'scale': 10, 'stage': 'bulk', 'stage_seconds': 1.0, 'peak_rss_mb': 200}], baseline)
+        self.assertIn('peak_rss_mb', regression)
+
+    def test_stub_bulk_endpoint(self):
+        handler = StubBulkHandler.__new__(StubBulkHandler)
+        body = b'{"index":{"_index":"pas","_id":"1"}}\n{"a":1}\n{"delete":{"_index":"pas","_id":"2"}}\n{"update":{"_index":"links","_id":"3"}}\n{"script":{}}\n'
+        handler.path = '/_bulk'
+        handler.headers = {'Content-Length': str(len(body))}
+        handler.rfile = MagicMock(read=MagicMock(return_value=body))
+        handler.respond = MagicMock()
+        handler.do_POST()
+        items = handler.respond.call_args[0][0]['items']
+        self.assertEqual([next(iter(item)) for item in items], ['index', 'delete', 'update'])
+        self.assertEqual([item[next(iter(item))]['_id'] for item in items], ['1', '2', '3'])
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file